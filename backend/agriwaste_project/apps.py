@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class AgriwasteProjectConfig(AppConfig):
+    name = 'agriwaste_project'
+    verbose_name = 'AgriWaste project'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -2,6 +2,11 @@
 ASGI config for agriwaste_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``python manage.py runasgi`` or any other ASGI server, e.g.
+``uvicorn agriwaste_project.asgi:application``.
+
+Requests are resolved against ``settings.ASGI_ROOT_URLCONF``, the URL
+configuration with async read views (see ``agriwaste_project.asynchronous``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -9,8 +14,19 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'agriwaste_project.settings')
 
-application = get_asgi_application()
+
+class AsyncReadsASGIHandler(ASGIHandler):
+    async def get_response_async(self, request):
+        request.urlconf = settings.ASGI_ROOT_URLCONF
+        return await super().get_response_async(request)
+
+
+# What get_asgi_application() does, with the handler above
+django.setup(set_prefix=False)
+application = AsyncReadsASGIHandler()
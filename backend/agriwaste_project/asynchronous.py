@@ -0,0 +1,208 @@
+"""
+Async read path for DRF viewsets under ASGI.
+
+DRF dispatches every request synchronously, so under ASGI each request
+holds the single thread that sync views run in for as long as its queries
+take. A viewset that mixes in `AsyncReadMixin` and names actions in
+`async_actions` has GET requests for those actions served by coroutines
+(`alist`, `aretrieve`, `a<action>`) that use the async ORM. All other
+requests go to the regular sync view, including writes, the browsable API
+and actions without an async counterpart.
+
+`async_urlpatterns()` puts the async views into a URL configuration.
+`agriwaste_project.urls_async` is the project URL configuration with it
+applied, and `asgi.py` selects it. WSGI keeps the plain configuration,
+where an async view would only add an event loop to every request.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse
+from django.urls import URLPattern, URLResolver
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+# Renderers that need nothing from the database; the browsable API builds forms that do
+ASYNC_FORMATS = ('json', 'msgpack')
+
+
+class AsyncReadMixin:
+    """
+    Async counterparts of `list`, `retrieve` and `get_object` for generic
+    viewsets. Custom list actions use `alist_response()` the way sync ones
+    use `list_response()`.
+    """
+    async_actions = ()
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.arender_list(self.filter_queryset(self.get_queryset()))
+
+    async def alist_response(self, queryset):
+        return await self.arender_list(queryset)
+
+    async def arender_list(self, queryset):
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer([obj async for obj in queryset], many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        if not hasattr(self.paginator, 'apaginate_queryset'):
+            return await sync_to_async(self.paginator.paginate_queryset)(queryset, self.request, view=self)
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """
+    `PageNumberPagination` with an async `apaginate_queryset()`.
+    """
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached property, so validate_number() uses this
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        # The same bounds as Paginator.page()
+        bottom = (number - 1) * paginator.per_page
+        top = bottom + paginator.per_page
+        if top + paginator.orphans >= paginator.count:
+            top = paginator.count
+        self.page = paginator._get_page([obj async for obj in queryset[bottom:top]], number, paginator)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+
+async def aauthenticate(request):
+    """
+    Resolve `request.user` for a DRF request. Token and session lookups may
+    query the database, so they run in a thread; anonymous requests are
+    resolved on the event loop.
+    """
+    django_request = request._request
+    if 'HTTP_AUTHORIZATION' in django_request.META or settings.SESSION_COOKIE_NAME in django_request.COOKIES:
+        await sync_to_async(getattr)(request, 'user')
+    return request.user
+
+
+def async_viewset_view(view):
+    """
+    Wrap a view returned by `ViewSet.as_view()` so GET and HEAD requests for
+    the viewset's `async_actions` are handled by its `a<action>` coroutines.
+    """
+    viewset_class, actions, initkwargs = view.cls, view.actions, view.initkwargs
+    sync_view = sync_to_async(view)
+
+    @csrf_exempt
+    async def async_view(request, *args, **kwargs):
+        method = request.method.lower()
+        action = actions.get('get') if method in ('get', 'head') else None
+        if action not in viewset_class.async_actions:
+            return await sync_view(request, *args, **kwargs)
+
+        # The same steps as ViewSetMixin.as_view() and APIView.dispatch()
+        self = viewset_class(**initkwargs)
+        self.action_map = {**actions, method: action}
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            renderer, _ = self.perform_content_negotiation(request)
+            if renderer.format not in ASYNC_FORMATS:
+                return await sync_view(request._request, *args, **kwargs)
+            await aauthenticate(request)
+            self.initial(request, *args, **kwargs)
+            response = await getattr(self, f'a{action}')(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        response = self.finalize_response(request, response, *args, **kwargs)
+        return rendered(response)
+
+    async_view.cls = viewset_class
+    async_view.actions = actions
+    async_view.initkwargs = initkwargs
+    return async_view
+
+
+def rendered(response):
+    """
+    Render a DRF response into a plain `HttpResponse`. The ASGI handler
+    renders template responses in a thread, even already rendered ones.
+    """
+    if not isinstance(response, Response):
+        return response
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code, headers=response.headers)
+    plain.cookies = response.cookies
+    return plain
+
+
+def serves_async(view):
+    """
+    Whether `view` is a viewset view whose GET action has an async counterpart.
+    """
+    actions = getattr(view, 'actions', None)
+    if not actions or not hasattr(view, 'cls'):
+        return False
+    return actions.get('get') in getattr(view.cls, 'async_actions', ())
+
+
+def async_urlpatterns(urlpatterns):
+    """
+    Copy `urlpatterns`, replacing the views of viewsets that have
+    `async_actions` with `async_viewset_view()`. Included URL configurations
+    are copied too; the originals are left untouched.
+    """
+    patterns = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern,
+                async_urlpatterns(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace,
+            )
+        elif isinstance(pattern, URLPattern) and serves_async(pattern.callback):
+            pattern = URLPattern(
+                pattern.pattern, async_viewset_view(pattern.callback), pattern.default_args, pattern.name
+            )
+        patterns.append(pattern)
+    return patterns
@@ -0,0 +1,78 @@
+"""
+Cache settings built from environment variables.
+
+Several features keep state in the default cache that every process must
+see: the catalog and listing version counters (`waste_catalog.cache`,
+`marketplace.facets`), the message counters (`marketplace.counters`), the
+replica pin (`ReplicaRoutingMiddleware`) and the message archive horizon
+(`marketplace.archive`). With a process-local cache, the default when
+nothing is configured, a worker keeps serving what it cached after another
+worker or a management command wrote, so production needs a shared backend:
+
+- `CACHE_BACKEND`: `locmem` (default), `redis`, `memcached`, `file` or `database`
+- `CACHE_LOCATION`: server URLs (comma separated), directory or table name,
+  defaulting to a local server, `var/cache/` and `agriwaste_cache`
+
+Redis needs `redis`, memcached needs `pymemcache`, and the database backend
+needs `python manage.py createcachetable`. The file backend is only shared
+between processes on one host.
+
+`require_shared_cache()` makes the settings refuse a process-local default
+cache when DEBUG is off.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'database': 'django.core.cache.backends.db.DatabaseCache',
+}
+
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def cache_settings(base_dir, environ=os.environ):
+    backend = environ.get('CACHE_BACKEND', 'locmem').strip().lower()
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(f'Unsupported CACHE_BACKEND "{backend}"')
+    location = environ.get('CACHE_LOCATION', '').strip()
+    if backend == 'redis':
+        location = [entry.strip() for entry in (location or 'redis://127.0.0.1:6379/1').split(',')]
+    elif backend == 'memcached':
+        location = [entry.strip() for entry in (location or '127.0.0.1:11211').split(',')]
+    elif backend == 'file':
+        location = location or str(base_dir / 'var' / 'cache')
+    elif backend == 'database':
+        location = location or 'agriwaste_cache'
+    cache = {'BACKEND': BACKENDS[backend]}
+    if location:
+        cache['LOCATION'] = location
+    return cache
+
+
+def is_shared(cache):
+    """
+    Whether every process using the `CACHES` entry sees the same data.
+    """
+    return cache['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def require_shared_cache(caches, debug):
+    if not debug and not is_shared(caches['default']):
+        raise ImproperlyConfigured(
+            f"The default cache ({caches['default']['BACKEND']}) is local to each process, so workers "
+            "would serve stale data. Set CACHE_BACKEND, see agriwaste_project/cache.py"
+        )
+
+
+def default_cache_is_shared():
+    from django.conf import settings
+
+    return is_shared(settings.CACHES['default'])
@@ -0,0 +1,125 @@
+"""
+Response compression for `CompressionMiddleware`.
+
+Encoders for gzip and, when the `brotli` package is installed, brotli, in
+one-shot and streaming form, plus per-endpoint counters of the bytes each
+one saved. Counters are per process and are exposed to staff at
+`/api/stats/compression/`.
+"""
+import gzip
+import re
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+_REFUSED = re.compile(r';\s*q=0(\.0*)?\s*$')
+
+
+def accepted_encodings(request):
+    """
+    Content codings the client accepts, ignoring any sent with `q=0`.
+    """
+    return {
+        part.split(';')[0].strip().lower()
+        for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')
+        if part.strip() and not _REFUSED.search(part)
+    }
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, content):
+        # mtime=0 keeps the output stable for identical content
+        return gzip.compress(content, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        return GzipStream(self.level)
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, chunk):
+        # Flush every chunk so a slow stream reaches the client as it is produced
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self.quality = quality
+
+    def compress(self, content):
+        return brotli.compress(content, quality=self.quality)
+
+    def compressor(self):
+        return BrotliStream(self.quality)
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def process(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def get_encoders(options):
+    """
+    Available encoders in order of preference.
+    """
+    encoders = []
+    if brotli is not None:
+        encoders.append(BrotliEncoder(options['BROTLI_QUALITY']))
+    encoders.append(GzipEncoder(options['GZIP_LEVEL']))
+    return encoders
+
+
+class CompressionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, encoding, original, compressed):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'responses': 0, 'original_bytes': 0, 'compressed_bytes': 0, 'encodings': {},
+            })
+            stats['responses'] += 1
+            stats['original_bytes'] += original
+            stats['compressed_bytes'] += compressed
+            stats['encodings'][encoding] = stats['encodings'].get(encoding, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {
+                endpoint: {**stats, 'encodings': dict(stats['encodings'])}
+                for endpoint, stats in self._endpoints.items()
+            }
+        for stats in endpoints.values():
+            stats['bytes_saved'] = stats['original_bytes'] - stats['compressed_bytes']
+            stats['ratio'] = round(stats['compressed_bytes'] / stats['original_bytes'], 3) if stats['original_bytes'] else None
+        return dict(sorted(endpoints.items(), key=lambda item: -item[1]['bytes_saved']))
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+compression_stats = CompressionStats()
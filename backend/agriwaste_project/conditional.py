@@ -0,0 +1,162 @@
+"""
+Conditional GET support (ETag / Last-Modified) for DRF viewsets.
+
+Polling clients resend the validators they were given, and the viewset
+answers with a 304 before anything is serialized. The default validator is
+a single aggregate query over the filtered queryset: the row count plus the
+newest `updated_at`, and the newest `updated_at` of each relation named in
+`conditional_related`, for the related data the serializer nests (titles,
+usernames). The ETag is built from all of them at full resolution, so it
+moves on deletions and on edits within the same second.
+
+Lists only get the ETag. `Last-Modified` has one-second resolution and no
+count, so `If-Modified-Since` alone would answer 304 after a row is deleted;
+it is only sent for single objects.
+
+The `a`-prefixed methods are the async counterparts used by
+`agriwaste_project.asynchronous.AsyncReadMixin`.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    conditional_field = 'updated_at'
+    # Forward relations whose `conditional_field` is folded into the validator
+    conditional_related = ()
+
+    def conditional_enabled(self, request):
+        # Cursor pages exist to avoid whole-queryset scans, which the validator needs
+        return 'cursor' not in request.query_params and request.query_params.get('pagination') != 'cursor'
+
+    def get_conditional_validator(self, queryset):
+        """
+        Return a `(token, last_modified)` pair describing the queryset.
+
+        `token` is any value that changes whenever the response would;
+        `last_modified` is a datetime or None.
+        """
+        values = queryset.order_by().aggregate(**self.conditional_aggregates())
+        return self.conditional_validator(values)
+
+    async def aget_conditional_validator(self, queryset):
+        values = await queryset.order_by().aaggregate(**self.conditional_aggregates())
+        return self.conditional_validator(values)
+
+    def conditional_aggregates(self):
+        aggregates = {'count': Count('pk'), 'last_modified': Max(self.conditional_field)}
+        for index, relation in enumerate(self.conditional_related):
+            aggregates[f'related_{index}'] = Max(f'{relation}__{self.conditional_field}')
+        return aggregates
+
+    def conditional_validator(self, values):
+        modified = [values['last_modified']] + [
+            values[f'related_{index}'] for index in range(len(self.conditional_related))
+        ]
+        token = (values['count'], *(value.isoformat() if value else None for value in modified))
+        return token, max((value for value in modified if value), default=None)
+
+    def get_conditional_etag(self, request, token):
+        user = request.user.pk if request.user and request.user.is_authenticated else None
+        params = sorted((name, request.query_params.getlist(name)) for name in request.query_params.keys())
+        source = f"{request.path}|{params}|{user}|{request.META.get('HTTP_ACCEPT', '')}|{token}"
+        # Weak, since the same data may be rendered differently
+        return f'W/"{hashlib.sha1(source.encode("utf-8")).hexdigest()}"'
+
+    def check_not_modified(self, request, queryset, many=True):
+        """
+        Return a 304 response if the client's validators still match,
+        otherwise None. Validators are added to the final response either way.
+        """
+        if request.method not in ('GET', 'HEAD') or not self.conditional_enabled(request):
+            return None
+        token, last_modified = self.get_conditional_validator(queryset)
+        return self.conditional_response(request, token, None if many else last_modified)
+
+    async def acheck_not_modified(self, request, queryset, many=True):
+        if request.method not in ('GET', 'HEAD') or not self.conditional_enabled(request):
+            return None
+        token, last_modified = await self.aget_conditional_validator(queryset)
+        return self.conditional_response(request, token, None if many else last_modified)
+
+    def conditional_response(self, request, token, last_modified=None):
+        etag = self.get_conditional_etag(request, token)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        self.conditional_headers = {'ETag': etag}
+        if timestamp is not None:
+            self.conditional_headers['Last-Modified'] = http_date(timestamp)
+        return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+    def list_response(self, queryset):
+        """
+        Conditional, paginated list response for `queryset`, shared by
+        `list` and the custom list actions.
+        """
+        not_modified = self.check_not_modified(self.request, queryset)
+        if not_modified is not None:
+            return not_modified
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    async def alist_response(self, queryset):
+        not_modified = await self.acheck_not_modified(self.request, queryset)
+        if not_modified is not None:
+            return not_modified
+        return await super().alist_response(queryset)
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.check_not_modified(request, self.filter_queryset(self.get_queryset()))
+        if not_modified is not None:
+            return not_modified
+        return super().list(request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        not_modified = await self.acheck_not_modified(request, self.filter_queryset(self.get_queryset()))
+        if not_modified is not None:
+            return not_modified
+        return await super().alist(request, *args, **kwargs)
+
+    def retrieve_queryset(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            not_modified = self.check_not_modified(request, self.retrieve_queryset(), many=False)
+        except (TypeError, ValueError, ValidationError):
+            # Malformed lookups are left to get_object() to turn into a 404
+            not_modified = None
+        if not_modified is not None:
+            return not_modified
+        return super().retrieve(request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        try:
+            not_modified = await self.acheck_not_modified(request, self.retrieve_queryset(), many=False)
+        except (TypeError, ValueError, ValidationError):
+            not_modified = None
+        if not_modified is not None:
+            return not_modified
+        return await super().aretrieve(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        headers = getattr(self, 'conditional_headers', None)
+        if headers and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            for name, value in headers.items():
+                response.setdefault(name, value)
+        return response
@@ -0,0 +1,160 @@
+"""
+Database settings built from environment variables.
+
+Without `DB_ENGINE` the bundled SQLite database is used as before.
+`DB_SQLITE_TUNED=true` enables the high-concurrency SQLite mode for
+single-node deployments:
+
+- WAL journal, so readers no longer block on a writer, with `synchronous=NORMAL`
+- `DB_SQLITE_MMAP_SIZE`: bytes of the file memory-mapped (default 256 MiB)
+- `DB_SQLITE_CACHE_SIZE`: page cache in KiB (default 65536)
+- `DB_SQLITE_BUSY_TIMEOUT`: ms a writer waits for the lock (default 5000)
+- `IMMEDIATE` transactions, which take the write lock up front instead of
+  failing with "database is locked" when a read transaction tries to write
+
+The pragmas are applied to each connection by the `connection_created`
+receiver in `agriwaste_project.signals`.
+
+`DB_ENGINE=postgresql` selects the production profile:
+
+- `DB_NAME`, `DB_USER`, `DB_PASSWORD`, `DB_HOST`, `DB_PORT`: connection details
+- `DB_CONN_MAX_AGE`: seconds a connection is kept between requests (default 60)
+- `DB_CONN_HEALTH_CHECKS`: check persistent connections before reuse (default on)
+- `DB_STATEMENT_TIMEOUT`: per-connection statement timeout in ms (default 30000, 0 disables)
+- `DB_POOL`: use a psycopg 3 connection pool instead of persistent connections
+- `DB_POOL_MIN_SIZE`, `DB_POOL_MAX_SIZE`: pool bounds (default 2 and 10)
+
+Pooling needs `psycopg[pool]` instead of `psycopg2-binary`. It replaces
+`CONN_MAX_AGE`, which Django requires to be 0 when a pool is used.
+
+Read replicas are listed in `DB_REPLICAS`, separated by commas. Each one
+becomes a `replica_<n>` alias that copies the primary's settings. For SQLite
+an entry is the replica's file path. For PostgreSQL it is
+`host[:port][/name]`, and omitted parts are taken from the primary, so
+`localhost/agriwaste_replica` is a second database on the same server.
+`agriwaste_project.routers.ReplicaRouter` sends reads to them.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', ''}
+
+
+def env_bool(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    if value.strip().lower() in TRUE_VALUES:
+        return True
+    if value.strip().lower() in FALSE_VALUES:
+        return False
+    raise ImproperlyConfigured(f'{name} must be a boolean, got "{value}"')
+
+
+def env_int(environ, name, default):
+    value = environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ImproperlyConfigured(f'{name} must be an integer, got "{value}"')
+
+
+def sqlite_settings(base_dir, environ):
+    database = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': environ.get('DB_NAME') or base_dir / 'db.sqlite3',
+        'CONN_MAX_AGE': env_int(environ, 'DB_CONN_MAX_AGE', 0),
+    }
+    if env_bool(environ, 'DB_SQLITE_TUNED', False):
+        database.update(sqlite_tuning(
+            mmap_size=env_int(environ, 'DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+            cache_size=env_int(environ, 'DB_SQLITE_CACHE_SIZE', 64 * 1024),
+            busy_timeout=env_int(environ, 'DB_SQLITE_BUSY_TIMEOUT', 5000),
+        ))
+    return database
+
+
+def sqlite_tuning(mmap_size, cache_size, busy_timeout):
+    """
+    Database entry keys for the high-concurrency SQLite mode.
+    """
+    return {
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': busy_timeout / 1000,
+        },
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': mmap_size,
+            # Negative values are KiB rather than pages
+            'cache_size': -cache_size,
+            'busy_timeout': busy_timeout,
+            'temp_store': 'MEMORY',
+        },
+    }
+
+
+def postgresql_settings(environ):
+    options = {}
+    statement_timeout = env_int(environ, 'DB_STATEMENT_TIMEOUT', 30000)
+    if statement_timeout:
+        # Sent as a startup parameter, so it applies to every connection
+        options['options'] = f'-c statement_timeout={statement_timeout}'
+
+    conn_max_age = env_int(environ, 'DB_CONN_MAX_AGE', 60)
+    if env_bool(environ, 'DB_POOL', False):
+        options['pool'] = {
+            'min_size': env_int(environ, 'DB_POOL_MIN_SIZE', 2),
+            'max_size': env_int(environ, 'DB_POOL_MAX_SIZE', 10),
+        }
+        conn_max_age = 0
+
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('DB_NAME', 'agriwaste'),
+        'USER': environ.get('DB_USER', ''),
+        'PASSWORD': environ.get('DB_PASSWORD', ''),
+        'HOST': environ.get('DB_HOST', ''),
+        'PORT': environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': env_bool(environ, 'DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': options,
+    }
+
+
+def database_settings(base_dir, environ=os.environ):
+    engine = environ.get('DB_ENGINE', 'sqlite').strip().lower()
+    if engine in ('sqlite', 'sqlite3'):
+        return sqlite_settings(base_dir, environ)
+    if engine in ('postgresql', 'postgres'):
+        return postgresql_settings(environ)
+    raise ImproperlyConfigured(f'Unsupported DB_ENGINE "{engine}"')
+
+
+def replica_settings(primary, environ=os.environ):
+    """
+    Return `{alias: settings}` for the replicas in `DB_REPLICAS`.
+    """
+    replicas = {}
+    entries = [entry.strip() for entry in environ.get('DB_REPLICAS', '').split(',') if entry.strip()]
+    for index, entry in enumerate(entries, start=1):
+        replica = {**primary, 'OPTIONS': dict(primary.get('OPTIONS', {}))}
+        if primary['ENGINE'] == 'django.db.backends.sqlite3':
+            replica['NAME'] = entry
+        else:
+            address, _, name = entry.partition('/')
+            host, _, port = address.partition(':')
+            replica.update({
+                'HOST': host or primary['HOST'],
+                'PORT': port or primary['PORT'],
+                'NAME': name or primary['NAME'],
+            })
+        # Tests run against the primary's test database
+        replica['TEST'] = {'MIRROR': 'default'}
+        replicas[f'replica_{index}'] = replica
+    return replicas
@@ -0,0 +1,257 @@
+"""
+Per-user event stream, pushed to clients with Server-Sent Events.
+
+Signal receivers publish small events (a type, the ids of the users they
+concern and a JSON payload) to `broker`. Clients connected to `/api/events/`
+(ASGI only, see `urls_async`) receive the events addressed to them, so they
+can refetch what changed instead of polling for it.
+
+The broker fans events out to the subscriptions of its own process; how
+events travel between processes is up to the backend in `EVENTS['BACKEND']`:
+
+- `LocalBackend` delivers within the publishing process. Enough for a
+  single ASGI worker.
+- `SpoolBackend` appends events to a file that every process tails, so
+  several workers (and WSGI workers that only publish) share one stream on
+  a single host. A stand-in for a real pub/sub service such as Redis:
+  delivery is best-effort and there is no replay.
+
+Backends take the broker and their `EVENTS['OPTIONS']`, and implement
+`publish(event)` and `start()`, calling `broker.deliver(event)` for every
+event published anywhere.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': 'agriwaste_project.events.LocalBackend',
+    'OPTIONS': {},
+    # Seconds between keep-alive comments on an idle stream
+    'KEEPALIVE': 15,
+    # Events buffered per connection before it is told to resync
+    'QUEUE_SIZE': 100,
+}
+
+
+class Subscription:
+    """
+    One connected client: a bounded queue living on the client's event loop.
+    """
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+
+    def put(self, event):
+        # Runs on self.loop. A client this far behind refetches everything instead
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync', 'users': [self.user_id], 'data': '{}'})
+
+
+class EventBroker:
+    # Milliseconds a client waits before reconnecting to a closed stream
+    retry = 3000
+
+    def __init__(self, backend, options=None, keepalive=15, queue_size=100):
+        self.backend_path = backend
+        self.options = options or {}
+        self.keepalive = keepalive
+        self.queue_size = queue_size
+        self._backend = None
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'EVENTS', {})}
+        return cls(options['BACKEND'], options['OPTIONS'], options['KEEPALIVE'], options['QUEUE_SIZE'])
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = import_string(self.backend_path)(self, **self.options)
+            return self._backend
+
+    def publish(self, user_ids, event_type, data):
+        """
+        Send an event to every connection of the given users. Safe to call
+        from any thread; receivers call it from `transaction.on_commit()`.
+        """
+        event = {
+            'type': event_type,
+            'users': sorted({user_id for user_id in user_ids if user_id is not None}),
+            'data': json.dumps(data, cls=DjangoJSONEncoder),
+        }
+        if event['users']:
+            self.backend.publish(event)
+
+    def deliver(self, event):
+        """
+        Hand an event to this process's subscriptions. Called by the backend,
+        from any thread.
+        """
+        with self._lock:
+            subscriptions = [
+                subscription
+                for user_id in event['users']
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, user_id):
+        self.backend.start()
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions[user_id].discard(subscription)
+                if not self._subscriptions[user_id]:
+                    del self._subscriptions[user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    async def stream(self, user_id):
+        """
+        The body of an event stream response for `user_id`, in the
+        text/event-stream format.
+        """
+        async with self.subscribe(user_id) as subscription:
+            # Sent at once, so the client knows the stream is open
+            yield f'retry: {self.retry}\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), self.keepalive)
+                except TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {event['data']}\n\n"
+
+
+class LocalBackend:
+    """
+    Deliver events to the publishing process only.
+    """
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, event):
+        self.broker.deliver(event)
+
+    def start(self):
+        pass
+
+
+class SpoolBackend:
+    """
+    Share events between the processes of one host through an append-only
+    spool file.
+
+    Each event is one JSON line appended with a single write. Every process
+    that has subscribers tails the file from a background thread, starting
+    at its end. The file is replaced once it grows past `max_bytes`; readers
+    finish the old file before moving to the new one.
+    """
+    def __init__(self, broker, path=None, max_bytes=1024 * 1024, poll_interval=0.2):
+        self.broker = broker
+        self.path = Path(path) if path else Path(settings.BASE_DIR) / 'var' / 'events' / 'spool.jsonl'
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.max_bytes:
+            # Readers keep the old file open until they have read it all
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._thread = threading.Thread(
+                    target=self.tail, args=(self.open(at_end=True),), name='event-spool', daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def open(self, at_end=False):
+        try:
+            spool = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        if at_end:
+            spool.seek(0, os.SEEK_END)
+        return spool
+
+    def tail(self, spool):
+        pending = b''
+        while not self._stopped.is_set():
+            if spool is None:
+                spool = self.open()
+            if spool is not None:
+                pending = self.read(spool, pending)
+                if self.replaced(spool):
+                    # Whatever was appended before the switch, then the new file
+                    self.read(spool, pending)
+                    spool.close()
+                    spool, pending = self.open(), b''
+                    continue
+            self._stopped.wait(self.poll_interval)
+        if spool is not None:
+            spool.close()
+
+    def replaced(self, spool):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(spool.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def read(self, spool, pending):
+        data = pending + spool.read()
+        *lines, pending = data.split(b'\n')
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self.broker.deliver(event)
+        return pending
+
+
+broker = EventBroker.from_settings()
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import uvicorn
+except ImportError:  # pragma: no cover
+    uvicorn = None
+
+
+class Command(BaseCommand):
+    help = 'Serves agriwaste_project.asgi with uvicorn'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            default='127.0.0.1',
+            help='Interface to bind (default: 127.0.0.1)'
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8000,
+            help='Port to bind (default: 8000)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Worker processes, each with its own event loop (default: 1)'
+        )
+        parser.add_argument(
+            '--log-level',
+            default='info',
+            choices=['critical', 'error', 'warning', 'info', 'debug'],
+            help='uvicorn log level (default: info)'
+        )
+
+    def handle(self, *args, **options):
+        if uvicorn is None:
+            raise CommandError('uvicorn is not installed, run "pipenv install uvicorn"')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+
+        uvicorn.run(
+            'agriwaste_project.asgi:application',
+            host=options['host'],
+            port=options['port'],
+            workers=options['workers'],
+            log_level=options['log_level'],
+            # Django implements no lifespan events
+            lifespan='off',
+        )
@@ -0,0 +1,31 @@
+import contextlib
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the primary SQLite database onto each SQLite read replica, standing in '
+        'for replication when trying the replica router locally'
+    )
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas:
+            raise CommandError('No replicas configured, set DB_REPLICAS')
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite replicas can be synced, PostgreSQL replication is set up on the server')
+
+        for alias in replicas:
+            target = connections[alias].settings_dict['NAME']
+            connections[alias].close()
+            # The backup API gives a consistent copy even while the primary is in use
+            with contextlib.closing(sqlite3.connect(primary.settings_dict['NAME'])) as source, \
+                    contextlib.closing(sqlite3.connect(target)) as replica:
+                source.backup(replica)
+            self.stdout.write(self.style.SUCCESS(f'Copied the primary database to {alias} ({target})'))
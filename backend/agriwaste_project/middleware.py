@@ -0,0 +1,232 @@
+import hashlib
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .compression import accepted_encodings, compression_stats, get_encoders
+from .routers import replica_reads
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve safe-method requests from the read replicas, except for clients
+    that wrote something within the last `DATABASE_REPLICA_PIN_SECONDS`.
+
+    A client is pinned to the primary after a successful unsafe request so
+    it reads its own writes despite replication lag. The pin is stored twice:
+    in a cookie, and in the cache under the client's credentials (Authorization
+    header or session), for API clients that ignore cookies.
+    """
+    cookie_name = 'db_primary_until'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not getattr(settings, 'DATABASE_REPLICAS', []):
+            return self.get_response(request)
+
+        use_replica = request.method in SAFE_METHODS and not self.is_pinned(request)
+        with replica_reads(use_replica):
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'DATABASE_REPLICAS', []):
+            return await self.get_response(request)
+
+        use_replica = request.method in SAFE_METHODS and not await self.ais_pinned(request)
+        # The flag is a context variable, so sync_to_async() carries it into database threads
+        with replica_reads(use_replica):
+            response = await self.get_response(request)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            await self.apin(request, response)
+        return response
+
+    def pin_keys(self, request):
+        credentials = [
+            request.META.get('HTTP_AUTHORIZATION'),
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME),
+        ]
+        return [
+            'db:pin:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+            for value in credentials if value
+        ]
+
+    def is_pinned(self, request):
+        if self.has_pin_cookie(request):
+            return True
+        keys = self.pin_keys(request)
+        return bool(keys and cache.get_many(keys))
+
+    async def ais_pinned(self, request):
+        if self.has_pin_cookie(request):
+            return True
+        keys = self.pin_keys(request)
+        return bool(keys and await cache.aget_many(keys))
+
+    def has_pin_cookie(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def pin(self, request, response):
+        seconds = self.set_pin_cookie(response)
+        cache.set_many({key: True for key in self.pin_keys(request)}, seconds)
+
+    async def apin(self, request, response):
+        seconds = self.set_pin_cookie(response)
+        await cache.aset_many({key: True for key in self.pin_keys(request)}, seconds)
+
+    def set_pin_cookie(self, response):
+        seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+        response.set_cookie(
+            self.cookie_name, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax'
+        )
+        return seconds
+
+
+COMPRESSION_DEFAULTS = {
+    'MIN_SIZE': 512,
+    'CONTENT_TYPES': [
+        'application/json',
+        'application/msgpack',
+        'text/html',
+        'text/plain',
+        'text/css',
+        'text/javascript',
+        'application/javascript',
+        'image/svg+xml',
+    ],
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli or gzip, whichever the client accepts
+    (brotli first).
+
+    Only responses whose content type is in `COMPRESSION['CONTENT_TYPES']`
+    and whose body is at least `COMPRESSION['MIN_SIZE']` bytes are
+    compressed. Streaming responses are compressed chunk by chunk. Files
+    under `MEDIA_URL` and responses that are already encoded are passed
+    through untouched. Bytes saved are counted per endpoint.
+    """
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.options = {**COMPRESSION_DEFAULTS, **getattr(settings, 'COMPRESSION', {})}
+        self.content_types = {content_type.lower() for content_type in self.options['CONTENT_TYPES']}
+        self.encoders = get_encoders(self.options)
+
+    async def __acall__(self, request):
+        # MiddlewareMixin would run process_response() in the sync thread; it only needs the CPU
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if not self.is_compressible(request, response):
+            return response
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        accepted = accepted_encodings(request)
+        encoder = next(
+            (encoder for encoder in self.encoders if encoder.name in accepted or '*' in accepted),
+            None,
+        )
+        if encoder is None:
+            return response
+
+        endpoint = self.get_endpoint(request)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async_stream(
+                    response.streaming_content, encoder, endpoint
+                )
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, encoder, endpoint)
+            # The compressed length is unknown until the stream ends
+            del response['Content-Length']
+        else:
+            original = response.content
+            compressed = encoder.compress(original)
+            if len(compressed) >= len(original):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+            compression_stats.record(endpoint, encoder.name, len(original), len(compressed))
+
+        # The encoded body is a different representation of the same resource
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoder.name
+        return response
+
+    def is_compressible(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return False
+        if settings.MEDIA_URL and request.path.startswith('/' + settings.MEDIA_URL.lstrip('/')):
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in self.content_types:
+            return False
+        if response.streaming:
+            length = response.get('Content-Length')
+            return length is None or int(length) >= self.options['MIN_SIZE']
+        return len(response.content) >= self.options['MIN_SIZE']
+
+    def get_endpoint(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.view_name:
+            return match.view_name
+        return request.path
+
+    def compress_stream(self, chunks, encoder, endpoint):
+        compressor = encoder.compressor()
+        original = compressed = 0
+        for chunk in chunks:
+            original += len(chunk)
+            data = compressor.process(chunk)
+            compressed += len(data)
+            if data:
+                yield data
+        data = compressor.finish()
+        compressed += len(data)
+        yield data
+        compression_stats.record(endpoint, encoder.name, original, compressed)
+
+    async def compress_async_stream(self, chunks, encoder, endpoint):
+        compressor = encoder.compressor()
+        original = compressed = 0
+        async for chunk in chunks:
+            original += len(chunk)
+            data = compressor.process(chunk)
+            compressed += len(data)
+            if data:
+                yield data
+        data = compressor.finish()
+        compressed += len(data)
+        yield data
+        compression_stats.record(endpoint, encoder.name, original, compressed)
@@ -0,0 +1,91 @@
+"""
+Faster renderers and parsers for the API.
+
+`ORJSONRenderer` and `ORJSONParser` replace DRF's stdlib-based JSON classes.
+Types that orjson does not handle the way DRF does go through DRF's own
+`JSONEncoder.default`, so the output is the same as before. That covers
+`Decimal` (as a number), datetimes (ISO 8601 with `Z` for UTC) and lazy
+translation strings. Without orjson installed, both
+classes fall back to the DRF implementation.
+
+`MessagePackRenderer` is selected by `Accept: application/msgpack` and
+`MessagePackParser` reads request bodies of that type. Values are converted
+the same way as for JSON.
+"""
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    options = (
+        (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        options = self.options
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            # orjson only indents by two spaces
+            options |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(data, default=encode_default, option=options)
+        except orjson.JSONEncodeError:
+            # Out of range integers and the like, which the stdlib encoder accepts
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError) as exc:
+            # Unhashable map keys raise TypeError where msgpack does not check keys strictly
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,56 @@
+"""
+Read-replica routing.
+
+`ReplicaRoutingMiddleware` marks safe-method requests as replica reads for
+the duration of the request, and `ReplicaRouter` then sends their queries to
+one of `settings.DATABASE_REPLICAS`. Everything else, including all writes,
+uses the primary. With no replicas configured the router leaves routing
+alone.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# A context variable rather than a thread local so it also holds under ASGI
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Route reads in this block to a replica (or, with False, to the primary).
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    def replicas(self):
+        return getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        if not replicas:
+            return None
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction on the primary have to see its writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS if self.replicas() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *self.replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
+from .cache import cache_settings, require_shared_cache
+from .database import database_settings, replica_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +49,7 @@ INSTALLED_APPS = [
     'corsheaders',
     
     # Custom apps
+    'agriwaste_project',
     'users',
     'marketplace',
     'waste_catalog',
@@ -51,6 +57,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'agriwaste_project.middleware.CompressionMiddleware',
+    'agriwaste_project.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +70,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'agriwaste_project.urls'
 
+# Used for requests served by asgi.py, where the hottest reads have async views
+ASGI_ROOT_URLCONF = 'agriwaste_project.urls_async'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -83,14 +94,20 @@ WSGI_APPLICATION = 'agriwaste_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# SQLite by default (tuned with DB_SQLITE_TUNED=true), PostgreSQL with
+# DB_ENGINE=postgresql; see database.py
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_settings(BASE_DIR),
 }
 
+# Read replicas from DB_REPLICAS. Safe-method requests read from them, and
+# clients are pinned to the primary for a few seconds after they write
+DATABASES.update(replica_settings(DATABASES['default']))
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['agriwaste_project.routers.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,16 +157,79 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # orjson-backed JSON, plus MessagePack for clients sending Accept: application/msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'agriwaste_project.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['agriwaste_project.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'agriwaste_project.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ] + (['agriwaste_project.renderers.MessagePackParser'] if find_spec('msgpack') else []),
+    'DEFAULT_PAGINATION_CLASS': 'agriwaste_project.asynchronous.AsyncPageNumberPagination',
     'PAGE_SIZE': 15
 }
 
+# Cache, from CACHE_BACKEND and CACHE_LOCATION. Version counters, message
+# counters, the replica pin and the archive horizon live here, so with DEBUG
+# off it must be shared between processes, see agriwaste_project/cache.py
+CACHES = {
+    'default': cache_settings(BASE_DIR),
+}
+require_shared_cache(CACHES, DEBUG)
+
+# Token -> user lookups cached per worker, optionally shared through a CACHES alias
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+}
+
+# Response compression (gzip, and brotli when installed); defaults in agriwaste_project.middleware
+COMPRESSION = {
+    'MIN_SIZE': 512,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+# Per-user events pushed at /api/events/ (ASGI). SpoolBackend shares them between
+# the workers of one host; defaults in agriwaste_project.events
+EVENTS = {
+    'BACKEND': 'agriwaste_project.events.LocalBackend',
+    'OPTIONS': {},
+    'KEEPALIVE': 15,
+}
+
+# Marketplace facet counts are cached per filter set and invalidated on listing changes
+MARKETPLACE_FACETS_CACHE_TIMEOUT = 300
+
+# Upper bound on how long a per-user message counter can stay off after a race
+MARKETPLACE_MESSAGE_COUNTS_TIMEOUT = 600
+
+# Seller reputation (0-100) recomputed by `manage.py update_reputations`; defaults in
+# marketplace.reputation
+REPUTATION = {
+    'WEIGHTS': {'rating': 0.5, 'completion': 0.3, 'response': 0.2},
+    'RESPONSE_WINDOW_DAYS': 90,
+}
+
+# Read messages older than this are moved to the archive by `manage.py archive_messages`
+MARKETPLACE_MESSAGE_ARCHIVE_AFTER_DAYS = 180
+
+# Waste catalog responses are cached until the catalog is edited
+WASTE_CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Precompressed catalog snapshot served at /api/waste-catalog/snapshot/
+WASTE_CATALOG_SNAPSHOT_DIR = BASE_DIR / 'var' / 'catalog'
+WASTE_CATALOG_SNAPSHOT_AUTO_REBUILD = True
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 # For production, specify allowed origins:
@@ -0,0 +1,417 @@
+import asyncio
+import datetime
+import gzip
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+import brotli
+import msgpack
+from asgiref.sync import async_to_sync, iscoroutinefunction
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .cache import cache_settings, require_shared_cache
+from .database import database_settings, replica_settings
+from .compression import compression_stats
+from .events import EventBroker, broker
+from .middleware import CompressionMiddleware, ReplicaRoutingMiddleware
+from .renderers import ORJSONRenderer
+from waste_catalog.models import WasteCategory
+from .routers import ReplicaRouter, replica_reads
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_sqlite_is_the_default(self):
+        database = database_settings(Path('/srv'), {})
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['NAME'], Path('/srv/db.sqlite3'))
+        self.assertNotIn('PRAGMAS', database)
+
+    def test_postgresql_profile(self):
+        database = database_settings(Path('/srv'), {
+            'DB_ENGINE': 'postgresql', 'DB_NAME': 'agriwaste', 'DB_STATEMENT_TIMEOUT': '5000',
+        })
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertEqual(database['OPTIONS'], {'options': '-c statement_timeout=5000'})
+
+    def test_pool_replaces_persistent_connections(self):
+        database = database_settings(Path('/srv'), {'DB_ENGINE': 'postgresql', 'DB_POOL': 'true'})
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 10})
+
+    def test_invalid_values(self):
+        with self.assertRaises(ImproperlyConfigured):
+            database_settings(Path('/srv'), {'DB_ENGINE': 'oracle'})
+        with self.assertRaises(ImproperlyConfigured):
+            database_settings(Path('/srv'), {'DB_ENGINE': 'postgresql', 'DB_CONN_MAX_AGE': 'forever'})
+
+    def test_tuned_sqlite_pragmas_are_applied(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = database_settings(Path(directory), {'DB_SQLITE_TUNED': 'true'})
+            database.update({
+                'ATOMIC_REQUESTS': False, 'AUTOCOMMIT': True, 'TIME_ZONE': None,
+                'CONN_HEALTH_CHECKS': False, 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+            })
+            connection = DatabaseWrapper(database, alias='tuned')
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+            finally:
+                connection.close()
+
+    def test_replicas_copy_the_primary(self):
+        primary = database_settings(Path('/srv'), {'DB_ENGINE': 'postgresql', 'DB_HOST': 'db', 'DB_PORT': '5432'})
+        replicas = replica_settings(primary, {'DB_REPLICAS': 'replica-a, localhost:5433/agriwaste_replica'})
+        self.assertEqual(list(replicas), ['replica_1', 'replica_2'])
+        self.assertEqual(
+            (replicas['replica_1']['HOST'], replicas['replica_1']['PORT'], replicas['replica_1']['NAME']),
+            ('replica-a', '5432', 'agriwaste'),
+        )
+        self.assertEqual(
+            (replicas['replica_2']['HOST'], replicas['replica_2']['PORT'], replicas['replica_2']['NAME']),
+            ('localhost', '5433', 'agriwaste_replica'),
+        )
+        self.assertEqual(replicas['replica_1']['TEST'], {'MIRROR': 'default'})
+
+        sqlite = replica_settings(database_settings(Path('/srv'), {}), {'DB_REPLICAS': '/srv/replica.sqlite3'})
+        self.assertEqual(sqlite['replica_1']['NAME'], '/srv/replica.sqlite3')
+
+
+class CacheSettingsTests(SimpleTestCase):
+    def test_locmem_is_the_default(self):
+        self.assertEqual(cache_settings(Path('/srv'), {}), {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+
+    def test_shared_backends(self):
+        self.assertEqual(cache_settings(Path('/srv'), {'CACHE_BACKEND': 'redis'}), {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': ['redis://127.0.0.1:6379/1'],
+        })
+        memcached = cache_settings(Path('/srv'), {'CACHE_BACKEND': 'memcached', 'CACHE_LOCATION': 'a:11211, b:11211'})
+        self.assertEqual(memcached['LOCATION'], ['a:11211', 'b:11211'])
+        self.assertEqual(cache_settings(Path('/srv'), {'CACHE_BACKEND': 'file'})['LOCATION'], '/srv/var/cache')
+        with self.assertRaises(ImproperlyConfigured):
+            cache_settings(Path('/srv'), {'CACHE_BACKEND': 'mongodb'})
+
+    def test_process_local_cache_is_refused_without_debug(self):
+        local = {'default': cache_settings(Path('/srv'), {})}
+        require_shared_cache(local, debug=True)
+        with self.assertRaises(ImproperlyConfigured):
+            require_shared_cache(local, debug=False)
+        with self.assertRaises(ImproperlyConfigured):
+            require_shared_cache({'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}, debug=False)
+        require_shared_cache({'default': cache_settings(Path('/srv'), {'CACHE_BACKEND': 'database'})}, debug=False)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], DATABASE_REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    # Not a TestCase: its wrapping transaction would keep every read on the primary
+    databases = {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+        self.routed_to = None
+
+    def view(self, request):
+        self.routed_to = self.router.db_for_read(User)
+        return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+    def call(self, request):
+        return ReplicaRoutingMiddleware(self.view)(request)
+
+    def test_router_defaults_to_the_primary(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertEqual(self.router.db_for_write(User), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(User), 'replica_1')
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(User), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_router_is_inactive_without_replicas(self):
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_write(User))
+
+    def test_safe_requests_read_from_replicas(self):
+        response = self.call(self.factory.get('/api/marketplace/listings/'))
+        self.assertEqual(self.routed_to, 'replica_1')
+        self.assertNotIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        self.call(self.factory.post('/api/marketplace/messages/'))
+        self.assertEqual(self.routed_to, 'default')
+
+    def test_writers_are_pinned_by_cookie(self):
+        response = self.call(self.factory.post('/api/marketplace/messages/'))
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 5)
+
+        request = self.factory.get('/api/marketplace/messages/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = cookie.value
+        self.call(request)
+        self.assertEqual(self.routed_to, 'default')
+
+    def test_writers_are_pinned_by_credentials(self):
+        self.call(self.factory.post('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc'))
+
+        self.call(self.factory.get('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(self.routed_to, 'default')
+        self.call(self.factory.get('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token other'))
+        self.assertEqual(self.routed_to, 'replica_1')
+
+    def test_failed_writes_do_not_pin(self):
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse(status=400))
+        response = middleware(self.factory.post('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertNotIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+        self.call(self.factory.get('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(self.routed_to, 'replica_1')
+
+    def test_async_requests_are_routed_and_pinned(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(
+            self.factory.post('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc')
+        )
+        self.assertEqual(self.routed_to, 'default')
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        async_to_sync(middleware)(self.factory.get('/api/marketplace/messages/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(self.routed_to, 'default')
+        async_to_sync(middleware)(self.factory.get('/api/marketplace/messages/'))
+        self.assertEqual(self.routed_to, 'replica_1')
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_orjson_output_matches_drf(self):
+        data = {
+            'price': Decimal('12.50'),
+            'created_at': timezone.now(),
+            'available_from': datetime.date(2025, 3, 1),
+            'label': gettext_lazy('Active'),
+            1: 'integer key',
+            'nested': [{'quantity': Decimal('0.25')}, None],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_messagepack_selected_by_accept(self):
+        response = self.client.get('/api/waste-catalog/categories/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['count'], 0)
+
+        response = self.client.get('/api/waste-catalog/categories/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_request_bodies(self):
+        response = self.client.post(
+            '/api/users/',
+            msgpack.packb({'username': 'packed', 'password': 'secret-pass-1'}),
+            content_type='application/msgpack',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(username='packed').exists())
+
+        response = self.client.post('/api/users/', '{"username": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+    def test_malformed_messagepack_bodies(self):
+        # A map or an array as a map key, a truncated array and trailing bytes
+        bodies = [b'\x81\x81\xa1a\x01\x01', b'\x81\x91\x01\x01', b'\x92\x01', b'\x01\x02']
+        for body in bodies:
+            with self.subTest(body=body):
+                response = self.client.post('/api/users/', body, content_type='application/msgpack')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('MessagePack parse error', response.json()['detail'])
+        with mock.patch.object(msgpack, 'unpackb', side_effect=TypeError("unhashable type: 'dict'")):
+            response = self.client.post('/api/users/', bodies[0], content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('MessagePack parse error', response.json()['detail'])
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        compression_stats.clear()
+        self.factory = RequestFactory()
+        self.payload = b'{"description": "' + 'Grignons d\'olive s\u00e9ch\u00e9s '.encode('utf-8') * 100 + b'"}'
+
+    def call(self, response, path='/api/marketplace/listings/', accept='gzip, br'):
+        request = self.factory.get(path, HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def json_response(self, content):
+        return HttpResponse(content, content_type='application/json')
+
+    def test_prefers_brotli_then_gzip(self):
+        response = self.call(self.json_response(self.payload))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.payload)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        response = self.call(self.json_response(self.payload), accept='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.payload)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def test_skips_small_unlisted_and_media_responses(self):
+        response = self.call(self.json_response(b'{"id": 1}'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.call(HttpResponse(self.payload, content_type='image/jpeg'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.call(self.json_response(self.payload), path='/media/listing_images/a.json')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.call(self.json_response(self.payload), accept='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_weakens_strong_etags(self):
+        response = self.json_response(self.payload)
+        response['ETag'] = '"abc"'
+        self.assertEqual(self.call(response)['ETag'], 'W/"abc"')
+
+    def test_streaming_responses(self):
+        chunks = [self.payload[i:i + 100] for i in range(0, len(self.payload), 100)]
+        response = self.call(StreamingHttpResponse(iter(chunks), content_type='application/json'), accept='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.payload)
+
+        stats = compression_stats.snapshot()['/api/marketplace/listings/']
+        self.assertEqual(stats['original_bytes'], len(self.payload))
+        self.assertGreater(stats['bytes_saved'], 0)
+
+    def test_stats_per_endpoint(self):
+        user = User.objects.create(username='staff', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user)
+        for index in range(20):
+            WasteCategory.objects.create(name=f'Category {index}', description='Residus agricoles ' * 5)
+
+        response = client.get('/api/waste-catalog/categories/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        response = client.get('/api/stats/compression/')
+        stats = response.json()['wastecategory-list']
+        self.assertEqual(stats['responses'], 1)
+        self.assertEqual(stats['encodings'], {'gzip': 1})
+        self.assertGreater(stats['bytes_saved'], 0)
+
+        client.force_authenticate(User.objects.create(username='farmer'))
+        self.assertEqual(client.get('/api/stats/compression/').status_code, 403)
+
+
+class EventBrokerTests(SimpleTestCase):
+    def local_broker(self, **kwargs):
+        return EventBroker('agriwaste_project.events.LocalBackend', **kwargs)
+
+    async def next_event(self, subscription):
+        return await asyncio.wait_for(subscription.queue.get(), 5)
+
+    async def test_events_reach_their_users_only(self):
+        events = self.local_broker()
+        async with events.subscribe(1) as first, events.subscribe(1) as again, events.subscribe(2) as other:
+            await asyncio.to_thread(events.publish, [1, None], 'message.created', {'id': 7})
+            for subscription in (first, again):
+                event = await self.next_event(subscription)
+                self.assertEqual((event['type'], event['data']), ('message.created', '{"id": 7}'))
+            self.assertTrue(other.queue.empty())
+        self.assertEqual(events.subscriber_count(), 0)
+
+    async def test_slow_clients_are_told_to_resync(self):
+        events = self.local_broker(queue_size=2)
+        async with events.subscribe(1) as subscription:
+            for number in range(3):
+                events.publish([1], 'message.created', {'id': number})
+            await asyncio.sleep(0)
+            self.assertEqual((await self.next_event(subscription))['type'], 'resync')
+            self.assertTrue(subscription.queue.empty())
+
+    async def test_spool_shares_events_between_brokers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        options = {'path': Path(directory.name) / 'spool.jsonl', 'max_bytes': 200, 'poll_interval': 0.01}
+        publisher = EventBroker('agriwaste_project.events.SpoolBackend', options)
+        subscriber = EventBroker('agriwaste_project.events.SpoolBackend', options)
+        publisher.publish([1], 'message.created', {'id': 0})
+        self.addCleanup(subscriber.backend.stop)
+
+        async with subscriber.subscribe(1) as subscription:
+            # Past the size limit, so the spool file is replaced along the way
+            for number in range(1, 6):
+                publisher.publish([1], 'message.created', {'id': number})
+            received = [(await self.next_event(subscription))['data'] for _ in range(5)]
+        # Only what was published after subscribing
+        self.assertEqual(received, [f'{{"id": {number}}}' for number in range(1, 6)])
+        self.assertLess(options['path'].stat().st_size, 200)
+
+    async def test_stream_format(self):
+        events = self.local_broker(keepalive=0.01)
+        stream = events.stream(1)
+        self.assertEqual(await anext(stream), 'retry: 3000\n\n')
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+        events.publish([1], 'order.created', {'id': 3})
+        self.assertEqual(await anext(stream), 'event: order.created\ndata: {"id": 3}\n\n')
+        await stream.aclose()
+        self.assertEqual(events.subscriber_count(), 0)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF='agriwaste_project.urls_async')
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.token = Token.objects.create(user=self.user)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get('/api/events/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        response = await self.async_client.get('/api/events/', headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_streams_the_users_events(self):
+        response = await self.async_client.get(
+            '/api/events/', headers={'Authorization': f'Token {self.token.key}', 'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry: '))
+        broker.publish([self.user.pk + 1], 'message.created', {'id': 1})
+        broker.publish([self.user.pk], 'message.created', {'id': 2})
+        self.assertEqual(
+            await asyncio.wait_for(anext(chunks), 5), b'event: message.created\ndata: {"id": 2}\n\n'
+        )
+        await chunks.aclose()
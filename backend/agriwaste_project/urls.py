@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.authtoken import views as token_views
+from .views import compression_stats_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,6 +28,7 @@ urlpatterns = [
     path('api/marketplace/', include('marketplace.urls')),
     path('api/waste-catalog/', include('waste_catalog.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    path('api/stats/compression/', compression_stats_view, name='compression-stats'),
 ]
 
 # Serve media files in development
@@ -0,0 +1,16 @@
+"""
+URL configuration for the ASGI application, selected by `asgi.py`.
+
+The routes of `agriwaste_project.urls`, with the async read views of
+`agriwaste_project.asynchronous` in place of the sync ones where a viewset
+provides them, plus the event stream, which needs an event loop to wait on.
+"""
+from django.urls import path
+
+from .asynchronous import async_urlpatterns
+from .urls import urlpatterns as sync_urlpatterns
+from .views import event_stream_view
+
+urlpatterns = async_urlpatterns(sync_urlpatterns) + [
+    path('api/events/', event_stream_view, name='event-stream'),
+]
@@ -0,0 +1,44 @@
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .asynchronous import aauthenticate
+from .compression import compression_stats
+from .events import broker
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def compression_stats_view(request):
+    # Bytes saved per endpoint by CompressionMiddleware in this worker
+    return Response(compression_stats.snapshot())
+
+
+@require_GET
+async def event_stream_view(request):
+    """
+    Server-Sent Events stream of the events addressed to the current user.
+    Authenticates like the API: a token header, or the session cookie.
+    """
+    request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = await aauthenticate(request)
+    except exceptions.AuthenticationFailed as exc:
+        return JsonResponse({'detail': exc.detail}, status=401, headers={'WWW-Authenticate': 'Token'})
+    if not user or not user.is_authenticated:
+        return JsonResponse(
+            {'detail': exceptions.NotAuthenticated.default_detail},
+            status=401,
+            headers={'WWW-Authenticate': 'Token'},
+        )
+    return StreamingHttpResponse(
+        broker.stream(user.pk),
+        content_type='text/event-stream',
+        # no-transform also keeps CompressionMiddleware from buffering events
+        headers={'Cache-Control': 'no-cache, no-transform', 'X-Accel-Buffering': 'no'},
+    )
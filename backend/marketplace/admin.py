@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WasteListing, ListingImage, Order, Review, Message
+from .models import WasteListing, ListingImage, Order, Review, Message, Conversation, ConversationParticipant, ArchivedMessage
 
 class ListingImageInline(admin.TabularInline):
     model = ListingImage
@@ -33,3 +33,33 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = ('read', 'created_at')
     search_fields = ('subject', 'content', 'sender__username', 'receiver__username')
     readonly_fields = ('created_at',)
+    raw_id_fields = ('conversation',)
+
+class ConversationParticipantInline(admin.TabularInline):
+    model = ConversationParticipant
+    extra = 0
+    raw_id_fields = ('user',)
+    readonly_fields = ('unread_count', 'last_message_at')
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    # Maintained from messages, see marketplace.conversations
+    list_display = ('key', 'listing', 'last_message_at', 'last_message_preview')
+    search_fields = ('key', 'last_message_preview', 'participants__user__username')
+    readonly_fields = ('key', 'last_message', 'last_message_at', 'last_message_preview', 'created_at', 'updated_at')
+    raw_id_fields = ('listing',)
+    inlines = [ConversationParticipantInline]
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    # Written by the archive_messages command only
+    list_display = ('subject', 'sender', 'receiver', 'created_at', 'archived_at')
+    list_filter = ('created_at', 'archived_at')
+    search_fields = ('subject', 'content', 'sender__username', 'receiver__username')
+    raw_id_fields = ('sender', 'receiver', 'listing', 'conversation')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,119 @@
+"""
+Hot/cold storage for messages.
+
+`archive_messages()` (the `archive_messages` command) moves read messages
+older than `MARKETPLACE_MESSAGE_ARCHIVE_AFTER_DAYS` from `Message` to
+`ArchivedMessage` in chunks, each chunk with one INSERT ... SELECT and one
+DELETE in a transaction. Unread messages and the last message of every
+conversation stay in the hot table, so unread lists, counters and the inbox
+never need the archive.
+
+History endpoints page through both tables with `ArchiveKeysetPagination`.
+Everything archived is at least as old as the archive horizon, the newest
+`created_at` in the archive, so pages newer than it never read the archive.
+The horizon is cached only when the default cache is shared between
+processes, since the command that moves it runs in a process of its own.
+Otherwise it is read with one `MAX(created_at)` along an index.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from agriwaste_project.cache import default_cache_is_shared
+from .models import ArchivedMessage, Conversation, Message
+
+HORIZON_KEY = 'marketplace:messages:archive_horizon'
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'MARKETPLACE_MESSAGE_ARCHIVE_AFTER_DAYS', 180)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archivable_messages(cutoff, using='default'):
+    last_messages = Conversation.objects.using(using).filter(last_message__isnull=False).values('last_message')
+    return Message.objects.using(using).filter(created_at__lt=cutoff, read=True).exclude(pk__in=last_messages)
+
+
+def archive_messages(cutoff, chunk_size=1000, using='default'):
+    """
+    Move the archivable messages created before `cutoff`, oldest id first,
+    and return how many were moved. Safe to interrupt between chunks.
+    """
+    moved = 0
+    last_pk = 0
+    while True:
+        ids = list(
+            archivable_messages(cutoff, using).filter(pk__gt=last_pk)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        with transaction.atomic(using=using):
+            moved += move_messages(ids, cutoff, using)
+        # Readers only add the horizon, so they cannot put back an older one
+        cache.set(HORIZON_KEY, archive_horizon(using) or False, None)
+        last_pk = ids[-1]
+    return moved
+
+
+def move_messages(ids, cutoff, using='default'):
+    """
+    Copy the given messages into the archive and delete them, rechecking
+    that they are still archivable. Must run in a transaction.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = [field.column for field in Message._meta.concrete_fields]
+    pk = quote(Message._meta.pk.column)
+    archivable = archivable_messages(cutoff, using).filter(pk__in=ids).values('pk')
+    sql, params = archivable.query.get_compiler(using).as_sql()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(ArchivedMessage._meta.db_table)} "
+            f"({', '.join(quote(column) for column in columns)}, {quote('archived_at')}) "
+            f"SELECT {', '.join(quote(column) for column in columns)}, %s "
+            f"FROM {quote(Message._meta.db_table)} WHERE {pk} IN ({sql})",
+            [timezone.now(), *params],
+        )
+        # Rows are moved as they are: no delete receivers, which would treat them as gone
+        cursor.execute(
+            f"DELETE FROM {quote(Message._meta.db_table)} WHERE {pk} IN "
+            f"(SELECT {pk} FROM {quote(ArchivedMessage._meta.db_table)} WHERE {pk} IN "
+            f"({', '.join(['%s'] * len(ids))}))",
+            ids,
+        )
+        return cursor.rowcount
+
+
+def archive_horizon(using='default'):
+    return ArchivedMessage.objects.using(using).aggregate(horizon=Max('created_at'))['horizon']
+
+
+def get_archive_horizon():
+    """
+    The newest `created_at` in the archive, or None when it is empty.
+    """
+    if not default_cache_is_shared():
+        return archive_horizon()
+    horizon = cache.get(HORIZON_KEY)
+    if horizon is None:
+        horizon = archive_horizon()
+        cache.add(HORIZON_KEY, horizon or False, None)
+    return horizon or None
+
+
+async def aget_archive_horizon():
+    if not default_cache_is_shared():
+        return (await ArchivedMessage.objects.aaggregate(horizon=Max('created_at')))['horizon']
+    horizon = await cache.aget(HORIZON_KEY)
+    if horizon is None:
+        horizon = (await ArchivedMessage.objects.aaggregate(horizon=Max('created_at')))['horizon']
+        await cache.aadd(HORIZON_KEY, horizon or False, None)
+    return horizon or None
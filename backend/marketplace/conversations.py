@@ -0,0 +1,118 @@
+"""
+Conversation bookkeeping for messages.
+
+Every message belongs to the conversation of its two users and its listing,
+created on the first message. Each participant has a row with their unread
+count and a copy of the conversation's `last_message_at`, which the inbox
+pages through with the `participant_inbox_idx` index; a thread pages
+through `message_conversation_idx`. The receivers in `marketplace.signals`
+keep both up to date with UPDATE statements rather than read-modify-write.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .models import Conversation, ConversationParticipant, Message
+
+PREVIEW_LENGTH = 100
+
+
+def conversation_key(sender_id, receiver_id, listing_id=None):
+    low, high = sorted((sender_id, receiver_id))
+    return f"{low}:{high}:{listing_id or ''}"
+
+
+def get_conversation(sender_id, receiver_id, listing_id=None, using='default', started_at=None):
+    """
+    The conversation between two users about a listing, created if needed,
+    as of `started_at` (default: now).
+    """
+    key = conversation_key(sender_id, receiver_id, listing_id)
+    conversation = Conversation.objects.using(using).filter(key=key).first()
+    if conversation is not None:
+        return conversation
+
+    now = started_at or timezone.now()
+    try:
+        with transaction.atomic(using=using):
+            conversation = Conversation.objects.using(using).create(
+                key=key, listing_id=listing_id, last_message_at=now
+            )
+            ConversationParticipant.objects.using(using).bulk_create([
+                ConversationParticipant(conversation=conversation, user_id=user_id, last_message_at=now)
+                for user_id in sorted({sender_id, receiver_id})
+            ])
+    except IntegrityError:
+        # Another request started the same conversation first
+        conversation = Conversation.objects.using(using).get(key=key)
+    return conversation
+
+
+def record_message(message, using='default'):
+    """
+    Make `message` its conversation's last message and count it as unread
+    for the receiver.
+    """
+    Conversation.objects.using(using).filter(
+        pk=message.conversation_id, last_message_at__lte=message.created_at
+    ).update(
+        last_message=message,
+        last_message_at=message.created_at,
+        last_message_preview=Truncator(message.content).chars(PREVIEW_LENGTH),
+        updated_at=timezone.now(),
+    )
+    unread = 0 if message.read else 1
+    ConversationParticipant.objects.using(using).filter(conversation=message.conversation_id).update(
+        last_message_at=Greatest('last_message_at', Value(message.created_at)),
+        unread_count=F('unread_count') + Case(
+            When(user=message.receiver_id, then=Value(unread)), default=Value(0), output_field=IntegerField()
+        ),
+    )
+
+
+def adjust_unread(conversation_id, user_id, delta, using='default'):
+    ConversationParticipant.objects.using(using).filter(conversation=conversation_id, user=user_id).update(
+        unread_count=Greatest(F('unread_count') + delta, Value(0))
+    )
+
+
+def recount_unread(user_id, using='default'):
+    """
+    Recount the unread messages of every conversation in which `user_id`
+    had some, in one UPDATE. Used after bulk read-state changes, which do
+    not say which conversations they touched.
+    """
+    unread = (
+        Message.objects.using(using)
+        .filter(conversation=OuterRef('conversation'), receiver=user_id, read=False)
+        .order_by().values('conversation').annotate(count=Count('pk')).values('count')
+    )
+    ConversationParticipant.objects.using(using).filter(user=user_id, unread_count__gt=0).update(
+        unread_count=Coalesce(Subquery(unread), Value(0))
+    )
+
+
+def refresh_last_message(conversation_id, using='default'):
+    """
+    Point the conversation at its newest remaining message, after its last
+    one was deleted or moved to another conversation.
+    """
+    latest = (
+        Message.objects.using(using).filter(conversation=conversation_id)
+        .order_by('-created_at', '-id').only('pk', 'content', 'created_at').first()
+    )
+    conversation = Conversation.objects.using(using).filter(pk=conversation_id)
+    if latest is None:
+        conversation.update(last_message=None, last_message_preview='', updated_at=timezone.now())
+        return
+    conversation.update(
+        last_message=latest,
+        last_message_at=latest.created_at,
+        last_message_preview=Truncator(latest.content).chars(PREVIEW_LENGTH),
+        updated_at=timezone.now(),
+    )
+    ConversationParticipant.objects.using(using).filter(conversation=conversation_id).update(
+        last_message_at=latest.created_at
+    )
@@ -0,0 +1,121 @@
+"""
+Per-user message counters behind `messages/counts/`.
+
+Each user's unread, received and sent counts live in the cache as separate
+integers. A miss is filled from one aggregate query; after that the
+receivers in `marketplace.signals` adjust the counters with `incr` when a
+message is created, read or deleted, so a badge refresh is a cache hit.
+Counters that are not cached are left alone and recomputed on the next read.
+
+A read that misses while a message is being written can store a count
+that misses that write; `MARKETPLACE_MESSAGE_COUNTS_TIMEOUT` bounds how long.
+
+Received and sent counts include archived messages. Archiving moves rows
+without sending signals, so it leaves the counters as they are.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import ArchivedMessage, Message
+
+COUNTERS = ('unread', 'received', 'sent')
+
+
+def counter_key(user_id, name):
+    return f'marketplace:messages:{user_id}:{name}'
+
+
+def counts_queryset(user_id):
+    return Message.objects.filter(Q(sender=user_id) | Q(receiver=user_id))
+
+
+def count_aggregates(user_id):
+    return {
+        'unread': Count('pk', filter=Q(receiver=user_id, read=False)),
+        'received': Count('pk', filter=Q(receiver=user_id)),
+        'sent': Count('pk', filter=Q(sender=user_id)),
+    }
+
+
+def archived_counts_queryset(user_id):
+    return ArchivedMessage.objects.filter(Q(sender=user_id) | Q(receiver=user_id))
+
+
+def archived_aggregates(user_id):
+    # Only read messages are archived
+    return {
+        'received': Count('pk', filter=Q(receiver=user_id)),
+        'sent': Count('pk', filter=Q(sender=user_id)),
+    }
+
+
+def add_archived(counts, archived):
+    return {name: count + archived.get(name, 0) for name, count in counts.items()}
+
+
+def cached_counts(user_id, values):
+    """
+    The counts from a `get_many()` result, or None if any is missing.
+    """
+    counts = {name: values.get(counter_key(user_id, name)) for name in COUNTERS}
+    if None in counts.values():
+        return None
+    # A decrement racing a recount can overshoot
+    return {name: max(count, 0) for name, count in counts.items()}
+
+
+def store_counts(user_id, counts):
+    timeout = getattr(settings, 'MARKETPLACE_MESSAGE_COUNTS_TIMEOUT', 600)
+    return {counter_key(user_id, name): count for name, count in counts.items()}, timeout
+
+
+def get_message_counts(user_id):
+    counts = cached_counts(user_id, cache.get_many([counter_key(user_id, name) for name in COUNTERS]))
+    if counts is None:
+        counts = add_archived(
+            counts_queryset(user_id).aggregate(**count_aggregates(user_id)),
+            archived_counts_queryset(user_id).aggregate(**archived_aggregates(user_id)),
+        )
+        cache.set_many(*store_counts(user_id, counts))
+    return counts
+
+
+async def aget_message_counts(user_id):
+    counts = cached_counts(user_id, await cache.aget_many([counter_key(user_id, name) for name in COUNTERS]))
+    if counts is None:
+        counts = add_archived(
+            await counts_queryset(user_id).aaggregate(**count_aggregates(user_id)),
+            await archived_counts_queryset(user_id).aaggregate(**archived_aggregates(user_id)),
+        )
+        await cache.aset_many(*store_counts(user_id, counts))
+    return counts
+
+
+def adjust_message_counts(deltas):
+    """
+    Apply `{(user_id, counter): delta}` to the cached counters.
+    """
+    for (user_id, name), delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(counter_key(user_id, name), delta)
+        except ValueError:
+            # Not cached: the next read counts from the database
+            pass
+
+
+def forget_message_counts(*user_ids):
+    cache.delete_many([counter_key(user_id, name) for user_id in user_ids for name in COUNTERS])
+
+
+def message_deltas(message, sign=1):
+    """
+    The counter changes of `message` appearing (sign=1) or disappearing (sign=-1).
+    """
+    return {
+        (message.receiver_id, 'received'): sign,
+        (message.receiver_id, 'unread'): 0 if message.read else sign,
+        (message.sender_id, 'sent'): sign,
+    }
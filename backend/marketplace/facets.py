@@ -0,0 +1,115 @@
+"""
+Facet counts for the marketplace listing filters.
+
+Facets are computed from the same filtered queryset as the listing page, in
+a fixed number of aggregate queries: one GROUP BY per facet field plus one
+query for all price buckets. Results are cached per normalized filter set.
+Cache keys include a listings version counter, which is bumped whenever a
+listing is saved or deleted, so stale facets are never served.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import WasteListing
+
+VERSION_KEY = 'marketplace:listings:version'
+
+# Query parameters that change the page or its presentation but not the matching listings
+IGNORED_PARAMS = {'page', 'cursor', 'pagination', 'ordering', 'format', 'fields', 'expand'}
+
+PRICE_BUCKETS = (
+    (Decimal('0'), Decimal('50')),
+    (Decimal('50'), Decimal('100')),
+    (Decimal('100'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), None),
+)
+
+CHOICE_FACETS = {
+    'country': dict(WasteListing.COUNTRY_CHOICES),
+    'unit': dict(WasteListing.QUANTITY_UNITS),
+    'status': dict(WasteListing.STATUS_CHOICES),
+}
+
+
+def get_listings_version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def bump_listings_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def cache_key(query_params):
+    """
+    Build a cache key that is identical for equivalent filter sets,
+    whatever the parameter order, repeated values or pagination state.
+    """
+    normalized = []
+    for name in sorted(query_params.keys()):
+        if name in IGNORED_PARAMS:
+            continue
+        values = sorted({value.strip() for value in query_params.getlist(name) if value.strip()})
+        if name == 'search':
+            values = sorted({value.lower() for value in values})
+        if values:
+            normalized.append(f"{name}={','.join(values)}")
+    digest = hashlib.sha1('&'.join(normalized).encode('utf-8')).hexdigest()
+    return f'marketplace:facets:{get_listings_version()}:{digest}'
+
+
+def compute_facets(queryset):
+    queryset = queryset.select_related(None).prefetch_related(None).order_by()
+    facets = {}
+
+    for field, labels in CHOICE_FACETS.items():
+        rows = queryset.values(field).annotate(count=Count('pk')).order_by(field)
+        facets[field] = [
+            {'value': row[field], 'label': labels.get(row[field], row[field]), 'count': row['count']}
+            for row in rows
+        ]
+
+    rows = (
+        queryset.values('waste_type', 'waste_type__name')
+        .annotate(count=Count('pk'))
+        .order_by('waste_type__name')
+    )
+    facets['waste_type'] = [
+        {'value': row['waste_type'], 'label': row['waste_type__name'], 'count': row['count']}
+        for row in rows
+    ]
+
+    buckets = {}
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        buckets[f'bucket_{index}'] = Count('pk', filter=condition)
+    counts = queryset.aggregate(**buckets)
+    facets['price'] = [
+        {
+            'min': str(low),
+            'max': str(high) if high is not None else None,
+            'count': counts[f'bucket_{index}'],
+        }
+        for index, (low, high) in enumerate(PRICE_BUCKETS)
+    ]
+
+    facets['count'] = sum(row['count'] for row in facets['status'])
+    return facets
+
+
+def get_facets(queryset, query_params):
+    key = cache_key(query_params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, getattr(settings, 'MARKETPLACE_FACETS_CACHE_TIMEOUT', 300))
+    return facets
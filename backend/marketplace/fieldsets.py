@@ -0,0 +1,172 @@
+"""
+Sparse fieldsets (`?fields=`) and opt-in expansion (`?expand=`).
+
+`?fields=id,title,price` limits the top-level fields of each object, and
+`?expand=seller` replaces a related object's id with its nested
+representation. Serializers opt in with `SparseFieldsetMixin` and two
+`Meta` options:
+
+- `field_sources`: lookups each computed or nested field reads, e.g.
+  `{'seller_username': ['seller__username']}`. A lookup that ends on a
+  column is loaded with `only()` through a join. A lookup that ends on a
+  relation loads that relation whole (joined, or prefetched when it is
+  multi-valued). `Prefetch` objects are passed through as they are.
+- `expandable_fields`: `{name: (serializer class, extra lookups)}`.
+
+`sparse_queryset()` turns the fields a serializer will render into the
+matching `only()`, `select_related()` and `prefetch_related()` calls, so
+unrequested columns, joins and prefetch queries are skipped as well.
+Requests without either parameter are served exactly as before.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+
+
+def parse_names(query_params, name):
+    """
+    Comma separated names from one or more `name` parameters, or None.
+    """
+    values = query_params.getlist(name)
+    if not values:
+        return None
+    return {part.strip() for value in values for part in value.split(',') if part.strip()}
+
+
+class SparseFieldsetMixin:
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse_fields = fields
+        self.expanded_fields = set(expand or ()) & set(getattr(self.Meta, 'expandable_fields', {}))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name in self.expanded_fields:
+            serializer_class, _ = expandable[name]
+            fields[name] = serializer_class(read_only=True)
+        if self.sparse_fields is not None:
+            fields = {name: field for name, field in fields.items() if name in self.sparse_fields}
+        return fields
+
+
+def resolve_lookup(model, lookup):
+    """
+    Return `(kind, relation path)` for a lookup: 'column' for a concrete field,
+    'select' for single-valued relations, 'prefetch' when a many-valued
+    relation is crossed.
+    """
+    parts = lookup.split('__')
+    many = False
+    for index, part in enumerate(parts):
+        field = model._meta.get_field(part)
+        if not field.is_relation:
+            return 'column', '__'.join(parts[:index])
+        many = many or field.many_to_many or field.one_to_many
+        model = field.related_model
+    return ('prefetch' if many else 'select'), lookup
+
+
+def sparse_queryset(queryset, serializer, keep=()):
+    """
+    Adapt `queryset` to what `serializer` (a `SparseFieldsetMixin` instance)
+    renders. `keep` lists extra columns the view relies on, such as ordering
+    fields used for cursor positions.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    if serializer.sparse_fields is None and not serializer.expanded_fields:
+        return queryset
+
+    model = queryset.model
+    meta = serializer.Meta
+    sources = getattr(meta, 'field_sources', {})
+    expandable = getattr(meta, 'expandable_fields', {})
+
+    columns = {model._meta.pk.name, *keep}
+    joins = set()
+    whole = set()
+    prefetches = []
+    for name, field in serializer.fields.items():
+        if serializer.sparse_fields is None and name not in serializer.expanded_fields:
+            # The view's queryset already covers the default fields
+            continue
+        if name in serializer.expanded_fields:
+            lookups = [name, *expandable[name][1]]
+        elif name in sources:
+            lookups = sources[name]
+        else:
+            try:
+                if model._meta.get_field(field.source).concrete:
+                    columns.add(field.source)
+            except FieldDoesNotExist:
+                pass
+            continue
+
+        for lookup in lookups:
+            if isinstance(lookup, Prefetch):
+                prefetches.append(lookup)
+                continue
+            kind, path = resolve_lookup(model, lookup)
+            if kind == 'column':
+                columns.add(lookup)
+                if path:
+                    joins.add(path)
+            elif kind == 'select':
+                whole.add(path)
+            else:
+                prefetches.append(lookup)
+
+    if serializer.sparse_fields is None:
+        # Expansion only: keep every column, add what the expanded fields need
+        return queryset.select_related(*whole).prefetch_related(*prefetches)
+
+    # A relation loaded whole wins over columns restricted through it
+    columns = {
+        column for column in columns
+        if not any(column.startswith(f'{path}__') for path in whole)
+    }
+    columns.update(path.split('__')[0] for path in whole)
+    return (
+        queryset.select_related(None).prefetch_related(None)
+        .select_related(*joins, *whole)
+        .prefetch_related(*prefetches)
+        .only(*columns)
+    )
+
+
+class SparseFieldsetViewMixin:
+    """
+    Passes `?fields=`/`?expand=` to the serializer on reads and adapts the
+    list and detail querysets to match.
+    """
+    def get_fieldset(self):
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return None
+        params = self.request.query_params
+        fields, expand = parse_names(params, 'fields'), parse_names(params, 'expand')
+        if fields is None and not expand:
+            return None
+        return {'fields': fields, 'expand': expand}
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        fieldset = self.get_fieldset()
+        if fieldset and issubclass(serializer_class, SparseFieldsetMixin):
+            kwargs = {**fieldset, **kwargs}
+        return super().get_serializer(*args, **kwargs)
+
+    def get_sparse_keep(self):
+        return ['created_at', *getattr(self, 'ordering_fields', [])]
+
+    def sparse_queryset(self, queryset):
+        if self.get_fieldset() is None or not issubclass(self.get_serializer_class(), SparseFieldsetMixin):
+            return queryset
+        return sparse_queryset(queryset, self.get_serializer(), keep=self.get_sparse_keep())
+
+    def filter_queryset(self, queryset):
+        return self.sparse_queryset(super().filter_queryset(queryset))
+
+    def list_response(self, queryset):
+        return super().list_response(self.sparse_queryset(queryset))
+
+    async def alist_response(self, queryset):
+        return await super().alist_response(self.sparse_queryset(queryset))
@@ -0,0 +1,74 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import contextlib
+import io
+import sqlite3
+import sys
+
+from django.db import connections
+
+
+def call_wsgi(application, method, path, query='', body=b'', headers=None):
+    """
+    Run one request through a WSGI application, the way a WSGI server
+    would, and return `(status code, response body)`.
+    """
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.version': (1, 0),
+    }
+    for name, value in (headers or {}).items():
+        key = name.upper().replace('-', '_')
+        environ[key if key == 'CONTENT_TYPE' else f'HTTP_{key}'] = value
+
+    result = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        result['status'] = int(status.split(' ', 1)[0])
+
+    response = application(environ, start_response)
+    try:
+        content = b''.join(response)
+    finally:
+        # Sends request_finished, which is where connections are closed or kept
+        response.close()
+    return result['status'], content
+
+
+def copy_sqlite_database(source, target):
+    # The backup API gives a consistent copy even while the source is in use
+    with contextlib.closing(sqlite3.connect(source)) as src, \
+            contextlib.closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+
+
+@contextlib.contextmanager
+def database_settings(alias, overrides):
+    """
+    Temporarily change the settings of a database alias. New thread-local
+    connections are built from this same settings dict.
+    """
+    settings_dict = connections.settings[alias]
+    saved = {name: settings_dict.get(name) for name in overrides}
+    connections[alias].close()
+    settings_dict.update(overrides)
+    try:
+        yield
+    finally:
+        connections[alias].close()
+        settings_dict.update(saved)
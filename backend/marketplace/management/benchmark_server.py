@@ -0,0 +1,42 @@
+"""
+Server entry point for `benchmark_asgi`:
+
+    python -m marketplace.management.benchmark_server <latency ms> <module or script> [args...]
+
+Runs the module (like `python -m`) or script with the remaining arguments,
+after making every database query wait `latency` milliseconds first. The
+wait stands in for the network round trip to a database server, which a
+local SQLite file does not have.
+"""
+import runpy
+import sys
+import time
+
+from django.db.backends.signals import connection_created
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000
+    target = sys.argv[2]
+    sys.argv = [target, *sys.argv[3:]]
+
+    if latency > 0:
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            # The wrapper object outlives its connections, reconnecting must not stack delays
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        connection_created.connect(add_delay, weak=False)
+
+    if target.endswith('.py'):
+        runpy.run_path(target, run_name='__main__')
+    else:
+        runpy.run_module(target, run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+    main()
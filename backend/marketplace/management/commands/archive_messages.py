@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from marketplace.archive import archive_cutoff, archive_messages
+
+
+class Command(BaseCommand):
+    help = 'Moves old read messages to the message archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=None,
+            help='Archive read messages older than this (default: MARKETPLACE_MESSAGE_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Messages moved per transaction'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to archive messages on'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        cutoff = archive_cutoff(options['older_than_days'])
+        moved = archive_messages(cutoff, chunk_size=options['chunk_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} messages created before {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,244 @@
+import asyncio
+import contextlib
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, Q
+from rest_framework.authtoken.models import Token
+
+from marketplace.models import WasteListing
+from ..benchmark import copy_sqlite_database, database_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the hot read endpoints served over WSGI (gunicorn, threads) and ASGI '
+        '(uvicorn, async views) under many concurrent keep-alive connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=256,
+            help='Concurrent client connections (default: 256)'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=15.0,
+            help='Seconds each server is measured for (default: 15)'
+        )
+        parser.add_argument(
+            '--wsgi-threads',
+            type=int,
+            default=32,
+            help='Threads of the gunicorn worker (default: 32)'
+        )
+        parser.add_argument(
+            '--query-latency',
+            type=float,
+            default=0.0,
+            help='Milliseconds added to every database query, like a networked database (default: 0)'
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8765,
+            help='Port the servers listen on (default: 8765)'
+        )
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['wsgi_threads'] < 1 or options['duration'] <= 0:
+            raise CommandError('--connections, --wsgi-threads and --duration must be positive')
+        if options['query_latency'] < 0:
+            raise CommandError('--query-latency must not be negative')
+        for module in ('uvicorn', 'gunicorn'):
+            try:
+                __import__(module)
+            except ImportError:
+                raise CommandError(f'{module} is not installed, run "pipenv install --dev"')
+
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        sqlite = settings_dict['ENGINE'] == 'django.db.backends.sqlite3'
+        with tempfile.TemporaryDirectory() as directory:
+            environ = {**os.environ}
+            if sqlite:
+                # Work on a migrated copy, the benchmark adds a user and token
+                copy = Path(directory) / 'benchmark.sqlite3'
+                copy_sqlite_database(settings_dict['NAME'], copy)
+                environ['DB_NAME'] = str(copy)
+                with database_settings(DEFAULT_DB_ALIAS, {'NAME': copy}):
+                    call_command('migrate', verbosity=0)
+                    endpoints = self.endpoints()
+            else:
+                endpoints = self.endpoints()
+
+            address = ('127.0.0.1', options['port'])
+            launcher = [sys.executable, '-m', 'marketplace.management.benchmark_server', str(options['query_latency'])]
+            servers = [
+                (f"WSGI (gunicorn, {options['wsgi_threads']} threads)", [
+                    *launcher, 'gunicorn', 'agriwaste_project.wsgi:application',
+                    '--worker-class', 'gthread', '--workers', '1',
+                    '--threads', str(options['wsgi_threads']),
+                    '--bind', f'{address[0]}:{address[1]}', '--backlog', '2048',
+                    '--log-level', 'warning',
+                ]),
+                ('ASGI (uvicorn, async views)', [
+                    *launcher, 'manage.py', 'runasgi',
+                    '--host', address[0], '--port', str(address[1]), '--log-level', 'warning',
+                ]),
+            ]
+
+            self.stdout.write(
+                f"{len(endpoints)} endpoints, {options['connections']} connections, "
+                f"{options['duration']:g}s per server, {options['query_latency']:g}ms query latency"
+            )
+            results = []
+            for name, command in servers:
+                with self.server(name, command, environ, address):
+                    results.append((name, asyncio.run(self.load(address, endpoints, options))))
+
+        self.stdout.write(
+            f"{'server':<32}  {'req/s':>8}  {'p50 ms':>8}  {'p99 ms':>8}  {'errors':>6}"
+        )
+        for name, (completed, errors, latencies, elapsed) in results:
+            self.stdout.write(
+                f'{name:<32}  {completed / elapsed:>8.1f}  {self.percentile(latencies, 50):>8.1f}  '
+                f'{self.percentile(latencies, 99):>8.1f}  {errors:>6}'
+            )
+        (_, (wsgi, _, _, wsgi_elapsed)), (_, (asgi, _, _, asgi_elapsed)) = results
+        if wsgi:
+            self.stdout.write(f'ASGI/WSGI throughput: {(asgi / asgi_elapsed) / (wsgi / wsgi_elapsed):.2f}x')
+
+    def endpoints(self):
+        listing = WasteListing.objects.filter(status='ACTIVE').order_by('-created_at').first()
+        if listing is None:
+            raise CommandError('The database needs at least one active listing, see generate_mock_data.sh')
+        # The user with the most unread messages makes messages/unread return something
+        receiver = (
+            User.objects.annotate(unread=Count('received_messages', filter=Q(received_messages__read=False)))
+            .order_by('-unread', 'pk').first()
+        )
+        token, _ = Token.objects.get_or_create(user=receiver)
+        connections[DEFAULT_DB_ALIAS].close()
+
+        auth = {'Authorization': f'Token {token.key}'}
+        return [
+            ('/api/marketplace/listings/', {}),
+            (f'/api/marketplace/listings/{listing.pk}/', {}),
+            ('/api/marketplace/listings/active/', {}),
+            (f'/api/marketplace/listings/by_country/?country={listing.country}', {}),
+            ('/api/marketplace/messages/unread/', auth),
+            ('/api/waste-catalog/categories/', {}),
+            ('/api/waste-catalog/types/', {}),
+        ]
+
+    @contextlib.contextmanager
+    def server(self, name, command, environ, address):
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=environ)
+        try:
+            self.wait_for(name, process, address)
+            yield process
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def wait_for(self, name, process, address, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'{name} exited with status {process.returncode}')
+            try:
+                socket.create_connection(address, timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'{name}: nothing listening on {address[0]}:{address[1]} after {timeout}s')
+
+    async def load(self, address, endpoints, options):
+        # Every endpoint once, so imports and caches are warm before timing starts
+        await self.client(address, endpoints, 0, time.monotonic() + 60, [], [0], limit=len(endpoints))
+
+        latencies = []
+        errors = [0]
+        started = time.monotonic()
+        deadline = started + options['duration']
+        await asyncio.gather(*(
+            self.client(address, endpoints, index, deadline, latencies, errors)
+            for index in range(options['connections'])
+        ))
+        return len(latencies), errors[0], latencies, time.monotonic() - started
+
+    async def client(self, address, endpoints, index, deadline, latencies, errors, limit=None):
+        """
+        One keep-alive connection sending requests back to back until the
+        deadline, cycling through the endpoints from its own offset.
+        """
+        reader = writer = None
+        sent = 0
+        while time.monotonic() < deadline and (limit is None or sent < limit):
+            path, headers = endpoints[(index + sent) % len(endpoints)]
+            sent += 1
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(*address)
+                request = f'GET {path} HTTP/1.1\r\nHost: {address[0]}\r\nAccept: application/json\r\n'
+                request += ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+                started = time.monotonic()
+                writer.write(f'{request}\r\n'.encode('latin-1'))
+                status, keep_alive = await self.read_response(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors[0] += 1
+                writer = self.close(writer)
+                continue
+            if status == 200:
+                latencies.append((time.monotonic() - started) * 1000)
+            else:
+                errors[0] += 1
+            if not keep_alive:
+                writer = self.close(writer)
+        self.close(writer)
+
+    async def read_response(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ', 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip().lower()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers.get('connection') != 'close'
+
+    @staticmethod
+    def close(writer):
+        if writer is not None:
+            writer.close()
+        return None
+
+    @staticmethod
+    def percentile(values, percent):
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100)[percent - 1]
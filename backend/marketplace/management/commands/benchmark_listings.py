@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ..benchmark import call_wsgi, database_settings
+
+ENDPOINTS = [
+    ('listings', '/api/marketplace/listings/', ''),
+    ('listings active', '/api/marketplace/listings/active/', ''),
+    ('listings by country', '/api/marketplace/listings/by_country/', 'country=TN'),
+    ('listings cursor page', '/api/marketplace/listings/', 'pagination=cursor'),
+    ('listing facets', '/api/marketplace/listings/facets/', ''),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures listing endpoint throughput through the full WSGI stack, with a '
+        'new database connection per request versus the configured connection settings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Requests per endpoint and configuration (default: 500)'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='Worker threads, like a threaded WSGI server (default: 4)'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias whose connection settings are compared (default: "default")'
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections.settings:
+            raise CommandError(f'Unknown database alias "{alias}"')
+        if options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError('--requests and --threads must be positive')
+
+        configured = connections.settings[alias]
+        per_request = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {
+            name: value for name, value in configured['OPTIONS'].items() if name != 'pool'
+        }}
+        if configured['CONN_MAX_AGE'] or configured['OPTIONS'].get('pool'):
+            reused = ('configured', {})
+        else:
+            # The current settings already open a connection per request
+            reused = ('persistent connections', {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True})
+        profiles = [('per-request connections', per_request), reused]
+
+        self.stdout.write(
+            f"{configured['ENGINE'].rsplit('.', 1)[-1]}: CONN_MAX_AGE={configured['CONN_MAX_AGE']}, "
+            f"CONN_HEALTH_CHECKS={configured['CONN_HEALTH_CHECKS']}, "
+            f"pool={'on' if configured['OPTIONS'].get('pool') else 'off'}"
+        )
+        application = WSGIHandler()
+        results = {}
+        for profile, overrides in profiles:
+            with database_settings(alias, overrides):
+                for name, path, query in ENDPOINTS:
+                    # One untimed request warms up caches and imports
+                    call_wsgi(application, 'GET', path, query)
+                    results[profile, name] = self.run(application, path, query, options)
+
+        width = max(len(name) for name, _, _ in ENDPOINTS)
+        header = '  '.join(f'{profile:>24}' for profile, _ in profiles)
+        self.stdout.write(f"{'endpoint':<{width}}  {header}  {'speedup':>8}")
+        for name, _, _ in ENDPOINTS:
+            rates = [results[profile, name] for profile, _ in profiles]
+            columns = '  '.join(f'{rate:>18.1f} req/s' for rate in rates)
+            self.stdout.write(f'{name:<{width}}  {columns}  {rates[1] / rates[0]:>7.2f}x')
+
+    def run(self, application, path, query, options):
+        total = options['requests']
+        errors = []
+
+        def worker(count):
+            try:
+                for _ in range(count):
+                    status, _ = call_wsgi(application, 'GET', path, query)
+                    if status != 200:
+                        errors.append(status)
+            finally:
+                # Worker threads own their connections, the pool is shared
+                connections.close_all()
+
+        counts = [total // options['threads']] * options['threads']
+        for index in range(total % options['threads']):
+            counts[index] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(worker, [count for count in counts if count]))
+        elapsed = time.perf_counter() - started
+
+        if errors:
+            raise CommandError(f'{path}?{query}: unexpected status {errors[0]}')
+        return total / elapsed
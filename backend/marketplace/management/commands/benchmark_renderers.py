@@ -0,0 +1,98 @@
+import json
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from agriwaste_project.renderers import ORJSONRenderer, MessagePackRenderer, orjson, msgpack
+from marketplace.models import WasteListing, ListingImage
+from marketplace.serializers import WasteListingSerializer
+from marketplace.views import listing_queryset
+from waste_catalog.models import WasteCategory, WasteType
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares DRF\'s JSONRenderer with the orjson and MessagePack renderers '
+        'on a page of serialized listings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Listings on the rendered page (default: 100)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Renders per renderer (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        if options['page_size'] < 1 or options['iterations'] < 1:
+            raise CommandError('--page-size and --iterations must be positive')
+
+        renderers = [('JSONRenderer (stdlib json)', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('ORJSONRenderer', ORJSONRenderer()))
+        if msgpack is not None:
+            renderers.append(('MessagePackRenderer', MessagePackRenderer()))
+
+        # The listings only exist for the duration of the benchmark
+        with transaction.atomic():
+            data = self.page(options['page_size'])
+            transaction.set_rollback(True)
+
+        baseline = JSONRenderer().render(data)
+        if orjson is not None and json.loads(ORJSONRenderer().render(data)) != json.loads(baseline):
+            raise CommandError('ORJSONRenderer output differs from JSONRenderer')
+
+        self.stdout.write(f"{'renderer':<28}  {'ms/page':>8}  {'bytes':>8}  {'speedup':>8}")
+        reference = None
+        for name, renderer in renderers:
+            started = time.perf_counter()
+            for _ in range(options['iterations']):
+                content = renderer.render(data)
+            elapsed = (time.perf_counter() - started) / options['iterations'] * 1000
+            reference = reference or elapsed
+            self.stdout.write(f'{name:<28}  {elapsed:>8.3f}  {len(content):>8}  {reference / elapsed:>7.1f}x')
+
+    def page(self, size):
+        seller = User.objects.create(username='benchmark_renderers_seller')
+        category = WasteCategory.objects.create(name='Benchmark category')
+        waste_type = WasteType.objects.create(category=category, name='Benchmark type')
+        listings = WasteListing.objects.bulk_create(
+            WasteListing(
+                seller=seller,
+                waste_type=waste_type,
+                title=f'Benchmark listing {i}',
+                description='Olive pomace from the autumn harvest, dried and bagged. ' * 3,
+                quantity=Decimal(random.randint(1, 1000)),
+                unit='KG',
+                price=Decimal(random.randint(100, 500000)) / 100,
+                location='Sfax',
+                country='TN',
+                available_from=date.today(),
+            )
+            for i in range(size)
+        )
+        ListingImage.objects.bulk_create(
+            ListingImage(listing=listing, image=f'listing_images/benchmark_{listing.pk}_{n}.jpg', is_primary=n == 0)
+            for listing in listings
+            for n in range(2)
+        )
+
+        request = Request(APIRequestFactory().get('/api/marketplace/listings/', SERVER_NAME='localhost'))
+        queryset = listing_queryset().filter(seller=seller).order_by('-created_at', '-id')
+        results = WasteListingSerializer(queryset, many=True, context={'request': request}).data
+        return {'count': size, 'next': None, 'previous': None, 'results': results}
@@ -0,0 +1,173 @@
+import contextlib
+import io
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.authtoken.models import Token
+
+from agriwaste_project.database import sqlite_tuning
+from marketplace.models import WasteListing
+from ..benchmark import call_wsgi, copy_sqlite_database, database_settings
+
+READS = [
+    ('/api/marketplace/listings/', ''),
+    ('/api/marketplace/listings/active/', ''),
+    ('/api/marketplace/messages/my_messages/', ''),
+    ('/api/marketplace/orders/my_orders/', ''),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs concurrent marketplace reads and message/order writes against copies of the '
+        'SQLite database, in the stock and the tuned (WAL, IMMEDIATE) mode'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10.0,
+            help='Seconds each mode runs for (default: 10)'
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=8,
+            help='Reader threads (default: 8)'
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=4,
+            help='Writer threads (default: 4)'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='SQLite database alias to copy (default: "default")'
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections.settings:
+            raise CommandError(f'Unknown database alias "{alias}"')
+        settings_dict = connections.settings[alias]
+        if settings_dict['ENGINE'] != 'django.db.backends.sqlite3' or connections[alias].is_in_memory_db():
+            raise CommandError(f'"{alias}" is not a file-backed SQLite database')
+        if options['readers'] < 0 or options['writers'] < 1:
+            raise CommandError('--writers must be positive and --readers not negative')
+
+        defaults = sqlite_tuning(mmap_size=256 * 1024 * 1024, cache_size=64 * 1024, busy_timeout=5000)
+        modes = [
+            ('stock', {'OPTIONS': {}, 'PRAGMAS': {}}),
+            ('tuned', {'OPTIONS': settings_dict['OPTIONS'] or defaults['OPTIONS'],
+                       'PRAGMAS': settings_dict.get('PRAGMAS') or defaults['PRAGMAS']}),
+        ]
+
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, overrides in modes:
+                copy = Path(directory) / f'{mode}.sqlite3'
+                copy_sqlite_database(settings_dict['NAME'], copy)
+                with database_settings(alias, {'NAME': copy, **overrides}):
+                    results.append((mode, self.run(alias, options)))
+
+        self.stdout.write(
+            f"{'mode':<6}  {'reads/s':>9}  {'writes/s':>9}  {'failed reads':>12}  {'failed writes':>13}"
+        )
+        for mode, (reads, writes, failed_reads, failed_writes, elapsed) in results:
+            self.stdout.write(
+                f'{mode:<6}  {reads / elapsed:>9.1f}  {writes / elapsed:>9.1f}  '
+                f'{failed_reads:>12}  {failed_writes:>13}'
+            )
+
+    def prepare_writer(self, alias, index):
+        user, _ = User.objects.using(alias).get_or_create(username=f'benchmark_writer_{index}')
+        token, _ = Token.objects.using(alias).get_or_create(user=user)
+        listing = (
+            WasteListing.objects.using(alias)
+            .filter(status='ACTIVE').exclude(seller=user)
+            .order_by('-created_at').first()
+        )
+        if listing is None:
+            raise CommandError('The database needs at least one active listing, see generate_mock_data.sh')
+        # Orders reserve quantity, so make sure the run cannot sell the listing out
+        WasteListing.objects.using(alias).filter(pk=listing.pk).update(quantity=Decimal('99999999'))
+        return user, token.key, listing
+
+    def run(self, alias, options):
+        call_command('migrate', database=alias, verbosity=0)
+        writers = [self.prepare_writer(alias, index) for index in range(options['writers'])]
+        connections[alias].close()
+
+        application = WSGIHandler()
+        counters = {'reads': 0, 'writes': 0, 'failed_reads': 0, 'failed_writes': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def count(name):
+            with lock:
+                counters[name] += 1
+
+        def reader(index):
+            _, key, _ = writers[index % len(writers)]
+            headers = {'Authorization': f'Token {key}'}
+            requests = 0
+            while time.monotonic() < deadline:
+                path, query = READS[requests % len(READS)]
+                status, _ = call_wsgi(application, 'GET', path, query, headers=headers)
+                count('reads' if status == 200 else 'failed_reads')
+                requests += 1
+
+        def writer(index):
+            user, key, listing = writers[index]
+            headers = {'Authorization': f'Token {key}', 'Content-Type': 'application/json'}
+            requests = 0
+            while time.monotonic() < deadline:
+                if requests % 2:
+                    path, payload = '/api/marketplace/orders/', {
+                        'listing': listing.pk, 'buyer': user.pk, 'quantity': '1',
+                        'shipping_address': 'Benchmark',
+                    }
+                else:
+                    path, payload = '/api/marketplace/messages/', {
+                        'receiver': listing.seller_id, 'subject': 'Benchmark',
+                        'content': f'Message {requests} from writer {index}',
+                    }
+                body = json.dumps(payload, default=str).encode('utf-8')
+                status, _ = call_wsgi(application, 'POST', path, body=body, headers=headers)
+                count('writes' if status == 201 else 'failed_writes')
+                requests += 1
+
+        def target(function, index):
+            try:
+                function(index)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=target, args=(reader, index)) for index in range(options['readers'])]
+        threads += [threading.Thread(target=target, args=(writer, index)) for index in range(options['writers'])]
+
+        started = time.monotonic()
+        # The views print debug output for every message
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.monotonic() - started
+
+        return (
+            counters['reads'], counters['writes'],
+            counters['failed_reads'], counters['failed_writes'], elapsed,
+        )
@@ -0,0 +1,210 @@
+import random
+import re
+from datetime import date
+from decimal import Decimal
+from itertools import product
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from marketplace.models import WasteListing, ListingImage, Order, Message
+from marketplace.views import WasteListingViewSet, OrderViewSet, MessageViewSet
+from waste_catalog.models import WasteCategory, WasteType
+
+# (name, viewset, action, query params, authenticated)
+ENDPOINTS = [
+    ('listings', WasteListingViewSet, 'list', {}, False),
+    ('listings ordered by price', WasteListingViewSet, 'list', {'ordering': 'price'}, False),
+    ('listings best rated', WasteListingViewSet, 'list', {'ordering': '-rating_average'}, False),
+    ('listings by seller reputation', WasteListingViewSet, 'list', {'ordering': '-seller_reputation'}, False),
+    ('listings active', WasteListingViewSet, 'active', {}, False),
+    ('listings active by country', WasteListingViewSet, 'active', {'country': 'TN'}, False),
+    ('listings by_country', WasteListingViewSet, 'by_country', {'country': 'DZ'}, False),
+    ('listings my_listings', WasteListingViewSet, 'my_listings', {}, True),
+    ('orders', OrderViewSet, 'list', {}, True),
+    ('orders my_orders', OrderViewSet, 'my_orders', {}, True),
+    ('orders my_sales', OrderViewSet, 'my_sales', {}, True),
+    ('messages', MessageViewSet, 'list', {}, True),
+    ('messages my_messages', MessageViewSet, 'my_messages', {}, True),
+    ('messages unread', MessageViewSet, 'unread', {}, True),
+]
+
+# Page numbers (the default, a COUNT and an OFFSET page) and keyset cursors
+PAGINATIONS = [('page', {}), ('cursor', {'pagination': 'cursor'})]
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)(?: AS \S+)?$')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\S+)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs EXPLAIN on the queries issued by the marketplace viewsets, with page number '
+        'and cursor pagination, against a seeded dataset and fails if any of them falls '
+        'back to a full table scan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=100000,
+            help='Number of listings, orders and messages to seed (default: 100000)'
+        )
+        parser.add_argument(
+            '--no-seed',
+            action='store_true',
+            help='Explain against the existing data instead of a seeded dataset'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Unsupported database vendor "{connection.vendor}"')
+
+        # Everything happens in a transaction that is rolled back at the end
+        with transaction.atomic():
+            if options['no_seed']:
+                user = User.objects.filter(listings__isnull=False).first() or User.objects.first()
+            else:
+                user = self.seed(options['rows'])
+            self.analyze()
+            failures = self.explain_endpoints(user)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"Full table scan in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('All viewset queries use indexes'))
+
+    def seed(self, rows):
+        self.stdout.write(f'Seeding {rows} listings with images, orders and messages...')
+        users = User.objects.bulk_create(
+            User(username=f'explain_user_{i}') for i in range(max(rows // 100, 10))
+        )
+        category = WasteCategory.objects.create(name='Explain category')
+        waste_types = WasteType.objects.bulk_create(
+            WasteType(category=category, name=f'Explain type {i}') for i in range(20)
+        )
+
+        statuses = ['ACTIVE'] * 6 + ['SOLD'] * 2 + ['PAUSED', 'EXPIRED']
+        countries = [code for code, _ in WasteListing.COUNTRY_CHOICES]
+        ratings = [random.randint(0, 20) for _ in range(rows)]
+        listings = WasteListing.objects.bulk_create(
+            (
+                WasteListing(
+                    seller=random.choice(users),
+                    waste_type=random.choice(waste_types),
+                    title=f'Explain listing {i}',
+                    description='Seeded for query plan checks',
+                    quantity=Decimal(random.randint(1, 1000)),
+                    unit='KG',
+                    price=Decimal(random.randint(1, 5000)),
+                    location='Tunis',
+                    country=random.choice(countries),
+                    available_from=date.today(),
+                    status=random.choice(statuses),
+                    rating_count=ratings[i],
+                    rating_sum=ratings[i] * 4,
+                    rating_average=Decimal(4 if ratings[i] else 0),
+                )
+                for i in range(rows)
+            ),
+            batch_size=5000,
+        )
+        # Up to three images per listing, the last one primary, like the listing form uploads them
+        ListingImage.objects.bulk_create(
+            (
+                ListingImage(
+                    listing=listing,
+                    image=f'listing_images/explain_{listing.pk}_{j}.jpg',
+                    is_primary=(j == count - 1),
+                )
+                for listing in listings
+                for count in [random.randint(0, 3)]
+                for j in range(count)
+            ),
+            batch_size=5000,
+        )
+        Order.objects.bulk_create(
+            (
+                Order(
+                    buyer=random.choice(users),
+                    listing=random.choice(listings),
+                    quantity=Decimal('1'),
+                    total_price=Decimal('10'),
+                    shipping_address='Tunis',
+                )
+                for _ in range(rows)
+            ),
+            batch_size=5000,
+        )
+        Message.objects.bulk_create(
+            (
+                Message(
+                    sender=random.choice(users),
+                    receiver=random.choice(users),
+                    subject='Explain',
+                    content='Seeded for query plan checks',
+                    read=random.random() < 0.8,
+                )
+                for _ in range(rows)
+            ),
+            batch_size=5000,
+        )
+        return users[0]
+
+    def analyze(self):
+        # Give the planner statistics for the freshly seeded tables
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain_endpoints(self, user):
+        factory = APIRequestFactory()
+        failures = []
+        for (name, viewset, action, params, authenticated), (label, pagination) in product(ENDPOINTS, PAGINATIONS):
+            name = f'{name} ({label})'
+            view = viewset.as_view({'get': action})
+            request = factory.get('/', {**params, **pagination}, SERVER_NAME='localhost')
+            if authenticated:
+                force_authenticate(request, user=user)
+
+            with CaptureQueriesContext(connection) as context:
+                response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f'{name}: unexpected status {response.status_code}')
+
+            scans = []
+            for query in context.captured_queries:
+                if not query['sql'].lstrip().upper().startswith('SELECT'):
+                    continue
+                plan = self.explain(query['sql'])
+                scans.extend(self.full_scans(plan))
+
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {', '.join(sorted(set(scans)))}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK         {name}'))
+        return failures
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        if connection.vendor == 'sqlite':
+            return [row[-1] for row in rows]
+        return [row[0] for row in rows]
+
+    def full_scans(self, plan):
+        pattern = SQLITE_FULL_SCAN if connection.vendor == 'sqlite' else POSTGRES_FULL_SCAN
+        tables = []
+        for line in plan:
+            if self.verbosity > 1:
+                self.stdout.write(f'    {line}')
+            match = pattern.search(line.strip())
+            if match:
+                tables.append(match.group(1).strip('"'))
+        return tables
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from marketplace.models import WasteListing
+from marketplace.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for marketplace listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the index on'
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            if not rebuild_index(using=using):
+                raise CommandError(f'No full-text search backend for database "{using}"')
+        count = WasteListing.objects.using(using).count()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} listings'))
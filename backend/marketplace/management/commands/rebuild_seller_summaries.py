@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from marketplace.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recounts the seller dashboard summaries from orders, listings and messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seller',
+            type=int,
+            action='append',
+            dest='sellers',
+            help='Only rebuild this seller (repeatable)'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the summaries on'
+        )
+
+    def handle(self, *args, **options):
+        rows = rebuild_summaries(options['sellers'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} summary rows'))
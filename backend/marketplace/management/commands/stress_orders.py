@@ -0,0 +1,179 @@
+import contextlib
+import io
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from agriwaste_project.database import sqlite_tuning
+from marketplace.models import Order, WasteListing
+from waste_catalog.models import WasteCategory, WasteType
+from ..benchmark import call_wsgi, copy_sqlite_database, database_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Has many buyers order the same listing at once, while its seller keeps editing it, on a '
+        'copy of the SQLite database, and checks that the listing was not oversold'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--buyers',
+            type=int,
+            default=16,
+            help='Buyer threads (default: 16)'
+        )
+        parser.add_argument(
+            '--orders',
+            type=int,
+            default=20,
+            help='Orders each buyer tries to place (default: 20)'
+        )
+        parser.add_argument(
+            '--quantity',
+            type=int,
+            default=100,
+            help='Quantity of the listing they all order from (default: 100)'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='SQLite database alias to copy (default: "default")'
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections.settings:
+            raise CommandError(f'Unknown database alias "{alias}"')
+        settings_dict = connections.settings[alias]
+        if settings_dict['ENGINE'] != 'django.db.backends.sqlite3' or connections[alias].is_in_memory_db():
+            raise CommandError(f'"{alias}" is not a file-backed SQLite database')
+        if min(options['buyers'], options['orders'], options['quantity']) < 1:
+            raise CommandError('--buyers, --orders and --quantity must be positive')
+
+        defaults = sqlite_tuning(mmap_size=256 * 1024 * 1024, cache_size=64 * 1024, busy_timeout=5000)
+        overrides = {
+            'OPTIONS': settings_dict['OPTIONS'] or defaults['OPTIONS'],
+            'PRAGMAS': settings_dict.get('PRAGMAS') or defaults['PRAGMAS'],
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            copy = Path(directory) / 'stress.sqlite3'
+            copy_sqlite_database(settings_dict['NAME'], copy)
+            # The catalog rows it creates must not rebuild the real catalog snapshot
+            with database_settings(alias, {'NAME': copy, **overrides}), \
+                    override_settings(WASTE_CATALOG_SNAPSHOT_DIR=Path(directory) / 'catalog'):
+                self.run(alias, options)
+
+    def prepare(self, alias, options):
+        call_command('migrate', database=alias, verbosity=0)
+        seller, _ = User.objects.using(alias).get_or_create(username='stress_seller')
+        seller_token, _ = Token.objects.using(alias).get_or_create(user=seller)
+        category, _ = WasteCategory.objects.using(alias).get_or_create(name='Stress test')
+        waste_type, _ = WasteType.objects.using(alias).get_or_create(category=category, name='Stress test')
+        listing = WasteListing.objects.using(alias).create(
+            seller=seller, waste_type=waste_type, title='Stress test lot', description='Ordered by every buyer',
+            quantity=Decimal(options['quantity']), unit='KG', price=Decimal('1.00'), location='Sfax',
+            available_from=timezone.localdate(),
+        )
+        buyers = []
+        for index in range(options['buyers']):
+            user, _ = User.objects.using(alias).get_or_create(username=f'stress_buyer_{index}')
+            token, _ = Token.objects.using(alias).get_or_create(user=user)
+            buyers.append((user, token.key))
+        return listing, seller_token.key, buyers
+
+    def run(self, alias, options):
+        listing, seller_key, buyers = self.prepare(alias, options)
+        connections[alias].close()
+
+        application = WSGIHandler()
+        statuses = {}
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(buyers) + 1)
+        done = threading.Event()
+        edits = {}
+
+        def buyer(index):
+            user, key = buyers[index]
+            headers = {'Authorization': f'Token {key}', 'Content-Type': 'application/json'}
+            barrier.wait()
+            for attempt in range(options['orders']):
+                body = json.dumps({
+                    'listing': listing.pk, 'buyer': user.pk,
+                    # Mixed sizes, so the last units are fought over by orders that no longer fit
+                    'quantity': str(1 + (index + attempt) % 3), 'shipping_address': 'Stress test',
+                }).encode('utf-8')
+                status, _ = call_wsgi(application, 'POST', '/api/marketplace/orders/', body=body, headers=headers)
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+
+        def seller():
+            # Saves of the listing loaded before an order must not undo its reservation
+            headers = {'Authorization': f'Token {seller_key}', 'Content-Type': 'application/json'}
+            barrier.wait()
+            edit = 0
+            while not done.is_set():
+                body = json.dumps({'title': f'Stress test lot, edit {edit}'}).encode('utf-8')
+                status, _ = call_wsgi(
+                    application, 'PATCH', f'/api/marketplace/listings/{listing.pk}/', body=body, headers=headers
+                )
+                edits[status] = edits.get(status, 0) + 1
+                edit += 1
+
+        def target(function, *args):
+            try:
+                function(*args)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=target, args=(buyer, index)) for index in range(len(buyers))]
+        editor = threading.Thread(target=target, args=(seller,))
+        started = time.monotonic()
+        # The views print debug output for every request
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor.start()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            done.set()
+            editor.join()
+        elapsed = time.monotonic() - started
+
+        listing.refresh_from_db(using=alias)
+        orders = Order.objects.using(alias).filter(listing=listing)
+        ordered = orders.aggregate(total=Sum('quantity'))['total'] or Decimal(0)
+        placed = statuses.get(201, 0)
+        requests = sum(statuses.values())
+        self.stdout.write(
+            f'{requests} requests in {elapsed:.1f}s ({requests / elapsed:.1f}/s): {placed} placed, '
+            f'{statuses.get(400, 0)} refused, {requests - placed - statuses.get(400, 0)} failed'
+        )
+        self.stdout.write(
+            f'{sum(edits.values())} listing edits by the seller, '
+            f'{sum(edits.values()) - edits.get(200, 0)} failed'
+        )
+        self.stdout.write(
+            f'Ordered {ordered} of {options["quantity"]}, {listing.quantity} left, listing {listing.status}'
+        )
+
+        if orders.count() != placed:
+            raise CommandError(f'{orders.count()} orders were stored for {placed} placed')
+        if listing.quantity < 0 or ordered + listing.quantity != options['quantity']:
+            raise CommandError(f'Oversold: {ordered} ordered, {listing.quantity} left of {options["quantity"]}')
+        if (listing.quantity == 0) != (listing.status == 'SOLD'):
+            raise CommandError(f'A listing with {listing.quantity} left is {listing.status}')
+        self.stdout.write(self.style.SUCCESS('No oversell'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.reputation import update_reputations
+
+
+class Command(BaseCommand):
+    help = 'Recomputes seller reputation scores and copies them to their listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seller',
+            type=int,
+            action='append',
+            dest='sellers',
+            help='Only update this seller (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        changed = update_reputations(options['sellers'])
+        self.stdout.write(self.style.SUCCESS(f'Updated {changed} seller reputations'))
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_listing_search_index'),
+        ('waste_catalog', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', '-created_at', '-id'], name='message_sender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', '-created_at', '-id'], name='message_receiver_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('read', False)), fields=['receiver', '-created_at', '-id'], name='message_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['buyer', '-created_at', '-id'], name='order_buyer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['listing', '-created_at', '-id'], name='order_listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['-created_at', '-id'], name='listing_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['price', 'id'], name='listing_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['available_from', 'id'], name='listing_available_from_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='listing_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['status', 'country', '-created_at', '-id'], name='listing_status_country_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['seller', '-created_at', '-id'], name='listing_seller_created_idx'),
+        ),
+    ]
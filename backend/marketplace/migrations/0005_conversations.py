@@ -0,0 +1,127 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:46
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def backfill_conversations(apps, schema_editor):
+    from marketplace.conversations import PREVIEW_LENGTH, conversation_key
+
+    Message = apps.get_model('marketplace', 'Message')
+    Conversation = apps.get_model('marketplace', 'Conversation')
+    ConversationParticipant = apps.get_model('marketplace', 'ConversationParticipant')
+    db = schema_editor.connection.alias
+
+    threads = {}
+    rows = (
+        Message.objects.using(db).order_by('created_at', 'id')
+        .values_list('id', 'sender_id', 'receiver_id', 'listing_id', 'content', 'read', 'created_at')
+        .iterator(chunk_size=2000)
+    )
+    for pk, sender_id, receiver_id, listing_id, content, read, created_at in rows:
+        key = conversation_key(sender_id, receiver_id, listing_id)
+        thread = threads.setdefault(key, {
+            'listing_id': listing_id, 'users': {sender_id, receiver_id}, 'messages': [], 'unread': Counter(),
+        })
+        thread['messages'].append(pk)
+        thread['last'] = (pk, content, created_at)
+        if not read:
+            thread['unread'][receiver_id] += 1
+
+    Conversation.objects.using(db).bulk_create([
+        Conversation(
+            key=key,
+            listing_id=thread['listing_id'],
+            last_message_id=thread['last'][0],
+            last_message_at=thread['last'][2],
+            last_message_preview=Truncator(thread['last'][1]).chars(PREVIEW_LENGTH),
+        )
+        for key, thread in threads.items()
+    ], batch_size=500)
+    # bulk_create() does not return primary keys on every backend
+    ids = dict(Conversation.objects.using(db).values_list('key', 'id'))
+    ConversationParticipant.objects.using(db).bulk_create([
+        ConversationParticipant(
+            conversation_id=ids[key],
+            user_id=user_id,
+            unread_count=thread['unread'][user_id],
+            last_message_at=thread['last'][2],
+        )
+        for key, thread in threads.items()
+        for user_id in sorted(thread['users'])
+    ], batch_size=500)
+    for key, thread in threads.items():
+        for start in range(0, len(thread['messages']), 500):
+            Message.objects.using(db).filter(pk__in=thread['messages'][start:start + 500]).update(
+                conversation_id=ids[key]
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_message_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-last_message_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('last_message_at', models.DateTimeField()),
+                ('last_message_preview', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='marketplace.message')),
+                ('listing', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='marketplace.wastelisting')),
+            ],
+            options={
+                'ordering': ['-last_message_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='marketplace.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-created_at', '-id'], name='message_conversation_idx'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='marketplace.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='participant_inbox_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='conversationparticipant',
+            unique_together={('conversation', 'user')},
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
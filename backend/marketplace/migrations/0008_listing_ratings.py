@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    WasteListing = apps.get_model('marketplace', 'WasteListing')
+    Review = apps.get_model('marketplace', 'Review')
+    db = schema_editor.connection.alias
+
+    totals = Review.objects.using(db).order_by().values_list('listing').annotate(Count('pk'), Sum('rating'))
+    for listing_id, count, total in totals:
+        WasteListing.objects.using(db).filter(pk=listing_id).update(
+            rating_count=count,
+            rating_sum=total,
+            rating_average=(Decimal(total) / count).quantize(Decimal('0.01')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0007_seller_summary'),
+        ('waste_catalog', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wastelisting',
+            name='rating_average',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=4),
+        ),
+        migrations.AddField(
+            model_name='wastelisting',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='wastelisting',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['rating_average', 'id'], name='listing_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['rating_count', 'id'], name='listing_rating_count_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_listing_ratings'),
+        ('waste_catalog', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wastelisting',
+            name='seller_reputation',
+            field=models.DecimalField(decimal_places=2, default=50, editable=False, max_digits=5),
+        ),
+        migrations.AddIndex(
+            model_name='wastelisting',
+            index=models.Index(fields=['seller_reputation', 'id'], name='listing_reputation_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_listing_seller_reputation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listingimage',
+            index=models.Index(fields=['listing', '-is_primary', '-created_at'], name='listingimage_listing_idx'),
+        ),
+        migrations.AlterField(
+            model_name='listingimage',
+            name='listing',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='images', to='marketplace.wastelisting'),
+        ),
+    ]
@@ -1,14 +1,61 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from waste_catalog.models import WasteType
 
-class WasteListing(models.Model):
+
+class LoadedValuesMixin:
+    """
+    Track which of `tracked_fields` (attribute names) a save changes.
+
+    During `save()`, and so in `pre_save`/`post_save` receivers,
+    `saved_changes` maps each tracked field that differs from its value when
+    the instance was loaded, refreshed or last saved to that previous value.
+    Queryset `update()` calls bypass it.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_values = {name: loaded[name] for name in cls.tracked_fields if name in loaded}
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        refreshed = None if fields is None else {self._meta.get_field(name).attname for name in fields}
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', {})
+        self._loaded_values = {**loaded, **{
+            name: getattr(self, name) for name in self.tracked_fields
+            if (refreshed is None or name in refreshed) and name not in deferred
+        }}
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_values', {})
+        self.saved_changes = {name: value for name, value in loaded.items() if getattr(self, name) != value}
+        super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.tracked_fields}
+
+class ListingChanged(Exception):
+    """
+    A listing's quantity or status moved since it was loaded, so the change
+    being saved no longer applies.
+    """
+
+
+class WasteListing(LoadedValuesMixin, models.Model):
     STATUS_CHOICES = (
         ('ACTIVE', 'Active'),
         ('SOLD', 'Sold'),
         ('EXPIRED', 'Expired'),
         ('PAUSED', 'Paused'),
     )
+    tracked_fields = ('status', 'seller_id', 'currency', 'quantity')
+    DERIVED_FIELDS = ('rating_count', 'rating_sum', 'rating_average', 'seller_reputation')
+    # Also written by order reservations, see marketplace.reservations
+    RESERVED_FIELDS = ('quantity', 'status')
     
     QUANTITY_UNITS = (
         ('KG', 'Kilograms'),
@@ -44,17 +91,84 @@ class WasteListing(models.Model):
     available_until = models.DateField(blank=True, null=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ACTIVE')
     featured = models.BooleanField(default=False)
+    # Maintained from reviews, see marketplace.ratings
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_average = models.DecimalField(max_digits=4, decimal_places=2, default=0, editable=False)
+    # Copy of the seller's UserProfile.reputation_score, see marketplace.reputation
+    seller_reputation = models.DecimalField(max_digits=5, decimal_places=2, default=50, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Ratings and reputation are only written by marketplace.ratings and
+        # marketplace.reputation, so saving a listing loaded before a review
+        # cannot put back stale values. Quantity and status are only written
+        # when they changed, on top of what orders did to them meanwhile.
+        reserved = {}
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            loaded = getattr(self, '_loaded_values', {})
+            reserved = {
+                name: loaded[name] for name in self.RESERVED_FIELDS
+                if name in loaded and getattr(self, name) != loaded[name]
+            }
+            skipped = [*self.DERIVED_FIELDS, *(name for name in self.RESERVED_FIELDS if name in loaded)]
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        if not reserved:
+            super().save(*args, **kwargs)
+            return
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self.save_reserved_fields(reserved, using)
+            super().save(*args, **kwargs)
+
+    def save_reserved_fields(self, loaded, using):
+        """
+        Write the changed quantity and status with one conditional UPDATE.
+        The status only changes from the one loaded, and the quantity by the
+        difference to the loaded one, so units reserved since stay taken.
+        Raises ListingChanged if the row no longer allows it.
+        """
+        listings = WasteListing.objects.using(using).filter(pk=self.pk)
+        values = {}
+        if 'status' in loaded:
+            listings = listings.filter(status=loaded['status'])
+            values['status'] = self.status
+        if 'quantity' in loaded:
+            difference = self.quantity - loaded['quantity']
+            listings = listings.filter(quantity__gte=-difference)
+            values['quantity'] = F('quantity') + difference
+        if not listings.update(**values):
+            raise ListingChanged
+        if 'quantity' in loaded:
+            self.quantity = WasteListing.objects.using(using).values_list('quantity', flat=True).get(pk=self.pk)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Default listing order and its keyset pagination tiebreaker
+            models.Index(fields=['-created_at', '-id'], name='listing_created_idx'),
+            models.Index(fields=['price', 'id'], name='listing_price_idx'),
+            models.Index(fields=['available_from', 'id'], name='listing_available_from_idx'),
+            models.Index(fields=['rating_average', 'id'], name='listing_rating_idx'),
+            models.Index(fields=['rating_count', 'id'], name='listing_rating_count_idx'),
+            models.Index(fields=['seller_reputation', 'id'], name='listing_reputation_idx'),
+            # active and by_country
+            models.Index(fields=['status', '-created_at', '-id'], name='listing_status_created_idx'),
+            models.Index(fields=['status', 'country', '-created_at', '-id'], name='listing_status_country_idx'),
+            # my_listings
+            models.Index(fields=['seller', '-created_at', '-id'], name='listing_seller_created_idx'),
+        ]
 
 class ListingImage(models.Model):
-    listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='images')
+    # Indexed by listingimage_listing_idx instead
+    listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='images', db_index=False)
     image = models.ImageField(upload_to='listing_images/')
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -64,8 +178,13 @@ class ListingImage(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The images prefetch of listing pages, in images_prefetch order,
+            # and every other lookup by listing
+            models.Index(fields=['listing', '-is_primary', '-created_at'], name='listingimage_listing_idx'),
+        ]
 
-class Order(models.Model):
+class Order(LoadedValuesMixin, models.Model):
     STATUS_CHOICES = (
         ('PENDING', 'Pending'),
         ('ACCEPTED', 'Accepted'),
@@ -73,6 +192,7 @@ class Order(models.Model):
         ('CANCELLED', 'Cancelled'),
         ('COMPLETED', 'Completed'),
     )
+    tracked_fields = ('status', 'total_price', 'listing_id', 'quantity')
     
     buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='orders')
@@ -86,10 +206,25 @@ class Order(models.Model):
     def __str__(self):
         return f"Order #{self.id} - {self.buyer.username}"
 
+    def save(self, *args, **kwargs):
+        # The save receivers reserve and release listing quantity (see
+        # marketplace.reservations), which must stand or fall with the order
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # my_orders, and the buyer side of the order list
+            models.Index(fields=['buyer', '-created_at', '-id'], name='order_buyer_created_idx'),
+            # my_sales, reached through the seller's listings
+            models.Index(fields=['listing', '-created_at', '-id'], name='order_listing_created_idx'),
+        ]
+
+class Review(LoadedValuesMixin, models.Model):
+    tracked_fields = ('rating', 'listing_id')
 
-class Review(models.Model):
     reviewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews_given')
     listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='reviews')
     rating = models.IntegerField()
@@ -103,17 +238,129 @@ class Review(models.Model):
         ordering = ['-created_at']
         unique_together = ('reviewer', 'listing')  # Prevent duplicate reviews
 
-class Message(models.Model):
+class Conversation(models.Model):
+    """
+    The messages between two users, about one listing or none. Maintained
+    from the `Message` receivers in `marketplace.signals`.
+    """
+    # "<lower user id>:<higher user id>:<listing id or empty>"
+    key = models.CharField(max_length=64, unique=True)
+    listing = models.ForeignKey(
+        WasteListing, on_delete=models.CASCADE, related_name='conversations', blank=True, null=True
+    )
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, related_name='+', blank=True, null=True
+    )
+    last_message_at = models.DateTimeField()
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Conversation {self.key}"
+
+    class Meta:
+        ordering = ['-last_message_at']
+
+class ConversationParticipant(models.Model):
+    """
+    A user's side of a conversation: their unread count, and a copy of the
+    conversation's `last_message_at` so an inbox is a single index range.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user} in {self.conversation}"
+
+    class Meta:
+        ordering = ['-last_message_at']
+        unique_together = ('conversation', 'user')
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='participant_inbox_idx'),
+        ]
+
+class Message(LoadedValuesMixin, models.Model):
+    tracked_fields = ('read', 'sender_id', 'receiver_id', 'listing_id', 'conversation_id')
+
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='messages', blank=True, null=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='messages', blank=True, null=True
+    )
     subject = models.CharField(max_length=255)
     content = models.TextField()
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['sender', '-created_at', '-id'], name='message_sender_created_idx'),
+            models.Index(fields=['receiver', '-created_at', '-id'], name='message_receiver_created_idx'),
+            # unread only covers the small unread slice of each inbox
+            models.Index(
+                fields=['receiver', '-created_at', '-id'],
+                condition=Q(read=False),
+                name='message_unread_idx',
+            ),
+            # Conversation threads
+            models.Index(fields=['conversation', '-created_at', '-id'], name='message_conversation_idx'),
+        ]
+
+class ArchivedMessage(models.Model):
+    """
+    Old messages moved out of `Message` by `archive_messages`, with the same
+    columns and ids, so hot inbox queries only touch recent rows. History
+    endpoints merge them back in (see marketplace.archive).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    listing = models.ForeignKey(WasteListing, on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='archived_messages', blank=True, null=True
+    )
+    subject = models.CharField(max_length=255)
+    content = models.TextField()
+    read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived message {self.pk}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['sender', '-created_at', '-id'], name='archived_sender_created_idx'),
+            models.Index(fields=['receiver', '-created_at', '-id'], name='archived_receiver_created_idx'),
+            models.Index(fields=['conversation', '-created_at', '-id'], name='archived_conversation_idx'),
+            # The archive horizon, see marketplace.archive
+            models.Index(fields=['-created_at'], name='archived_created_idx'),
+        ]
+
+class SellerSummary(models.Model):
+    """
+    One running total of a seller's dashboard, such as `orders:PENDING` or
+    `revenue:TND`. Maintained from the receivers in `marketplace.signals`,
+    see marketplace.summaries.
+    """
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='summary')
+    metric = models.CharField(max_length=32)
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.metric} for {self.seller}"
+
+    class Meta:
+        ordering = ['seller', 'metric']
+        unique_together = ('seller', 'metric')
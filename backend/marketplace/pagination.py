@@ -0,0 +1,262 @@
+import base64
+import datetime
+import decimal
+import json
+import math
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from agriwaste_project.asynchronous import AsyncPageNumberPagination
+from .archive import aget_archive_horizon, get_archive_horizon
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over the queryset's current ordering.
+
+    The cursor stores the ordering values of the boundary row, and each page
+    is fetched with a `WHERE (a, b, id) < (x, y, z)` style condition instead
+    of an OFFSET, so deep pages cost the same as the first one and no COUNT
+    query is issued. The primary key is always appended as a tiebreaker, which
+    makes non-unique orderings such as `price` or `available_from` stable.
+    Ordering fields must be non-nullable.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """
+        The rows of the requested page, plus one to tell whether more follow.
+        """
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+
+        self.after_cursor = cursor is not None
+        self.reverse = False
+        self.position = None
+        if cursor is not None:
+            self.reverse = cursor['reverse']
+            self.position = {
+                field.lstrip('-'): self.to_python(queryset.model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, cursor['position'])
+            }
+            queryset = queryset.filter(self.get_keyset_filter(queryset.model, cursor['position'], self.reverse))
+
+        ordering = [self.flip(field) for field in self.ordering] if self.reverse else self.ordering
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.after_cursor
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            raise NotFound('Cursor pagination requires a plain field ordering.')
+
+        names = [field.lstrip('-') for field in ordering]
+        if self.tiebreaker not in names and 'pk' not in names:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f'-{self.tiebreaker}' if descending else self.tiebreaker)
+        return ordering
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_keyset_filter(self, model, position, reverse):
+        """
+        Build the lexicographic "after this row" condition:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        """
+        keyset = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            value = self.to_python(model, name, value)
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            keyset |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return keyset
+
+    def to_python(self, model, name, value):
+        try:
+            field = model._meta.get_field('id' if name == 'pk' else name)
+        except FieldDoesNotExist:
+            # Annotations (e.g. a search rank) are stored as plain JSON values
+            return value
+        try:
+            value = field.to_python(value)
+            # Also the database's integer range, which an out-of-range id would overflow
+            field.run_validators(value)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            # Forged positions of the wrong type, e.g. a number for a datetime
+            raise NotFound(self.invalid_cursor_message)
+        if isinstance(value, (decimal.Decimal, float)) and not math.isfinite(value):
+            raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            ordering = payload['o']
+            position = payload['p']
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor is only meaningful for the ordering it was issued under
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Ordering fields are non-nullable, and encode_cursor only writes scalars
+        if not all(isinstance(value, (str, int, float)) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': position, 'reverse': reverse}
+
+    def encode_cursor(self, row, reverse):
+        position = [self.to_json(getattr(row, field.lstrip('-'))) for field in self.ordering]
+        payload = json.dumps({'o': self.ordering, 'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    @staticmethod
+    def to_json(value):
+        # Keep full microsecond precision; DjangoJSONEncoder would truncate it
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
+
+
+class ArchiveKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination over a hot queryset and its archive, for the history
+    endpoints (see marketplace.archive). The view's `get_archive_queryset()`
+    returns the archived counterpart of the queryset, with the same ordering
+    and filters, and both are read with the same cursor. The archive is only
+    queried when the page reaches back to the archive horizon.
+
+    The ordering must run in one direction and include `created_at`.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.page_queryset(queryset, request))
+        if self.reaches_archive(rows, get_archive_horizon()):
+            rows = self.merge(rows, list(self.page_queryset(view.get_archive_queryset(), request)))
+        return self.set_page(rows)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        rows = [row async for row in self.page_queryset(queryset, request)]
+        if self.reaches_archive(rows, await aget_archive_horizon()):
+            archived = self.page_queryset(view.get_archive_queryset(), request)
+            rows = self.merge(rows, [row async for row in archived])
+        return self.set_page(rows)
+
+    def reaches_archive(self, rows, horizon):
+        if horizon is None:
+            return False
+        if self.reverse:
+            # Rows run from the cursor towards newer ones, and nothing newer than the horizon is archived
+            return self.position['created_at'] <= horizon
+        return len(rows) <= self.page_size or rows[-1].created_at <= horizon
+
+    def merge(self, rows, archived):
+        descending = self.ordering[0].startswith('-') != self.reverse
+        rows = sorted(
+            rows + archived,
+            key=lambda row: tuple(getattr(row, field.lstrip('-')) for field in self.ordering),
+            reverse=descending,
+        )
+        return rows[:self.page_size + 1]
+
+
+class MarketplacePagination(AsyncPageNumberPagination):
+    """
+    Page-number pagination by default, with opt-in keyset pagination.
+
+    Clients start a cursor walk with `?pagination=cursor` and then follow the
+    `next`/`previous` links, which carry a `cursor` parameter.
+    """
+    pagination_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def wants_keyset(self, request):
+        return (request.query_params.get(self.pagination_query_param) == 'cursor'
+                or self.keyset_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.wants_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.wants_keyset(request):
+            self.keyset = self.keyset_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,36 @@
+"""
+Rating statistics stored on listings.
+
+`WasteListing.rating_count`, `rating_sum` and `rating_average` summarize the
+listing's reviews, so showing or sorting by rating never aggregates
+`Review`. The receivers in `marketplace.signals` apply each review change
+with a single UPDATE whose expressions read the row's current values, so
+concurrent reviews of one listing cannot lose each other's changes.
+"""
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from .models import WasteListing
+
+
+def adjust_rating(listing_id, count, total, using='default'):
+    """
+    Add `count` reviews rating `total` in all to the listing's statistics
+    (negative to take them away).
+    """
+    new_count = F('rating_count') + count
+    new_sum = F('rating_sum') + total
+    WasteListing.objects.using(using).filter(pk=listing_id).update(
+        rating_count=new_count,
+        rating_sum=new_sum,
+        # Every expression reads the values from before this UPDATE. Rounded here,
+        # as SQLite would store every digit and cursors compare against two
+        rating_average=Case(
+            When(rating_count__gt=-count, then=Round(Cast(new_sum, FloatField()) / new_count, 2)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+        # Ratings are part of the listing representation, so move its validators on
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,195 @@
+"""
+Seller reputation scores.
+
+A seller's reputation is a score from 0 to 100, the weighted mean of three
+components between 0 and 1:
+
+- `rating`: the reviews of all their listings, 1 star counting 0 and 5 stars 1
+- `completion`: completed orders among their completed, rejected and
+  cancelled ones
+- `response`: how fast they reply to inquiries about their listings within
+  `RESPONSE_WINDOW_DAYS`. A reply after `RESPONSE_HALF_LIFE_HOURS` counts
+  half as much as an immediate one. An inquiry left unanswered for
+  `RESPONSE_DEADLINE_HOURS` counts 0.
+
+Each component is shrunk towards 0.5 by `PRIOR_WEIGHT` imaginary
+observations, so a handful of reviews or orders cannot make a new seller
+the best or worst of the marketplace, and a seller without any history
+scores 50, the default until the first run.
+
+`update_reputations()` (the `update_reputations` command, run
+periodically) computes every score from the running totals kept by
+`marketplace.ratings` and `marketplace.summaries`, plus one query over
+recent inquiries. It stores the scores on `UserProfile` and copies the
+ones that changed to `WasteListing.seller_reputation`, so listings filter
+and sort by reputation along an index, without joining or aggregating.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from users.models import UserProfile
+from .facets import bump_listings_version
+from .models import Message, SellerSummary, WasteListing
+
+DEFAULTS = {
+    'WEIGHTS': {'rating': 0.5, 'completion': 0.3, 'response': 0.2},
+    # Imaginary neutral observations added to every component
+    'PRIOR_WEIGHT': 5,
+    'RESPONSE_WINDOW_DAYS': 90,
+    'RESPONSE_HALF_LIFE_HOURS': 24,
+    'RESPONSE_DEADLINE_HOURS': 72,
+}
+
+CLOSED_ORDER_STATUSES = ('COMPLETED', 'REJECTED', 'CANCELLED')
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'REPUTATION', {})}
+
+
+def shrink(total, count, prior_weight):
+    """
+    The mean of `count` observations adding up to `total`, pulled towards 0.5.
+    """
+    return (total + 0.5 * prior_weight) / (count + prior_weight)
+
+
+def rating_totals(sellers=None):
+    """
+    `{seller_id: (normalized rating total, review count)}` from the listing
+    rating columns.
+    """
+    listings = WasteListing.objects.filter(rating_count__gt=0)
+    if sellers is not None:
+        listings = listings.filter(seller__in=sellers)
+    rows = listings.order_by().values_list('seller').annotate(Sum('rating_count'), Sum('rating_sum'))
+    # A rating of r stars counts (r - 1) / 4
+    return {seller_id: ((total - count) / 4, count) for seller_id, count, total in rows}
+
+
+def completion_totals(sellers=None):
+    """
+    `{seller_id: (completed orders, closed orders)}` from the seller summaries.
+    """
+    rows = SellerSummary.objects.filter(metric__in=[f'orders:{status}' for status in CLOSED_ORDER_STATUSES])
+    if sellers is not None:
+        rows = rows.filter(seller__in=sellers)
+    totals = defaultdict(lambda: [0, 0])
+    for seller_id, metric, value in rows.values_list('seller', 'metric', 'value'):
+        totals[seller_id][1] += int(value)
+        if metric == 'orders:COMPLETED':
+            totals[seller_id][0] += int(value)
+    return {seller_id: tuple(total) for seller_id, total in totals.items()}
+
+
+def response_totals(sellers=None, now=None, options=None):
+    """
+    `{seller_id: (response score total, inquiries)}` over the inquiries of
+    the response window.
+    """
+    options = options or get_options()
+    now = now or timezone.now()
+    deadline = options['RESPONSE_DEADLINE_HOURS']
+    half_life = options['RESPONSE_HALF_LIFE_HOURS']
+
+    reply = (
+        Message.objects.filter(
+            conversation=OuterRef('conversation'), sender=OuterRef('receiver'), created_at__gt=OuterRef('created_at')
+        )
+        .order_by('created_at').values('created_at')[:1]
+    )
+    inquiries = Message.objects.filter(
+        created_at__gte=now - datetime.timedelta(days=options['RESPONSE_WINDOW_DAYS']),
+        listing__seller=F('receiver'),
+    )
+    if sellers is not None:
+        inquiries = inquiries.filter(receiver__in=sellers)
+
+    totals = defaultdict(lambda: [0.0, 0])
+    rows = inquiries.annotate(replied_at=Subquery(reply)).values_list('receiver', 'created_at', 'replied_at')
+    for seller_id, created_at, replied_at in rows.iterator(chunk_size=2000):
+        if replied_at is None:
+            hours = (now - created_at).total_seconds() / 3600
+            if hours < deadline:
+                # Still time to answer
+                continue
+            score = 0.0
+        else:
+            hours = (replied_at - created_at).total_seconds() / 3600
+            score = 0.0 if hours >= deadline else 0.5 ** (hours / half_life)
+        totals[seller_id][0] += score
+        totals[seller_id][1] += 1
+    return {seller_id: tuple(total) for seller_id, total in totals.items()}
+
+
+def compute_reputations(sellers=None, now=None):
+    """
+    `{seller_id: score}` for the given sellers, or every user with a
+    profile, as Decimals rounded like `UserProfile.reputation_score`.
+    """
+    options = get_options()
+    prior = options['PRIOR_WEIGHT']
+    weights = options['WEIGHTS']
+    components = {
+        'rating': rating_totals(sellers),
+        'completion': completion_totals(sellers),
+        'response': response_totals(sellers, now, options),
+    }
+    if sellers is None:
+        sellers = UserProfile.objects.values_list('user', flat=True)
+
+    scores = {}
+    for seller_id in sellers:
+        weighted = sum(
+            weight * shrink(*components[name].get(seller_id, (0, 0)), prior)
+            for name, weight in weights.items()
+        )
+        score = 100 * weighted / sum(weights.values())
+        scores[seller_id] = Decimal(score).quantize(Decimal('0.01'))
+    return scores
+
+
+def update_reputations(sellers=None, now=None):
+    """
+    Recompute and store the scores of the given sellers, or everyone, and
+    return how many changed. Listings are only rewritten for sellers whose
+    score changed.
+    """
+    now = now or timezone.now()
+    scores = compute_reputations(sellers, now)
+    profiles = UserProfile.objects.all() if sellers is None else UserProfile.objects.filter(user__in=sellers)
+    changed = {}
+    for profile in profiles.only('pk', 'user', 'reputation_score'):
+        if profile.user_id in scores and profile.reputation_score != scores[profile.user_id]:
+            changed[profile.user_id] = profile
+
+    with transaction.atomic():
+        profiles.update(reputation_updated_at=now)
+        for seller_id, profile in changed.items():
+            profile.reputation_score = scores[seller_id]
+        UserProfile.objects.bulk_update(changed.values(), ['reputation_score'], batch_size=500)
+        for seller_id in changed:
+            # Part of the listing representation, so move its validators on
+            WasteListing.objects.filter(seller=seller_id).update(
+                seller_reputation=scores[seller_id], updated_at=now
+            )
+        if changed:
+            transaction.on_commit(bump_listings_version)
+    return len(changed)
+
+
+def copy_seller_reputation(listing_id, using='default'):
+    """
+    Give a new or reassigned listing its seller's current score.
+    """
+    score = UserProfile.objects.using(using).filter(user=OuterRef('seller')).values('reputation_score')
+    WasteListing.objects.using(using).filter(pk=listing_id).update(
+        seller_reputation=Coalesce(Subquery(score), Decimal(50))
+    )
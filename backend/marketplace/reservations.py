@@ -0,0 +1,82 @@
+"""
+Listing quantity reservations for orders.
+
+Placing an order takes its quantity off the listing with one conditional
+UPDATE (`quantity = quantity - x ... WHERE quantity >= x AND status =
+'ACTIVE'`), so the database decides between concurrent buyers and a lot
+can never be oversold. The statement that takes the last of a listing also
+marks it SOLD.
+
+Orders that are rejected, cancelled or deleted before completing give
+their quantity back, putting a listing that had sold out back on sale. An
+order moving from rejected or cancelled to an open status reserves its
+quantity again, and fails with `InsufficientQuantity` if it is gone. The
+receivers in `marketplace.signals` apply these transitions whichever way an
+order is saved.
+
+These UPDATEs bypass the listing receivers, so status changes they make
+update the seller summaries and facets here. In turn, `WasteListing.save()`
+leaves quantity and status alone unless they were changed, and then applies
+the change on top of the reservations made since the listing was loaded.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .facets import bump_listings_version
+from .models import WasteListing
+from .summaries import adjust_summaries
+
+RELEASED_STATUSES = ('REJECTED', 'CANCELLED')
+
+
+class InsufficientQuantity(Exception):
+    """
+    The listing is not active or has less than the ordered quantity left.
+    """
+
+
+def holds_quantity(status):
+    # Completed orders keep theirs for good
+    return status not in RELEASED_STATUSES
+
+
+def reserve_quantity(listing_id, quantity, using='default'):
+    """
+    Take `quantity` off an active listing and return its price, read after
+    the reservation so it is the price the quantity was taken at. Must run
+    in a transaction; raises InsufficientQuantity.
+    """
+    reserved = WasteListing.objects.using(using).filter(
+        pk=listing_id, status='ACTIVE', quantity__gte=quantity
+    ).update(
+        quantity=F('quantity') - quantity,
+        status=Case(When(quantity=quantity, then=Value('SOLD')), default=F('status')),
+        updated_at=timezone.now(),
+    )
+    if not reserved:
+        raise InsufficientQuantity
+    # The UPDATE holds the row until commit, so this reads what it left
+    listing = WasteListing.objects.using(using).filter(pk=listing_id).values('seller_id', 'status', 'price').get()
+    if listing['status'] == 'SOLD':
+        listing_status_changed(listing['seller_id'], 'ACTIVE', 'SOLD', using)
+    return listing['price']
+
+
+def release_quantity(listing_id, quantity, using='default'):
+    """
+    Give `quantity` back to the listing, putting it back on sale if it had
+    sold out.
+    """
+    now = timezone.now()
+    listings = WasteListing.objects.using(using).filter(pk=listing_id)
+    if listings.filter(status='SOLD', quantity=0).update(quantity=quantity, status='ACTIVE', updated_at=now):
+        seller_id = listings.values_list('seller_id', flat=True).get()
+        listing_status_changed(seller_id, 'SOLD', 'ACTIVE', using)
+    else:
+        listings.update(quantity=F('quantity') + quantity, updated_at=now)
+
+
+def listing_status_changed(seller_id, old_status, new_status, using='default'):
+    adjust_summaries({(seller_id, f'listings:{old_status}'): -1, (seller_id, f'listings:{new_status}'): 1}, using=using)
+    transaction.on_commit(bump_listings_version, using=using)
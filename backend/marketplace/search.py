@@ -0,0 +1,202 @@
+"""
+Full-text search index for marketplace listings.
+
+SQLite deployments use an FTS5 virtual table and PostgreSQL deployments use a
+`tsvector` column with a GIN index. Both hold the listing title, waste type
+name, location and description. Title and waste type are weighted above the
+rest when results are ranked. The index is kept in sync by the signal
+handlers in `marketplace.signals`. `manage.py rebuild_search_index` rebuilds
+it from scratch.
+"""
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import WasteListing
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_tokens(query):
+    """
+    Split user input into plain word tokens, dropping any query syntax.
+    """
+    return TOKEN_RE.findall(query.lower())[:10]
+
+
+class SQLiteSearchBackend:
+    table = 'marketplace_listing_fts'
+    # bm25() weights for title, waste_type, location, description
+    weights = (10.0, 5.0, 2.0, 1.0)
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            "title, waste_type, location, description, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def rebuild(self, cursor):
+        cursor.execute(f'DELETE FROM {self.table}')
+        cursor.execute(
+            f'INSERT INTO {self.table} (rowid, title, waste_type, location, description) '
+            'SELECT l.id, l.title, t.name, l.location, l.description '
+            'FROM marketplace_wastelisting l '
+            'JOIN waste_catalog_wastetype t ON t.id = l.waste_type_id'
+        )
+
+    def index(self, cursor, listing_id, title, waste_type, location, description):
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [listing_id])
+        cursor.execute(
+            f'INSERT INTO {self.table} (rowid, title, waste_type, location, description) '
+            'VALUES (%s, %s, %s, %s, %s)',
+            [listing_id, title, waste_type, location, description],
+        )
+
+    def remove(self, cursor, listing_id):
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [listing_id])
+
+    def search(self, queryset, tokens):
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        listing_table = WasteListing._meta.db_table
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # bm25() is lower-is-better, negate it so ranks sort descending like PostgreSQL
+        rank = RawSQL(
+            f'SELECT -bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND {self.table}.rowid = "{listing_table}"."id"',
+            (match,),
+        )
+        matches = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,))
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+class PostgresSearchBackend:
+    table = 'marketplace_listing_search'
+    config = 'simple'
+    document_sql = (
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'D')"
+    )
+
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            'listing_id bigint PRIMARY KEY REFERENCES marketplace_wastelisting (id) '
+            'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING gin (document)'
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def rebuild(self, cursor):
+        document = self.document_sql % ('l.title', 't.name', 'l.location', 'l.description')
+        cursor.execute(f'DELETE FROM {self.table}')
+        cursor.execute(
+            f'INSERT INTO {self.table} (listing_id, document) '
+            f'SELECT l.id, {document} '
+            'FROM marketplace_wastelisting l '
+            'JOIN waste_catalog_wastetype t ON t.id = l.waste_type_id'
+        )
+
+    def index(self, cursor, listing_id, title, waste_type, location, description):
+        cursor.execute(
+            f'INSERT INTO {self.table} (listing_id, document) VALUES (%s, {self.document_sql}) '
+            'ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document',
+            [listing_id, title, waste_type, location, description],
+        )
+
+    def remove(self, cursor, listing_id):
+        cursor.execute(f'DELETE FROM {self.table} WHERE listing_id = %s', [listing_id])
+
+    def search(self, queryset, tokens):
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        listing_table = WasteListing._meta.db_table
+        rank = RawSQL(
+            f"SELECT ts_rank(document, to_tsquery('{self.config}', %s)) FROM {self.table} "
+            f'WHERE {self.table}.listing_id = "{listing_table}"."id"',
+            (query,),
+        )
+        matches = RawSQL(
+            f"SELECT listing_id FROM {self.table} WHERE document @@ to_tsquery('{self.config}', %s)",
+            (query,),
+        )
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(connection):
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class() if backend_class else None
+
+
+def index_listing(listing, using='default'):
+    connection = connections[using]
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.index(
+            cursor, listing.pk, listing.title, listing.waste_type.name,
+            listing.location, listing.description,
+        )
+
+
+def remove_listing(listing_id, using='default'):
+    connection = connections[using]
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.remove(cursor, listing_id)
+
+
+def reindex_waste_type(waste_type, using='default'):
+    listings = WasteListing.objects.using(using).filter(waste_type=waste_type)
+    for listing in listings.only('id', 'title', 'location', 'description', 'waste_type_id'):
+        listing.waste_type = waste_type
+        index_listing(listing, using=using)
+
+
+def rebuild_index(using='default'):
+    connection = connections[using]
+    backend = get_backend(connection)
+    if backend is None:
+        return False
+    with connection.cursor() as cursor:
+        backend.rebuild(cursor)
+    return True
+
+
+class ListingSearchFilter(filters.SearchFilter):
+    """
+    `?search=` backed by the full-text index, ordered by relevance.
+
+    Falls back to the regular `icontains` SearchFilter on databases without a
+    search backend. An explicit `?ordering=` still takes precedence, since
+    OrderingFilter runs after this backend.
+    """
+    def filter_queryset(self, request, queryset, view):
+        backend = get_backend(connections[queryset.db])
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        tokens = search_tokens(request.query_params.get(self.search_param, ''))
+        if not tokens:
+            return queryset
+        return backend.search(queryset, tokens).order_by('-search_rank', '-created_at')
@@ -1,9 +1,15 @@
 from rest_framework import serializers
-from .models import WasteListing, ListingImage, Order, Review, Message
+from .models import WasteListing, ListingImage, Order, Review, Message, ConversationParticipant
+from .fieldsets import SparseFieldsetMixin
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from waste_catalog.serializers import WasteTypeSerializer
 from users.serializers import UserSerializer
 
+def images_prefetch(lookup='images'):
+    # Primary image first, in the single query that loads every image on the page
+    return Prefetch(lookup, queryset=ListingImage.objects.order_by('-is_primary', '-created_at'))
+
 class ListingImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
     
@@ -14,12 +20,18 @@ class ListingImageSerializer(serializers.ModelSerializer):
     def get_image_url(self, obj):
         request = self.context.get('request')
         if obj.image and hasattr(obj.image, 'url'):
+            url = obj.image.url
             if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
+                if url.startswith('/') and not url.startswith('//'):
+                    # Resolve scheme and host once per response rather than per image
+                    if 'absolute_uri_base' not in self.context:
+                        self.context['absolute_uri_base'] = request.build_absolute_uri('/')[:-1]
+                    return self.context['absolute_uri_base'] + url
+                return request.build_absolute_uri(url)
+            return url
         return None
 
-class WasteListingSerializer(serializers.ModelSerializer):
+class WasteListingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ListingImageSerializer(many=True, read_only=True)
     seller_username = serializers.SerializerMethodField()
     waste_type_name = serializers.SerializerMethodField()
@@ -29,6 +41,17 @@ class WasteListingSerializer(serializers.ModelSerializer):
     class Meta:
         model = WasteListing
         fields = '__all__'
+        field_sources = {
+            'images': [images_prefetch()],
+            'seller_username': ['seller__username'],
+            'waste_type_name': ['waste_type__name'],
+            'country_name': ['country'],
+            'is_active': ['status'],
+        }
+        expandable_fields = {
+            'seller': (UserSerializer, ['seller__profile']),
+            'waste_type': (WasteTypeSerializer, ['waste_type__documents']),
+        }
         
     def get_seller_username(self, obj):
         return obj.seller.username
@@ -42,7 +65,7 @@ class WasteListingSerializer(serializers.ModelSerializer):
     def get_is_active(self, obj):
         return obj.status == 'ACTIVE'
 
-class WasteListingDetailSerializer(serializers.ModelSerializer):
+class WasteListingDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ListingImageSerializer(many=True, read_only=True)
     seller = UserSerializer(read_only=True)
     waste_type = WasteTypeSerializer(read_only=True)
@@ -51,17 +74,35 @@ class WasteListingDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = WasteListing
         fields = '__all__'
+        field_sources = {
+            'images': [images_prefetch()],
+            'seller': ['seller__profile'],
+            'waste_type': ['waste_type', 'waste_type__documents'],
+            'is_active': ['status'],
+        }
         
     def get_is_active(self, obj):
         return obj.status == 'ACTIVE'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     buyer_username = serializers.SerializerMethodField()
     listing_title = serializers.SerializerMethodField()
     
     class Meta:
         model = Order
         fields = '__all__'
+        # Computed from the listing price when the quantity is reserved
+        read_only_fields = ['total_price']
+        field_sources = {
+            'buyer_username': ['buyer__username'],
+            'listing_title': ['listing__title'],
+        }
+        expandable_fields = {
+            'buyer': (UserSerializer, ['buyer__profile']),
+            'listing': (WasteListingSerializer, [
+                'listing__seller', 'listing__waste_type', images_prefetch('listing__images'),
+            ]),
+        }
         
     def get_buyer_username(self, obj):
         return obj.buyer.username
@@ -69,6 +110,24 @@ class OrderSerializer(serializers.ModelSerializer):
     def get_listing_title(self, obj):
         return obj.listing.title
 
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be positive")
+        return value
+
+    def validate(self, attrs):
+        if self.instance is None:
+            # New orders always start PENDING, so they are priced and reserve their quantity
+            attrs.pop('status', None)
+            return attrs
+        # Moving a reservation is left to cancelling and placing a new order
+        for field in ('listing', 'quantity'):
+            if field in attrs and attrs[field] != getattr(self.instance, field):
+                raise serializers.ValidationError(
+                    {field: "Cancel this order and place a new one instead"}
+                )
+        return attrs
+
 class OrderDetailSerializer(serializers.ModelSerializer):
     buyer = UserSerializer(read_only=True)
     listing = WasteListingSerializer(read_only=True)
@@ -101,14 +160,25 @@ class ReviewSerializer(serializers.ModelSerializer):
         validated_data['reviewer'] = self.context['request'].user
         return super().create(validated_data)
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     sender_username = serializers.SerializerMethodField()
     receiver_username = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = '__all__'
-        read_only_fields = ['sender']  # Make sender read-only since it's set from the authenticated user
+        read_only_fields = ['sender', 'conversation']  # Set from the authenticated user and by marketplace.conversations
+        field_sources = {
+            'sender_username': ['sender__username'],
+            'receiver_username': ['receiver__username'],
+        }
+        expandable_fields = {
+            'sender': (UserSerializer, ['sender__profile']),
+            'receiver': (UserSerializer, ['receiver__profile']),
+            'listing': (WasteListingSerializer, [
+                'listing__seller', 'listing__waste_type', images_prefetch('listing__images'),
+            ]),
+        }
         
     def get_sender_username(self, obj):
         return obj.sender.username
@@ -153,4 +223,52 @@ class MessageSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # Set the sender to the current user
         validated_data['sender'] = self.context['request'].user
-        return super().create(validated_data) 
\ No newline at end of file
+        return super().create(validated_data) 
+
+class ConversationSerializer(serializers.ModelSerializer):
+    """
+    A conversation as seen by one participant, from their
+    `ConversationParticipant` row.
+    """
+    id = serializers.IntegerField(source='conversation_id', read_only=True)
+    listing = serializers.IntegerField(source='conversation.listing_id', read_only=True)
+    listing_title = serializers.SerializerMethodField()
+    participants = serializers.SerializerMethodField()
+    last_message_preview = serializers.CharField(source='conversation.last_message_preview', read_only=True)
+    last_message_sender = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ConversationParticipant
+        fields = [
+            'id', 'listing', 'listing_title', 'participants', 'unread_count',
+            'last_message_at', 'last_message_preview', 'last_message_sender',
+        ]
+
+    def get_listing_title(self, obj):
+        listing = obj.conversation.listing
+        return listing.title if listing else None
+
+    def get_participants(self, obj):
+        return [
+            {'id': participant.user_id, 'username': participant.user.username}
+            for participant in obj.conversation.participants.all()
+        ]
+
+    def get_last_message_sender(self, obj):
+        last_message = obj.conversation.last_message
+        return last_message.sender_id if last_message else None
+
+class MarkReadSerializer(serializers.Serializer):
+    """
+    Which of the user's received messages `messages/mark_read/` marks as read.
+    Given filters are combined.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    sender = serializers.IntegerField(required=False)
+    listing = serializers.IntegerField(required=False)
+    conversation = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("Give ids, sender, listing or conversation.")
+        return data
@@ -0,0 +1,307 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from agriwaste_project.events import broker
+from waste_catalog.models import WasteType
+from .models import Conversation, ListingImage, Message, Order, Review, WasteListing
+from . import search
+from .conversations import adjust_unread, get_conversation, record_message, refresh_last_message
+from .counters import adjust_message_counts, forget_message_counts, message_deltas
+from .facets import bump_listings_version
+from .ratings import adjust_rating
+from .reputation import copy_seller_reputation
+from .reservations import holds_quantity, release_quantity, reserve_quantity
+from .summaries import (
+    UNREAD_INQUIRIES, adjust_summaries, add_deltas, inquiry_seller, order_deltas, rebuild_summaries,
+)
+
+
+@receiver(post_save, sender=WasteListing)
+def index_listing(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    search.index_listing(instance, using=using)
+
+
+@receiver(post_delete, sender=WasteListing)
+def unindex_listing(sender, instance, using='default', **kwargs):
+    search.remove_listing(instance.pk, using=using)
+
+
+@receiver(post_save, sender=WasteListing)
+@receiver(post_delete, sender=WasteListing)
+@receiver(post_save, sender=WasteType)
+def invalidate_facets(sender, instance, using='default', **kwargs):
+    transaction.on_commit(bump_listings_version, using=using)
+
+
+@receiver(post_save, sender=ListingImage)
+@receiver(post_delete, sender=ListingImage)
+def touch_image_listing(sender, instance, raw=False, using='default', **kwargs):
+    # Images are part of the listing representation, so move its validators on
+    if raw:
+        return
+    WasteListing.objects.using(using).filter(pk=instance.listing_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=WasteType)
+def reindex_waste_type_listings(sender, instance, created, raw=False, using='default', **kwargs):
+    # The waste type name is part of every listing document
+    if raw or created:
+        return
+    search.reindex_waste_type(instance, using=using)
+
+
+def publish_on_commit(user_ids, event_type, data, using):
+    transaction.on_commit(partial(broker.publish, user_ids, event_type, data), using=using)
+
+
+@receiver(post_save, sender=Message)
+def publish_message_event(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    if created:
+        event_type = 'message.created'
+    elif 'read' in instance.saved_changes and instance.read:
+        event_type = 'message.read'
+    else:
+        return
+    publish_on_commit([instance.sender_id, instance.receiver_id], event_type, {
+        'id': instance.pk,
+        'sender': instance.sender_id,
+        'receiver': instance.receiver_id,
+        'listing': instance.listing_id,
+        'conversation': instance.conversation_id,
+        'read': instance.read,
+    }, using)
+
+
+@receiver(pre_save, sender=Message)
+def assign_conversation(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    if instance._state.adding:
+        if instance.conversation_id is None:
+            instance.conversation = get_conversation(
+                instance.sender_id, instance.receiver_id, instance.listing_id, using=using
+            )
+        return
+    # A message whose users or listing change moves to their conversation
+    changes = instance.saved_changes
+    if instance.conversation_id is None or not changes.keys() & {'sender_id', 'receiver_id', 'listing_id'}:
+        return
+    previous = instance.conversation_id
+    # Started as of the message, so it becomes the new conversation's last one
+    instance.conversation = get_conversation(
+        instance.sender_id, instance.receiver_id, instance.listing_id, using=using, started_at=instance.created_at
+    )
+    if instance.conversation_id != previous:
+        changes.setdefault('conversation_id', previous)
+
+
+@receiver(post_save, sender=Message)
+def update_conversation(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw or instance.conversation_id is None:
+        return
+    if created:
+        record_message(instance, using=using)
+        return
+    changes = instance.saved_changes
+    previous = changes.get('conversation_id', instance.conversation_id)
+    receiver_id = changes.get('receiver_id', instance.receiver_id)
+    was_read = changes.get('read', instance.read)
+    if (previous, receiver_id, was_read) == (instance.conversation_id, instance.receiver_id, instance.read):
+        return
+    if previous is not None and not was_read:
+        adjust_unread(previous, receiver_id, -1, using=using)
+    if previous != instance.conversation_id:
+        if previous is not None:
+            refresh_last_message(previous, using=using)
+        record_message(instance, using=using)
+    elif not instance.read:
+        adjust_unread(instance.conversation_id, instance.receiver_id, 1, using=using)
+
+
+@receiver(post_delete, sender=Message)
+def update_conversation_on_delete(sender, instance, using='default', **kwargs):
+    if instance.conversation_id is None:
+        return
+    if not instance.read:
+        adjust_unread(instance.conversation_id, instance.receiver_id, -1, using=using)
+    # The foreign key was set to NULL if this was the last message
+    if Conversation.objects.using(using).filter(pk=instance.conversation_id, last_message=None).exists():
+        refresh_last_message(instance.conversation_id, using=using)
+
+
+@receiver(post_save, sender=Message)
+def count_saved_message(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    if created:
+        transaction.on_commit(partial(adjust_message_counts, message_deltas(instance)), using=using)
+        return
+    changes = instance.saved_changes
+    if 'sender_id' in changes or 'receiver_id' in changes:
+        users = {
+            changes.get('sender_id', instance.sender_id), changes.get('receiver_id', instance.receiver_id),
+            instance.sender_id, instance.receiver_id,
+        }
+        transaction.on_commit(partial(forget_message_counts, *users), using=using)
+    elif 'read' in changes:
+        delta = -1 if instance.read else 1
+        transaction.on_commit(
+            partial(adjust_message_counts, {(instance.receiver_id, 'unread'): delta}), using=using
+        )
+
+
+@receiver(post_delete, sender=Message)
+def count_deleted_message(sender, instance, using='default', **kwargs):
+    transaction.on_commit(partial(adjust_message_counts, message_deltas(instance, sign=-1)), using=using)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_event(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw or not (created or 'status' in instance.saved_changes):
+        return
+    seller = instance.listing.seller_id
+    publish_on_commit([instance.buyer_id, seller], 'order.created' if created else 'order.status_changed', {
+        'id': instance.pk,
+        'listing': instance.listing_id,
+        'buyer': instance.buyer_id,
+        'seller': seller,
+        'status': instance.status,
+        'previous_status': instance.saved_changes.get('status'),
+    }, using)
+
+
+@receiver(post_save, sender=WasteListing)
+def summarize_saved_listing(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    changes = instance.saved_changes
+    if created:
+        adjust_summaries({(instance.seller_id, f'listings:{instance.status}'): 1}, using=using)
+    elif 'seller_id' in changes or 'currency' in changes:
+        # Moves orders and revenue along with the listing
+        rebuild_summaries({changes.get('seller_id', instance.seller_id), instance.seller_id}, using=using)
+    elif 'status' in changes:
+        adjust_summaries({
+            (instance.seller_id, f"listings:{changes['status']}"): -1,
+            (instance.seller_id, f'listings:{instance.status}'): 1,
+        }, using=using)
+
+
+@receiver(post_save, sender=WasteListing)
+def copy_listing_reputation(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw or not (created or 'seller_id' in instance.saved_changes):
+        return
+    copy_seller_reputation(instance.pk, using=using)
+
+
+@receiver(post_delete, sender=WasteListing)
+def summarize_deleted_listing(sender, instance, using='default', **kwargs):
+    # Its orders and messages were deleted first, through their own receivers
+    adjust_summaries({(instance.seller_id, f'listings:{instance.status}'): -1}, using=using)
+
+
+@receiver(post_save, sender=Order)
+def summarize_saved_order(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    changes = instance.saved_changes
+    if 'listing_id' in changes:
+        previous = WasteListing.objects.using(using).filter(pk=changes['listing_id']).values_list('seller_id', flat=True)
+        rebuild_summaries({*previous, instance.listing.seller_id}, using=using)
+    elif created:
+        adjust_summaries(order_deltas(instance.listing, instance.status, instance.total_price), using=using)
+    elif 'status' in changes or 'total_price' in changes:
+        adjust_summaries(add_deltas(
+            order_deltas(
+                instance.listing, changes.get('status', instance.status),
+                changes.get('total_price', instance.total_price), sign=-1,
+            ),
+            order_deltas(instance.listing, instance.status, instance.total_price),
+        ), using=using)
+
+
+@receiver(post_delete, sender=Order)
+def summarize_deleted_order(sender, instance, using='default', **kwargs):
+    adjust_summaries(order_deltas(instance.listing, instance.status, instance.total_price, sign=-1), using=using)
+
+
+@receiver(post_save, sender=Message)
+def summarize_saved_message(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    changes = instance.saved_changes
+    if {'sender_id', 'receiver_id', 'listing_id'} & changes.keys():
+        rebuild_summaries({changes.get('receiver_id', instance.receiver_id), instance.receiver_id}, using=using)
+    elif (created and not instance.read) or 'read' in changes:
+        seller_id = inquiry_seller(instance, using=using)
+        if seller_id is not None:
+            adjust_summaries({(seller_id, UNREAD_INQUIRIES): -1 if instance.read else 1}, using=using)
+
+
+@receiver(post_delete, sender=Message)
+def summarize_deleted_message(sender, instance, using='default', **kwargs):
+    if instance.read:
+        return
+    seller_id = inquiry_seller(instance, using=using)
+    if seller_id is not None:
+        adjust_summaries({(seller_id, UNREAD_INQUIRIES): -1}, using=using)
+
+
+@receiver(post_save, sender=Review)
+def rate_listing(sender, instance, created, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    changes = instance.saved_changes
+    if created:
+        adjust_rating(instance.listing_id, 1, instance.rating, using=using)
+    elif 'listing_id' in changes:
+        adjust_rating(changes['listing_id'], -1, -changes.get('rating', instance.rating), using=using)
+        adjust_rating(instance.listing_id, 1, instance.rating, using=using)
+    elif 'rating' in changes:
+        adjust_rating(instance.listing_id, 0, instance.rating - changes['rating'], using=using)
+
+
+@receiver(post_delete, sender=Review)
+def unrate_listing(sender, instance, using='default', **kwargs):
+    adjust_rating(instance.listing_id, -1, -instance.rating, using=using)
+
+
+@receiver(pre_save, sender=Order)
+def reserve_order_quantity(sender, instance, raw=False, using='default', **kwargs):
+    if raw or not instance._state.adding or not holds_quantity(instance.status):
+        return
+    price = reserve_quantity(instance.listing_id, instance.quantity, using=using)
+    if instance.total_price is None:
+        instance.total_price = instance.quantity * price
+
+
+@receiver(post_save, sender=Order)
+def move_order_reservation(sender, instance, created, raw=False, using='default', **kwargs):
+    changes = instance.saved_changes
+    if raw or created or not changes.keys() & {'status', 'listing_id', 'quantity'}:
+        return
+    held = holds_quantity(changes.get('status', instance.status))
+    holds = holds_quantity(instance.status)
+    moved = 'listing_id' in changes or 'quantity' in changes
+    # Release first, so a changed quantity on the same listing can use what it frees
+    if held and (moved or not holds):
+        release_quantity(changes.get('listing_id', instance.listing_id), changes.get('quantity', instance.quantity), using=using)
+    if holds and (moved or not held):
+        reserve_quantity(instance.listing_id, instance.quantity, using=using)
+
+
+@receiver(post_delete, sender=Order)
+def release_deleted_order(sender, instance, using='default', origin=None, **kwargs):
+    # Nothing to give back to a listing that is being deleted
+    if isinstance(origin, WasteListing) or getattr(origin, 'model', None) is WasteListing:
+        return
+    if holds_quantity(instance.status) and instance.status != 'COMPLETED':
+        release_quantity(instance.listing_id, instance.quantity, using=using)
@@ -0,0 +1,179 @@
+"""
+Per-seller totals behind `dashboard/summary/`.
+
+`SellerSummary` holds one row per seller and metric:
+
+- `orders:<status>`: orders on the seller's listings, per `Order.STATUS_CHOICES`
+- `revenue:<currency>`: total price of those orders once completed, in the
+  listing's currency
+- `listings:<status>`: the seller's listings, per `WasteListing.STATUS_CHOICES`
+- `inquiries:unread`: unread messages the seller received about their own listings
+
+A missing row counts as zero. The receivers in `marketplace.signals` add
+each change to the rows with `UPDATE ... SET value = value + delta`, in the
+transaction that makes it, so a summary is one indexed read however many
+orders a seller has. Changes that move a listing or an order to another
+seller or currency recompute the sellers involved with
+`rebuild_summaries()`, as does `manage.py rebuild_seller_summaries` for
+everyone, e.g. after loading fixtures, whose raw saves are skipped.
+Queryset `update()` calls bypass the receivers and must bring the rows up
+to date themselves.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Message, Order, SellerSummary, WasteListing
+
+UNREAD_INQUIRIES = 'inquiries:unread'
+
+
+def add_deltas(*deltas):
+    total = defaultdict(int)
+    for changes in deltas:
+        for key, delta in changes.items():
+            total[key] += delta
+    return total
+
+
+def adjust_summaries(deltas, using='default'):
+    """
+    Apply `{(seller_id, metric): delta}` to the summary rows, creating
+    missing ones.
+    """
+    for (seller_id, metric), delta in deltas.items():
+        if not delta:
+            continue
+        rows = SellerSummary.objects.using(using).filter(seller=seller_id, metric=metric)
+        if rows.update(value=F('value') + delta):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                SellerSummary.objects.using(using).create(seller_id=seller_id, metric=metric, value=delta)
+        except IntegrityError:
+            # Another transaction created it first
+            rows.update(value=F('value') + delta)
+
+
+def order_deltas(listing, status, total_price, sign=1):
+    """
+    What an order with this status and total price adds to its seller's
+    summary (sign=1), or takes away (sign=-1).
+    """
+    deltas = {(listing.seller_id, f'orders:{status}'): sign}
+    if status == 'COMPLETED':
+        deltas[(listing.seller_id, f'revenue:{listing.currency}')] = sign * total_price
+    return deltas
+
+
+def inquiry_seller(message, using='default'):
+    """
+    The id of the receiver of `message` if it is about one of their own
+    listings, else None.
+    """
+    if message.listing_id is None:
+        return None
+    seller_id = (
+        WasteListing.objects.using(using).filter(pk=message.listing_id)
+        .values_list('seller_id', flat=True).first()
+    )
+    return seller_id if seller_id == message.receiver_id else None
+
+
+def recount_unread_inquiries(seller_id, using='default'):
+    """
+    Recount the seller's unread inquiries in one UPDATE, after bulk
+    read-state changes.
+    """
+    unread = (
+        Message.objects.using(using)
+        .filter(receiver=OuterRef('seller'), listing__seller=OuterRef('seller'), read=False)
+        .order_by().values('receiver').annotate(count=Count('pk')).values('count')
+    )
+    SellerSummary.objects.using(using).filter(seller=seller_id, metric=UNREAD_INQUIRIES, value__gt=0).update(
+        value=Coalesce(Subquery(unread), Value(0))
+    )
+
+
+def summary_rows(sellers=None, using='default', apps=global_apps):
+    """
+    `{(seller_id, metric): value}` counted from scratch, for the given
+    sellers or everyone. `apps` lets migrations pass their historical models.
+    """
+    Order = apps.get_model('marketplace', 'Order')
+    WasteListing = apps.get_model('marketplace', 'WasteListing')
+    Message = apps.get_model('marketplace', 'Message')
+
+    orders = Order.objects.using(using).order_by()
+    listings = WasteListing.objects.using(using).order_by()
+    inquiries = Message.objects.using(using).order_by().filter(read=False, listing__seller=F('receiver'))
+    if sellers is not None:
+        orders = orders.filter(listing__seller__in=sellers)
+        listings = listings.filter(seller__in=sellers)
+        inquiries = inquiries.filter(receiver__in=sellers)
+
+    rows = {}
+    for seller_id, status, count in orders.values_list('listing__seller', 'status').annotate(Count('pk')):
+        rows[(seller_id, f'orders:{status}')] = count
+    revenue = orders.filter(status='COMPLETED').values_list('listing__seller', 'listing__currency')
+    for seller_id, currency, total in revenue.annotate(Sum('total_price')):
+        rows[(seller_id, f'revenue:{currency}')] = total
+    for seller_id, status, count in listings.values_list('seller', 'status').annotate(Count('pk')):
+        rows[(seller_id, f'listings:{status}')] = count
+    for seller_id, count in inquiries.values_list('receiver').annotate(Count('pk')):
+        rows[(seller_id, UNREAD_INQUIRIES)] = count
+    return rows
+
+
+def rebuild_summaries(sellers=None, using='default', apps=global_apps):
+    """
+    Replace the summary rows of the given sellers, or of everyone, with
+    fresh counts. Returns the number of rows written.
+    """
+    SellerSummary = apps.get_model('marketplace', 'SellerSummary')
+    rows = summary_rows(sellers, using, apps)
+    with transaction.atomic(using=using):
+        existing = SellerSummary.objects.using(using)
+        if sellers is not None:
+            existing = existing.filter(seller__in=sellers)
+        existing.delete()
+        SellerSummary.objects.using(using).bulk_create([
+            SellerSummary(seller_id=seller_id, metric=metric, value=value)
+            for (seller_id, metric), value in rows.items()
+        ], batch_size=500)
+    return len(rows)
+
+
+def format_summary(rows):
+    """
+    The `dashboard/summary/` payload from `(metric, value)` rows.
+    """
+    values = dict(rows)
+    currencies = [code for code, _ in WasteListing.CURRENCY_CHOICES]
+    # Revenue in currencies no longer offered is still revenue
+    currencies += sorted(
+        metric.split(':', 1)[1] for metric in values
+        if metric.startswith('revenue:') and metric.split(':', 1)[1] not in currencies
+    )
+    return {
+        'orders': {status: int(values.get(f'orders:{status}', 0)) for status, _ in Order.STATUS_CHOICES},
+        'revenue': {
+            currency: str(Decimal(values.get(f'revenue:{currency}', 0)).quantize(Decimal('0.01')))
+            for currency in currencies
+        },
+        'listings': {status: int(values.get(f'listings:{status}', 0)) for status, _ in WasteListing.STATUS_CHOICES},
+        'unread_inquiries': int(values.get(UNREAD_INQUIRIES, 0)),
+    }
+
+
+def get_summary(seller_id):
+    return format_summary(SellerSummary.objects.filter(seller=seller_id).values_list('metric', 'value'))
+
+
+async def aget_summary(seller_id):
+    rows = SellerSummary.objects.filter(seller=seller_id).values_list('metric', 'value')
+    return format_summary([row async for row in rows])
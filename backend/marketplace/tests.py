@@ -1,3 +1,1521 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from agriwaste_project.events import broker
+from waste_catalog.models import WasteCategory, WasteType
+from .archive import HORIZON_KEY, archive_cutoff, archive_messages
+from .reputation import compute_reputations, update_reputations
+from .reservations import InsufficientQuantity
+from .summaries import get_summary, summary_rows
+from .models import WasteListing, ListingChanged, ListingImage, Order, Review, Message, Conversation, ConversationParticipant, ArchivedMessage, SellerSummary
+from .pagination import KeysetPagination
+
+GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00'
+    b'\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+class MarketplaceTestCase(TestCase):
+    """
+    Shared fixtures for the marketplace API tests.
+    """
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create(username='seller')
+        self.buyer = User.objects.create(username='buyer')
+        self.category = WasteCategory.objects.create(name='Crop residue')
+        self.waste_type = WasteType.objects.create(category=self.category, name='Olive pomace')
+
+    def create_listing(self, **kwargs):
+        data = {
+            'seller': self.seller,
+            'waste_type': self.waste_type,
+            'title': 'Olive pomace lot',
+            'description': 'Fresh pomace from the last harvest',
+            'quantity': Decimal('100.00'),
+            'unit': 'KG',
+            'price': Decimal('25.00'),
+            'location': 'Sfax',
+            'country': 'TN',
+            'available_from': datetime.date.today(),
+        }
+        data.update(kwargs)
+        return WasteListing.objects.create(**data)
+
+    def create_listings(self, count, images=2):
+        listings = []
+        for i in range(count):
+            listing = self.create_listing(title=f'Lot {i}')
+            for j in range(images):
+                ListingImage.objects.create(
+                    listing=listing,
+                    image=f'listing_images/lot_{i}_{j}.jpg',
+                    is_primary=(j == images - 1),
+                )
+            listings.append(listing)
+        return listings
+
+
+class ListingQueryCountTests(MarketplaceTestCase):
+    def assertConstantQueries(self, url, expected):
+        for count in (1, 15):
+            WasteListing.objects.all().delete()
+            self.create_listings(count)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), count)
+
+    def test_list_query_count_is_constant(self):
+        # validator, COUNT, listings with seller/waste type, images
+        self.assertConstantQueries('/api/marketplace/listings/', 4)
+
+    def test_active_query_count_is_constant(self):
+        self.assertConstantQueries('/api/marketplace/listings/active/', 4)
+
+    def test_by_country_query_count_is_constant(self):
+        self.assertConstantQueries('/api/marketplace/listings/by_country/?country=TN', 4)
+
+    def test_my_listings_query_count_is_constant(self):
+        self.client.force_authenticate(self.seller)
+        self.assertConstantQueries('/api/marketplace/listings/my_listings/', 4)
+
+    def test_retrieve_prefetches_profile_and_documents(self):
+        listing = self.create_listings(1)[0]
+        # validator, listing with seller/profile/waste type, images, documents
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/marketplace/listings/{listing.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['seller']['username'], 'seller')
+
+    def test_primary_image_first(self):
+        self.create_listings(1, images=3)
+        response = self.client.get('/api/marketplace/listings/')
+        images = response.data['results'][0]['images']
+        self.assertTrue(images[0]['is_primary'])
+        self.assertTrue(images[0]['image_url'].startswith('http://testserver/media/'))
+
+
+class KeysetPaginationTests(MarketplaceTestCase):
+    def walk(self, url):
+        seen = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return seen, pages
+
+    def test_walks_every_listing_once_with_tied_created_at(self):
+        listings = self.create_listings(40, images=0)
+        WasteListing.objects.update(created_at=listings[0].created_at)
+        seen, pages = self.walk('/api/marketplace/listings/?pagination=cursor')
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(sorted(seen), sorted(listing.pk for listing in listings))
+
+    def test_walks_price_ordering_with_ties(self):
+        listings = self.create_listings(35, images=0)
+        for i, listing in enumerate(listings):
+            WasteListing.objects.filter(pk=listing.pk).update(price=Decimal(i % 4))
+        seen, _ = self.walk('/api/marketplace/listings/?pagination=cursor&ordering=price')
+        expected = WasteListing.objects.order_by('price', 'id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_previous_link_returns_prior_page(self):
+        self.create_listings(20, images=0)
+        first = self.client.get('/api/marketplace/listings/?pagination=cursor')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in back.data['results']],
+            [item['id'] for item in first.data['results']],
+        )
+
+    def test_deep_page_skips_count_query(self):
+        self.create_listings(20, images=0)
+        first = self.client.get('/api/marketplace/listings/?pagination=cursor')
+        # listings and images only, no COUNT or validator
+        with self.assertNumQueries(2):
+            self.client.get(first.data['next'])
+
+    def test_cursor_from_other_ordering_is_rejected(self):
+        self.create_listings(20, images=0)
+        first = self.client.get('/api/marketplace/listings/?pagination=cursor')
+        response = self.client.get(first.data['next'] + '&ordering=price')
+        self.assertEqual(response.status_code, 404)
+
+    def test_malformed_cursors_are_rejected(self):
+        self.create_listings(20, images=0)
+        ordering = ['price', 'id']
+        positions = [5, None, [None, None], ['1', None], [['1'], 2], [{'a': 1}, 2], ['NaN', 2], [1], [1, 2, 3]]
+        for position in positions:
+            with self.subTest(position=position):
+                payload = json.dumps({'o': ordering, 'p': position, 'r': 0}).encode('ascii')
+                cursor = base64.urlsafe_b64encode(payload).decode('ascii')
+                response = self.client.get(
+                    '/api/marketplace/listings/', {'pagination': 'cursor', 'ordering': 'price', 'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+        # Numbers for the datetime of the default ordering, and ids out of the integer range
+        for position in ([5, 1], [1.5, 1], ['2024-01-01T00:00:00', 10 ** 30], ['2024-01-01T00:00:00', 1e300]):
+            with self.subTest(position=position):
+                payload = json.dumps({'o': ['-created_at', '-id'], 'p': position, 'r': 0}).encode('ascii')
+                cursor = base64.urlsafe_b64encode(payload).decode('ascii')
+                response = self.client.get('/api/marketplace/listings/', {'pagination': 'cursor', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+        for cursor in ('not base64!', base64.urlsafe_b64encode(b'[1, 2]').decode('ascii')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/marketplace/listings/', {'pagination': 'cursor', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_remains_default(self):
+        self.create_listings(2, images=0)
+        response = self.client.get('/api/marketplace/listings/')
+        self.assertEqual(response.data['count'], 2)
+
+
+class ListingSearchTests(MarketplaceTestCase):
+    def search(self, query, **params):
+        response = self.client.get('/api/marketplace/listings/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.data['results']]
+
+    def test_title_ranks_above_description(self):
+        self.create_listing(title='Dry straw bales', description='Leftover compost material')
+        self.create_listing(title='Compost from date palms', description='Sifted and dried')
+        self.assertEqual(self.search('compost'), ['Compost from date palms', 'Dry straw bales'])
+
+    def test_prefix_and_accent_insensitive_matching(self):
+        self.create_listing(title='Marc de raisin séché')
+        self.assertEqual(self.search('sech'), ['Marc de raisin séché'])
+
+    def test_matches_waste_type_name(self):
+        self.create_listing(title='Lot A')
+        self.assertEqual(self.search('olive'), ['Lot A'])
+
+    def test_index_follows_updates_and_deletes(self):
+        listing = self.create_listing(title='Rice husks')
+        listing.title = 'Wheat straw'
+        listing.save()
+        self.assertEqual(self.search('rice'), [])
+        self.assertEqual(self.search('wheat'), ['Wheat straw'])
+        listing.delete()
+        self.assertEqual(self.search('wheat'), [])
+
+    def test_waste_type_rename_reindexes_listings(self):
+        self.create_listing(title='Lot A')
+        self.waste_type.name = 'Grape marc'
+        self.waste_type.save()
+        self.assertEqual(self.search('grape'), ['Lot A'])
+        self.assertEqual(self.search('olive'), [])
+
+    def test_query_syntax_is_ignored(self):
+        self.create_listing(title='Olive leaves')
+        self.assertEqual(self.search('olive" OR NEAR(*'), [])
+        self.assertEqual(self.search('"olive'), ['Olive leaves'])
+
+    def test_search_with_cursor_pagination(self):
+        for i in range(20):
+            self.create_listing(title=f'Compost lot {i}')
+        response = self.client.get('/api/marketplace/listings/', {'search': 'compost', 'pagination': 'cursor'})
+        seen = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        seen += [item['id'] for item in response.data['results']]
+        self.assertEqual(len(set(seen)), 20)
+
+
+class ListingFacetsTests(MarketplaceTestCase):
+    url = '/api/marketplace/listings/facets/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_listing(price=Decimal('10'), country='TN')
+        self.create_listing(price=Decimal('75'), country='DZ', unit='TON')
+        self.create_listing(price=Decimal('2000'), country='TN', status='SOLD')
+
+    def test_counts_per_facet(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            {row['value']: row['count'] for row in response.data['country']},
+            {'TN': 2, 'DZ': 1},
+        )
+        self.assertEqual(
+            {row['value']: row['count'] for row in response.data['status']},
+            {'ACTIVE': 2, 'SOLD': 1},
+        )
+        self.assertEqual(response.data['waste_type'][0]['label'], 'Olive pomace')
+        self.assertEqual([row['count'] for row in response.data['price']], [1, 1, 0, 0, 1])
+
+    def test_facets_follow_list_filters(self):
+        response = self.client.get(self.url, {'country': 'TN', 'max_price': '100'})
+        self.assertEqual(response.data['count'], 1)
+        listing = self.client.get('/api/marketplace/listings/', {'country': 'TN', 'max_price': '100'})
+        self.assertEqual(listing.data['count'], 1)
+
+    def test_fixed_query_count_and_cache_hit(self):
+        with self.assertNumQueries(5):
+            self.client.get(self.url, {'unit': 'KG', 'country': 'TN'})
+        # Equivalent filter set in a different order is served from the cache
+        with self.assertNumQueries(0):
+            self.client.get(self.url + '?country=TN&page=2&unit=KG')
+
+    def test_listing_change_invalidates_cache(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_listing(country='LY')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 4)
+
+    def test_facets_with_search(self):
+        response = self.client.get(self.url, {'search': 'olive', 'status': 'ACTIVE'})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_invalid_price_is_rejected(self):
+        response = self.client.get(self.url, {'min_price': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_prices_are_rejected(self):
+        for url in (self.url, '/api/marketplace/listings/'):
+            for name in ('min_price', 'max_price'):
+                for value in ('NaN', 'sNaN', 'Infinity', '-inf'):
+                    with self.subTest(url=url, name=name, value=value):
+                        response = self.client.get(url, {name: value})
+                        self.assertEqual(response.status_code, 400)
+                        self.assertIn(name, response.json())
+
+    def test_out_of_range_waste_types_are_rejected(self):
+        for url in (self.url, '/api/marketplace/listings/'):
+            for value in ('99999999999999999999999', str(-2 ** 63 - 1), 'abc'):
+                with self.subTest(url=url, value=value):
+                    response = self.client.get(url, {'waste_type': value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('waste_type', response.json())
+            response = self.client.get(url, {'waste_type': str(2 ** 63 - 1)})
+            self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(MarketplaceTestCase):
+    def test_unchanged_list_returns_304_without_serializing(self):
+        self.create_listings(3)
+        response = self.client.get('/api/marketplace/listings/')
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        # Validator query only
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        listing = self.create_listings(1)[0]
+        url = f'/api/marketplace/listings/{listing.pk}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_delete_then_revalidate(self):
+        listings = self.create_listings(2)
+        response = self.client.get('/api/marketplace/listings/')
+        etag = response['ETag']
+        # Lists carry no Last-Modified, so If-Modified-Since alone never gets a 304
+        last_modified = self.client.get(f'/api/marketplace/listings/{listings[0].pk}/')['Last-Modified']
+        listings[1].delete()
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_edits_within_one_second_change_the_etag(self):
+        listing = self.create_listings(1)[0]
+        second = listing.updated_at.replace(microsecond=0)
+        WasteListing.objects.filter(pk=listing.pk).update(updated_at=second.replace(microsecond=1000))
+        etag = self.client.get('/api/marketplace/listings/')['ETag']
+        WasteListing.objects.filter(pk=listing.pk).update(updated_at=second.replace(microsecond=2000))
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_and_delete_change_the_etag(self):
+        listings = self.create_listings(2)
+        etag = self.client.get('/api/marketplace/listings/')['ETag']
+        listings[0].title = 'Renamed'
+        listings[0].save()
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        listings[1].delete()
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_filters_and_user(self):
+        self.create_listings(1)
+        etag = self.client.get('/api/marketplace/listings/')['ETag']
+        response = self.client.get('/api/marketplace/listings/?country=TN', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(self.seller)
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_and_custom_actions(self):
+        listing = self.create_listings(1)[0]
+        url = f'/api/marketplace/listings/{listing.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/marketplace/listings/abc/').status_code, 404)
+
+        self.client.force_authenticate(self.seller)
+        etag = self.client.get('/api/marketplace/listings/my_listings/')['ETag']
+        response = self.client.get('/api/marketplace/listings/my_listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_image_upload_changes_listing_etag(self):
+        listing = self.create_listings(1, images=0)[0]
+        etag = self.client.get(f'/api/marketplace/listings/{listing.pk}/')['ETag']
+        WasteListing.objects.filter(pk=listing.pk).update(updated_at=listing.updated_at - datetime.timedelta(seconds=5))
+        self.client.force_authenticate(self.seller)
+        image = SimpleUploadedFile('lot.gif', GIF, content_type='image/gif')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            response = self.client.post(
+                f'/api/marketplace/listings/{listing.pk}/upload_image/', {'image': image}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(f'/api/marketplace/listings/{listing.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_image_delete_changes_listing_etag(self):
+        listing = self.create_listings(1)[0]
+        WasteListing.objects.filter(pk=listing.pk).update(updated_at=listing.updated_at - datetime.timedelta(seconds=5))
+        etag = self.client.get('/api/marketplace/listings/')['ETag']
+        listing.images.first().delete()
+        response = self.client.get('/api/marketplace/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results'][0]['images']), 1)
+
+    def test_nested_listing_title_and_usernames_change_the_etags(self):
+        listing = self.create_listing()
+        Order.objects.create(
+            buyer=self.buyer, listing=listing, quantity=Decimal('1'),
+            total_price=Decimal('25'), shipping_address='Sfax',
+        )
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Hello', listing=listing)
+        self.client.force_authenticate(self.buyer)
+        urls = ('/api/marketplace/listings/', '/api/marketplace/orders/', '/api/marketplace/messages/')
+
+        def etags():
+            return {url: self.client.get(url)['ETag'] for url in urls}
+
+        before = etags()
+        listing.title = 'Renamed lot'
+        listing.save()
+        for url in urls:
+            with self.subTest(change='listing title', url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=before[url])
+                self.assertEqual(response.status_code, 200)
+
+        before = etags()
+        self.seller.username = 'renamed_seller'
+        self.seller.save()
+        self.buyer.username = 'renamed_buyer'
+        self.buyer.save()
+        for url in urls:
+            with self.subTest(change='usernames', url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=before[url])
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['sender_username'], 'renamed_buyer')
+
+
+class SparseFieldsetTests(MarketplaceTestCase):
+    def test_fields_limit_payload_and_columns(self):
+        self.create_listings(3)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/marketplace/listings/?fields=id,title,price,seller_username')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'price', 'seller_username'})
+        self.assertEqual(response.data['results'][0]['seller_username'], 'seller')
+
+        # validator, COUNT, listings joined to the seller only; no image prefetch
+        self.assertEqual(len(context.captured_queries), 3)
+        listing_query = context.captured_queries[-1]['sql']
+        self.assertNotIn('"description"', listing_query)
+        self.assertNotIn('waste_catalog_wastetype', listing_query)
+        self.assertNotIn('"auth_user"."email"', listing_query)
+
+    def test_expand_nests_related_objects(self):
+        self.create_listings(2)
+        with self.assertNumQueries(5):
+            # validator, COUNT, listings with seller/profile/waste type, images, documents
+            response = self.client.get('/api/marketplace/listings/?expand=seller,waste_type')
+        listing = response.data['results'][0]
+        self.assertEqual(listing['seller']['username'], 'seller')
+        self.assertEqual(listing['waste_type']['name'], 'Olive pomace')
+        self.assertIn('images', listing)
+
+    def test_fields_and_expand_together(self):
+        self.create_listings(1)
+        response = self.client.get('/api/marketplace/listings/active/?fields=id,seller,seller_username&expand=seller')
+        listing = response.data['results'][0]
+        self.assertEqual(set(listing), {'id', 'seller', 'seller_username'})
+        self.assertEqual(listing['seller']['email'], self.seller.email)
+
+    def test_unknown_names_are_ignored(self):
+        self.create_listings(1)
+        response = self.client.get('/api/marketplace/listings/?fields=id,nope&expand=nope')
+        self.assertEqual(response.data['results'][0], {'id': WasteListing.objects.get().pk})
+
+    def test_retrieve_and_cursor_pages(self):
+        listing = self.create_listings(20, images=0)[0]
+        response = self.client.get(f'/api/marketplace/listings/{listing.pk}/?fields=id,waste_type')
+        self.assertEqual(response.data, {'id': listing.pk, 'waste_type': response.data['waste_type']})
+        self.assertEqual(response.data['waste_type']['name'], 'Olive pomace')
+
+        response = self.client.get('/api/marketplace/listings/?pagination=cursor&fields=id&ordering=price')
+        self.assertIsNotNone(response.data['next'])
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_orders_and_messages(self):
+        listing = self.create_listing()
+        Order.objects.create(
+            buyer=self.buyer, listing=listing, quantity=Decimal('1'),
+            total_price=Decimal('10'), shipping_address='Sfax',
+        )
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Hello', listing=listing)
+        self.client.force_authenticate(self.buyer)
+
+        response = self.client.get('/api/marketplace/orders/my_orders/?fields=id,status,listing&expand=listing')
+        order = response.data['results'][0]
+        self.assertEqual(set(order), {'id', 'status', 'listing'})
+        self.assertEqual(order['listing']['title'], listing.title)
+
+        response = self.client.get('/api/marketplace/messages/?fields=id,subject,receiver_username')
+        self.assertEqual(response.data['results'][0], {
+            'id': Message.objects.get().pk, 'subject': 'Hi', 'receiver_username': 'seller',
+        })
+
+    def test_writes_ignore_fieldsets(self):
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post('/api/marketplace/messages/?fields=id', {
+            'receiver': self.seller.pk, 'subject': 'Hi', 'content': 'Hello',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('content', response.data)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AsyncReadTests(MarketplaceTestCase):
+    """
+    The async views of `agriwaste_project.urls_async`, compared with the sync ones.
+    """
+    def async_get(self, path, **headers):
+        with self.settings(ROOT_URLCONF='agriwaste_project.urls_async'):
+            return async_to_sync(self.async_client.get)(path, headers=headers)
+
+    def assertSameAsSync(self, path, **headers):
+        expected = self.client.get(path, headers=headers)
+        response = self.async_get(path, **headers)
+        self.assertEqual(response.status_code, expected.status_code, path)
+        self.assertEqual(response.json(), expected.json(), path)
+        self.assertEqual(response.get('ETag'), expected.get('ETag'), path)
+        return response
+
+    def test_hot_reads_resolve_to_coroutines(self):
+        listing = self.create_listing()
+        for path in (
+            '/api/marketplace/listings/',
+            f'/api/marketplace/listings/{listing.pk}/',
+            '/api/marketplace/listings/active/',
+            '/api/marketplace/listings/by_country/',
+            '/api/marketplace/messages/unread/',
+            '/api/marketplace/messages/counts/',
+            '/api/marketplace/messages/history/',
+            '/api/marketplace/conversations/',
+            '/api/marketplace/conversations/1/messages/',
+            '/api/waste-catalog/categories/',
+        ):
+            self.assertTrue(iscoroutinefunction(resolve(path, 'agriwaste_project.urls_async').func), path)
+            self.assertFalse(iscoroutinefunction(resolve(path).func), path)
+
+    def test_listing_reads_match_sync_views(self):
+        listing = self.create_listings(20)[0]
+        self.create_listing(title='Inactive', status='SOLD')
+        for path in (
+            '/api/marketplace/listings/',
+            '/api/marketplace/listings/?page=2&ordering=price',
+            '/api/marketplace/listings/?country=TN&search=pomace',
+            '/api/marketplace/listings/?fields=id,title&expand=seller',
+            f'/api/marketplace/listings/{listing.pk}/',
+            '/api/marketplace/listings/active/?country=TN',
+            '/api/marketplace/listings/by_country/?country=TN',
+            '/api/marketplace/listings/by_country/',
+            '/api/marketplace/listings/?pagination=cursor',
+            '/api/marketplace/listings/?page=9',
+            '/api/marketplace/listings/0/',
+            '/api/marketplace/listings/abc/',
+        ):
+            self.assertSameAsSync(path)
+
+    def test_same_query_count_as_sync(self):
+        self.create_listings(15)
+        # validator, COUNT, listings with seller/waste type, images
+        with self.assertNumQueries(4):
+            response = self.async_get('/api/marketplace/listings/')
+        self.assertEqual(len(response.json()['results']), 15)
+
+    def test_conditional_get(self):
+        self.create_listings(2)
+        etag = self.async_get('/api/marketplace/listings/active/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.async_get('/api/marketplace/listings/active/', If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unread_messages_require_a_token(self):
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Hello')
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Read', content='Old', read=True)
+        self.assertEqual(self.async_get('/api/marketplace/messages/unread/').status_code, 401)
+
+        token = Token.objects.create(user=self.seller)
+        response = self.assertSameAsSync('/api/marketplace/messages/unread/', Authorization=f'Token {token.key}')
+        self.assertEqual([message['subject'] for message in response.json()['results']], ['Hi'])
+
+    def test_other_requests_use_the_sync_views(self):
+        self.create_listing()
+        response = self.async_get('/api/marketplace/listings/', Accept='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/html', response['Content-Type'])
+
+        token = Token.objects.create(user=self.seller)
+        with self.settings(ROOT_URLCONF='agriwaste_project.urls_async'):
+            response = async_to_sync(self.async_client.post)(
+                '/api/marketplace/messages/',
+                {'receiver': self.buyer.pk, 'subject': 'Hi', 'content': 'Hello'},
+                content_type='application/json',
+                headers={'Authorization': f'Token {token.key}'},
+            )
+        self.assertEqual(response.status_code, 201)
+
+
+class MessageCountsTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.seller)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def send(self, sender, receiver, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(sender=sender, receiver=receiver, subject='Hi', content='Hello', **kwargs)
+
+    def counts(self):
+        response = self.client.get('/api/marketplace/messages/counts/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_are_served_from_the_counters(self):
+        first = self.send(self.buyer, self.seller)
+        self.send(self.buyer, self.seller, read=True)
+        self.send(self.seller, self.buyer)
+        self.assertEqual(self.counts(), {'unread': 1, 'received': 2, 'sent': 1})
+
+        # Token lookup and counters both come from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'unread': 1, 'received': 2, 'sent': 1})
+
+        self.send(self.buyer, self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/marketplace/messages/{first.pk}/mark_as_read/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'unread': 1, 'received': 3, 'sent': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(pk=first.pk).delete()
+            Message.objects.filter(sender=self.seller).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'unread': 1, 'received': 2, 'sent': 0})
+
+    def test_changing_participants_recounts(self):
+        message = self.send(self.buyer, self.seller)
+        self.assertEqual(self.counts()['received'], 1)
+        other = User.objects.create(username='other')
+        message.receiver = other
+        with self.captureOnCommitCallbacks(execute=True):
+            message.save()
+        self.assertEqual(self.counts(), {'unread': 0, 'received': 0, 'sent': 0})
+
+    def test_rolled_back_writes_do_not_count(self):
+        self.assertEqual(self.counts()['unread'], 0)
+        with self.captureOnCommitCallbacks(execute=False):
+            Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Hello')
+        cache.delete(f'marketplace:messages:{self.seller.pk}:received')
+        # A partial set of counters is recounted from the database
+        self.assertEqual(self.counts(), {'unread': 1, 'received': 1, 'sent': 0})
+
+    def test_async_view_shares_the_counters(self):
+        self.send(self.buyer, self.seller)
+        self.assertEqual(self.counts()['unread'], 1)
+        self.send(self.buyer, self.seller)
+        with self.settings(ROOT_URLCONF='agriwaste_project.urls_async', ALLOWED_HOSTS=['testserver']):
+            response = async_to_sync(self.async_client.get)(
+                '/api/marketplace/messages/counts/', headers={'Authorization': f'Token {self.token.key}'}
+            )
+        self.assertEqual(response.json(), {'unread': 2, 'received': 2, 'sent': 0})
+
+class ConversationTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+
+    def send(self, sender, receiver, content='Hello', **kwargs):
+        return Message.objects.create(sender=sender, receiver=receiver, subject='Hi', content=content, **kwargs)
+
+    def unread(self, conversation, user):
+        return ConversationParticipant.objects.get(conversation=conversation, user=user).unread_count
+
+    def test_messages_are_grouped_into_conversations(self):
+        first = self.send(self.buyer, self.seller, 'About the lot')
+        reply = self.send(self.seller, self.buyer, 'x' * 300)
+        about_listing = self.send(self.buyer, self.seller, listing=self.listing)
+        self.assertEqual(first.conversation, reply.conversation)
+        self.assertNotEqual(first.conversation, about_listing.conversation)
+
+        conversation = Conversation.objects.get(pk=first.conversation_id)
+        self.assertEqual(conversation.last_message_id, reply.pk)
+        self.assertEqual(conversation.last_message_at, reply.created_at)
+        self.assertEqual(len(conversation.last_message_preview), 100)
+        self.assertEqual(self.unread(conversation, self.seller), 1)
+        self.assertEqual(self.unread(conversation, self.buyer), 1)
+
+        first.read = True
+        first.save()
+        self.assertEqual(self.unread(conversation, self.seller), 0)
+
+        reply.delete()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, first.pk)
+        self.assertEqual(conversation.last_message_preview, 'About the lot')
+        self.assertEqual(self.unread(conversation, self.buyer), 0)
+
+    def test_inbox_pages_through_conversations(self):
+        others = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for other in others:
+            self.send(other, self.buyer)
+        self.send(self.seller, self.buyer, 'Newest')
+        # Replying moves the conversation to the top
+        self.send(self.buyer, others[0], 'Reply')
+
+        self.client.force_authenticate(self.buyer)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/marketplace/conversations/')
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([row['last_message_preview'] for row in page['results']][:2], ['Reply', 'Newest'])
+        self.assertEqual(len(page['results']), 4)
+        self.assertEqual(page['results'][0]['unread_count'], 1)
+        self.assertEqual(page['results'][0]['last_message_sender'], self.buyer.pk)
+        self.assertEqual(
+            sorted(user['username'] for user in page['results'][0]['participants']), ['buyer', 'user0']
+        )
+
+        seen = []
+        url = '/api/marketplace/conversations/'
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            while url:
+                page = self.client.get(url).json()
+                seen += [row['id'] for row in page['results']]
+                url = page['next']
+        self.assertEqual(seen, [row['id'] for row in response.json()['results']])
+
+    def test_thread_lists_a_conversations_messages(self):
+        messages = [self.send(self.buyer, self.seller, f'Message {i}') for i in range(3)]
+        self.send(self.buyer, self.seller, 'Other thread', listing=self.listing)
+        conversation_id = messages[0].conversation_id
+
+        self.client.force_authenticate(self.seller)
+        response = self.client.get(f'/api/marketplace/conversations/{conversation_id}/messages/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['content'] for row in response.data['results']], ['Message 2', 'Message 1', 'Message 0'])
+        self.assertIsNone(response.data['next'])
+
+        self.client.force_authenticate(User.objects.create(username='outsider'))
+        response = self.client.get(f'/api/marketplace/conversations/{conversation_id}/messages/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/marketplace/conversations/abc/messages/').status_code, 404)
+
+    def test_changing_the_receiver_or_listing_moves_the_message(self):
+        other = User.objects.create(username='other')
+        earlier = self.send(self.buyer, self.seller, 'Earlier')
+        message = self.send(self.buyer, self.seller, 'Misaddressed')
+        conversation = message.conversation
+        self.assertEqual(self.unread(conversation, self.seller), 2)
+
+        self.client.force_authenticate(self.buyer)
+        response = self.client.patch(f'/api/marketplace/messages/{message.pk}/', {'receiver': other.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        moved_to = message.conversation
+        self.assertNotEqual(moved_to, conversation)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, earlier.pk)
+        self.assertEqual(conversation.last_message_preview, 'Earlier')
+        self.assertEqual(self.unread(conversation, self.seller), 1)
+        self.assertEqual(moved_to.last_message_id, message.pk)
+        self.assertEqual(self.unread(moved_to, other), 1)
+
+        self.client.force_authenticate(self.seller)
+        response = self.client.get(f'/api/marketplace/conversations/{conversation.pk}/messages/')
+        self.assertEqual([row['content'] for row in response.data['results']], ['Earlier'])
+        self.client.force_authenticate(other)
+        response = self.client.get('/api/marketplace/conversations/')
+        self.assertEqual([row['last_message_preview'] for row in response.json()['results']], ['Misaddressed'])
+        self.assertEqual(response.json()['results'][0]['unread_count'], 1)
+
+        # Moving the only message of a conversation leaves it empty
+        message.listing = self.listing
+        message.read = True
+        message.save()
+        moved_to.refresh_from_db()
+        self.assertIsNone(moved_to.last_message_id)
+        self.assertEqual(self.unread(moved_to, other), 0)
+        about_listing = Conversation.objects.get(pk=message.conversation_id)
+        self.assertEqual(about_listing.listing_id, self.listing.pk)
+        self.assertEqual(about_listing.last_message_id, message.pk)
+        self.assertEqual(self.unread(about_listing, other), 0)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_async_views_match_sync(self):
+        message = self.send(self.buyer, self.seller)
+        token = Token.objects.create(user=self.seller)
+        headers = {'Authorization': f'Token {token.key}'}
+        for path in (
+            '/api/marketplace/conversations/',
+            f'/api/marketplace/conversations/{message.conversation_id}/messages/',
+            '/api/marketplace/conversations/999/messages/',
+        ):
+            expected = self.client.get(path, headers=headers)
+            with self.settings(ROOT_URLCONF='agriwaste_project.urls_async'):
+                response = async_to_sync(self.async_client.get)(path, headers=headers)
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.json(), expected.json(), path)
+
+class BulkReadStateTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        self.other = User.objects.create(username='other')
+        self.messages = [
+            Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='1'),
+            Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='2', listing=self.listing),
+            Message.objects.create(sender=self.other, receiver=self.seller, subject='Hi', content='3'),
+            Message.objects.create(sender=self.seller, receiver=self.buyer, subject='Hi', content='4'),
+        ]
+        self.client.force_authenticate(self.seller)
+
+    def mark(self, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data or {}, format='json')
+        # One UPDATE of the messages, then of the unread counts and unread inquiries; no message is loaded
+        statements = [query['sql'].split()[0] for query in queries if 'marketplace_message' in query['sql']]
+        if response.status_code == 200 and response.data['updated']:
+            self.assertEqual(statements, ['UPDATE', 'UPDATE', 'UPDATE'])
+        return response
+
+    def unread(self):
+        return sorted(Message.objects.filter(read=False).values_list('content', flat=True))
+
+    def test_mark_all_read(self):
+        self.assertEqual(self.client.get('/api/marketplace/messages/counts/').data['unread'], 3)
+        with mock.patch.object(broker, 'publish') as publish:
+            response = self.mark('/api/marketplace/messages/mark_all_read/')
+        self.assertEqual(response.data, {'updated': 3})
+        self.assertEqual(self.unread(), ['4'])
+        publish.assert_called_once_with([self.seller.pk], 'messages.read', {'count': 3})
+
+        self.assertEqual(self.client.get('/api/marketplace/messages/counts/').data['unread'], 0)
+        self.assertEqual(
+            list(ConversationParticipant.objects.filter(user=self.seller).values_list('unread_count', flat=True)),
+            [0, 0, 0],
+        )
+        self.assertEqual(ConversationParticipant.objects.get(user=self.buyer, unread_count__gt=0).unread_count, 1)
+        self.assertGreater(Message.objects.get(content='1').updated_at, self.messages[0].updated_at)
+        self.assertEqual(self.mark('/api/marketplace/messages/mark_all_read/').data, {'updated': 0})
+
+    def test_mark_read_by_criteria(self):
+        url = '/api/marketplace/messages/mark_read/'
+        # The buyer's own unread message is not the seller's to mark
+        response = self.mark(url, {'ids': [self.messages[0].pk, self.messages[3].pk]})
+        self.assertEqual(response.data, {'updated': 1})
+        self.assertEqual(self.unread(), ['2', '3', '4'])
+
+        self.assertEqual(self.mark(url, {'sender': self.buyer.pk, 'listing': self.listing.pk}).data, {'updated': 1})
+        self.assertEqual(self.mark(url, {'conversation': self.messages[2].conversation_id}).data, {'updated': 1})
+        self.assertEqual(self.unread(), ['4'])
+        self.assertFalse(ConversationParticipant.objects.filter(user=self.seller, unread_count__gt=0).exists())
+
+    def test_mark_read_needs_criteria(self):
+        url = '/api/marketplace/messages/mark_read/'
+        self.assertEqual(self.mark(url).status_code, 400)
+        self.assertEqual(self.mark(url, {'ids': ['abc']}).status_code, 400)
+        self.assertEqual(self.mark(url, {'ids': list(range(1001))}).status_code, 400)
+        self.assertEqual(len(self.unread()), 4)
+
+class MessageArchiveTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        now = timezone.now()
+        self.messages = []
+        for i in range(10):
+            sender, receiver = (self.buyer, self.seller) if i % 2 else (self.seller, self.buyer)
+            message = Message.objects.create(sender=sender, receiver=receiver, subject='Hi', content=f'{i}', read=True)
+            # Two per day, the first eight older than the cutoff
+            created_at = now - datetime.timedelta(days=200 - i // 2 * 5 if i < 8 else 1) + datetime.timedelta(minutes=i)
+            Message.objects.filter(pk=message.pk).update(created_at=created_at)
+            self.messages.append(message.pk)
+        old = now - datetime.timedelta(days=300)
+        unread = Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='unread')
+        alone = Message.objects.create(
+            sender=self.buyer, receiver=self.seller, subject='Hi', content='alone', read=True, listing=self.listing
+        )
+        Message.objects.filter(pk__in=[unread.pk, alone.pk]).update(created_at=old)
+        self.kept = [unread.pk, alone.pk]
+        self.client.force_authenticate(self.seller)
+
+    def walk(self, url, page_size=3):
+        ids = []
+        with mock.patch.object(KeysetPagination, 'page_size', page_size):
+            while url:
+                page = self.client.get(url).json()
+                ids += [row['id'] for row in page['results']]
+                url = page['next']
+        return ids
+
+    def walk_back(self, url, page_size=3):
+        # From the last page to the first, following `previous` links
+        with mock.patch.object(KeysetPagination, 'page_size', page_size):
+            page = self.client.get(url).json()
+            while page['next']:
+                page = self.client.get(page['next']).json()
+            ids = [row['id'] for row in page['results']]
+            while page['previous']:
+                page = self.client.get(page['previous']).json()
+                ids = [row['id'] for row in page['results']] + ids
+        return ids
+
+    def test_moves_old_read_messages_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive_messages(archive_cutoff(180), chunk_size=3), 8)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('pk', flat=True)), self.messages[:8])
+        self.assertEqual(
+            sorted(Message.objects.values_list('pk', flat=True)), sorted(self.messages[8:] + self.kept)
+        )
+        archived = ArchivedMessage.objects.get(pk=self.messages[1])
+        self.assertEqual((archived.sender, archived.receiver, archived.content), (self.buyer, self.seller, '1'))
+        self.assertIsNotNone(archived.conversation_id)
+
+        stdout = io.StringIO()
+        call_command('archive_messages', '--older-than-days', '180', stdout=stdout)
+        self.assertIn('Archived 0 messages', stdout.getvalue())
+
+    def test_history_and_threads_merge_the_archive(self):
+        history_url = '/api/marketplace/messages/history/'
+        thread_url = f'/api/marketplace/conversations/{Message.objects.get(pk=self.messages[0]).conversation_id}/messages/'
+        history, thread = self.walk(history_url), self.walk(thread_url)
+        self.assertEqual(len(history), 12)
+        self.assertEqual(history[:2], self.messages[9:7:-1])
+        self.assertEqual(thread, self.messages[::-1] + self.kept[:1])
+
+        archive_messages(archive_cutoff(180), chunk_size=5)
+        for url, expected in ((history_url, history), (thread_url, thread)):
+            for page_size in (2, 3, 20):
+                self.assertEqual(self.walk(url, page_size), expected, (url, page_size))
+            self.assertEqual(self.walk_back(url), expected, url)
+
+    def archive_reads(self, queries):
+        # Leaves out the horizon's MAX(created_at)
+        return [query for query in queries if 'archivedmessage' in query['sql'] and 'MAX(' not in query['sql']]
+
+    def test_recent_pages_do_not_read_the_archive(self):
+        archive_messages(archive_cutoff(180))
+        self.client.get('/api/marketplace/messages/history/')
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get('/api/marketplace/messages/history/').json()
+            self.assertEqual(self.archive_reads(queries), [])
+            self.assertEqual([row['id'] for row in page['results']], self.messages[9:])
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(page['next'])
+            self.assertNotEqual(self.archive_reads(queries), [])
+
+    def test_process_local_cache_does_not_hide_the_archive(self):
+        # A worker that cached the empty archive before another process archived
+        cache.set(HORIZON_KEY, False, None)
+        archive_messages(archive_cutoff(180))
+        cache.set(HORIZON_KEY, False, None)
+        with mock.patch.object(KeysetPagination, 'page_size', 20):
+            page = self.client.get('/api/marketplace/messages/history/').json()
+        self.assertEqual(len(page['results']), 12)
+
+    def test_counts_include_archived_messages(self):
+        expected = self.client.get('/api/marketplace/messages/counts/').json()
+        self.assertEqual(expected, {'unread': 1, 'received': 7, 'sent': 5})
+        archive_messages(archive_cutoff(180))
+        self.assertEqual(self.client.get('/api/marketplace/messages/counts/').json(), expected)
+        cache.clear()
+        self.assertEqual(self.client.get('/api/marketplace/messages/counts/').json(), expected)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_async_views_match_sync(self):
+        archive_messages(archive_cutoff(180))
+        self.client.force_authenticate(None)
+        token = Token.objects.create(user=self.seller)
+        headers = {'Authorization': f'Token {token.key}'}
+        conversation_id = Message.objects.get(pk=self.messages[9]).conversation_id
+        with mock.patch.object(KeysetPagination, 'page_size', 3):
+            for url in ('/api/marketplace/messages/history/', f'/api/marketplace/conversations/{conversation_id}/messages/'):
+                while url:
+                    expected = self.client.get(url, headers=headers).json()
+                    with self.settings(ROOT_URLCONF='agriwaste_project.urls_async'):
+                        response = async_to_sync(self.async_client.get)(url, headers=headers)
+                    self.assertEqual(response.json(), expected, url)
+                    url = expected['next']
+
+class SellerSummaryTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        self.client.force_authenticate(self.seller)
+
+    def order(self, listing=None, **kwargs):
+        data = {'quantity': Decimal('2.00'), 'total_price': Decimal('50.00'), 'shipping_address': 'Sfax'}
+        data.update(kwargs)
+        return Order.objects.create(buyer=self.buyer, listing=listing or self.listing, **data)
+
+    def assertMatchesRebuild(self):
+        # The running totals equal a recount, zero rows aside
+        stored = {
+            (row.seller_id, row.metric): row.value for row in SellerSummary.objects.all() if row.value
+        }
+        self.assertEqual(stored, {key: value for key, value in summary_rows().items() if value})
+
+    def test_summary_follows_orders_listings_and_messages(self):
+        other_listing = self.create_listing(currency='LYD')
+        orders = [self.order(), self.order(), self.order(other_listing, total_price=Decimal('12.50'))]
+        for order in orders:
+            order.status = 'COMPLETED'
+            order.save()
+        orders[1].status = 'CANCELLED'
+        orders[1].save()
+        self.create_listing(status='PAUSED').delete()
+        other_listing.status = 'SOLD'
+        other_listing.save()
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='?', listing=self.listing)
+        Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Not an inquiry')
+        Message.objects.create(sender=self.seller, receiver=self.buyer, subject='Hi', content='!', listing=self.listing)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/dashboard/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'orders': {'PENDING': 0, 'ACCEPTED': 0, 'REJECTED': 0, 'CANCELLED': 1, 'COMPLETED': 2},
+            'revenue': {'TND': '50.00', 'LYD': '12.50', 'DZD': '0.00'},
+            'listings': {'ACTIVE': 1, 'SOLD': 1, 'EXPIRED': 0, 'PAUSED': 0},
+            'unread_inquiries': 1,
+        })
+        self.assertMatchesRebuild()
+
+        orders[0].delete()
+        self.client.post('/api/marketplace/messages/mark_all_read/')
+        summary = get_summary(self.seller.pk)
+        self.assertEqual(summary['revenue']['TND'], '0.00')
+        self.assertEqual(summary['unread_inquiries'], 0)
+        self.assertMatchesRebuild()
+
+    def test_moving_a_listing_recounts_both_sellers(self):
+        self.order(status='COMPLETED')
+        self.listing.seller = self.buyer
+        self.listing.save()
+        self.assertEqual(get_summary(self.seller.pk)['revenue']['TND'], '0.00')
+        self.assertEqual(get_summary(self.buyer.pk)['revenue']['TND'], '50.00')
+        self.listing.currency = 'DZD'
+        self.listing.save()
+        self.assertEqual(get_summary(self.buyer.pk)['revenue']['DZD'], '50.00')
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command(self):
+        self.order()
+        SellerSummary.objects.all().delete()
+        stdout = io.StringIO()
+        call_command('rebuild_seller_summaries', stdout=stdout)
+        self.assertIn('Wrote 2 summary rows', stdout.getvalue())
+        self.assertEqual(get_summary(self.seller.pk)['orders']['PENDING'], 1)
+        self.assertEqual(get_summary(self.buyer.pk)['orders']['PENDING'], 0)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_async_view_matches_sync(self):
+        self.order(status='COMPLETED')
+        token = Token.objects.create(user=self.seller)
+        headers = {'Authorization': f'Token {token.key}'}
+        expected = self.client.get('/api/marketplace/dashboard/summary/', headers=headers).json()
+        with self.settings(ROOT_URLCONF='agriwaste_project.urls_async'):
+            response = async_to_sync(self.async_client.get)('/api/marketplace/dashboard/summary/', headers=headers)
+        self.assertEqual(response.json(), expected)
+
+class ListingRatingTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        self.reviewers = [User.objects.create(username=f'reviewer{i}') for i in range(3)]
+
+    def review(self, reviewer, rating, listing=None):
+        return Review.objects.create(reviewer=reviewer, listing=listing or self.listing, rating=rating, comment='Good')
+
+    def stats(self, listing=None):
+        listing = WasteListing.objects.get(pk=(listing or self.listing).pk)
+        return listing.rating_count, listing.rating_sum, listing.rating_average
+
+    def test_reviews_update_the_listing_statistics(self):
+        first = self.review(self.reviewers[0], 5)
+        self.review(self.reviewers[1], 4)
+        second = self.review(self.reviewers[2], 4)
+        self.assertEqual(self.stats(), (3, 13, Decimal('4.33')))
+
+        first.rating = 2
+        first.save()
+        self.assertEqual(self.stats(), (3, 10, Decimal('3.33')))
+
+        other = self.create_listing(title='Other lot')
+        second.listing = other
+        second.save()
+        self.assertEqual(self.stats(), (2, 6, Decimal('3.00')))
+        self.assertEqual(self.stats(other), (1, 4, Decimal('4.00')))
+
+        Review.objects.filter(listing=self.listing).delete()
+        self.assertEqual(self.stats(), (0, 0, Decimal('0.00')))
+
+    def test_saving_a_stale_listing_keeps_the_statistics(self):
+        stale = WasteListing.objects.get(pk=self.listing.pk)
+        self.review(self.reviewers[0], 5)
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.stats(), (1, 5, Decimal('5.00')))
+        self.assertEqual(WasteListing.objects.get(pk=self.listing.pk).title, 'Renamed')
+
+    def test_ratings_are_listed_and_sortable(self):
+        best = self.create_listing(title='Best')
+        self.review(self.reviewers[0], 5, best)
+        self.review(self.reviewers[0], 3)
+        self.review(self.reviewers[1], 4)
+        unrated = self.create_listing(title='Unrated')
+        self.client.force_authenticate(self.buyer)
+
+        # No review is read
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/marketplace/listings/?ordering=-rating_average')
+        results = response.json()['results']
+        self.assertEqual([row['id'] for row in results], [best.pk, self.listing.pk, unrated.pk])
+        self.assertEqual(
+            (results[1]['rating_count'], results[1]['rating_sum'], results[1]['rating_average']), (2, 7, '3.50')
+        )
+        response = self.client.get('/api/marketplace/listings/?pagination=cursor&ordering=-rating_count')
+        self.assertEqual(response.json()['results'][0]['id'], self.listing.pk)
+
+        # Cursors compare against the stored averages, ties included
+        tied = self.create_listing(title='Tied')
+        for reviewer, rating in zip(self.reviewers, (5, 4, 4)):
+            self.review(reviewer, rating, tied)
+        self.review(self.reviewers[1], 4, best)
+        self.review(self.reviewers[2], 4, best)
+        self.assertEqual(self.stats(best), (3, 13, Decimal('4.33')))
+        seen = []
+        url = '/api/marketplace/listings/?pagination=cursor&ordering=-rating_average'
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            while url:
+                page = self.client.get(url).json()
+                seen += [row['id'] for row in page['results']]
+                url = page['next']
+        self.assertEqual(seen, [tied.pk, best.pk, self.listing.pk, unrated.pk])
+
+        plan = WasteListing.objects.order_by('-rating_average', '-id')[:20].explain()
+        self.assertIn('listing_rating_idx', plan)
+
+    def test_statistics_are_not_writable(self):
+        self.client.force_authenticate(self.seller)
+        response = self.client.patch(
+            f'/api/marketplace/listings/{self.listing.pk}/', {'rating_count': 10, 'rating_sum': 50}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats(), (0, 0, Decimal('0.00')))
+
+class SellerReputationTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        self.other = User.objects.create(username='other')
+        self.other_listing = self.create_listing(seller=self.other, title='Other lot')
+
+    def inquire(self, listing, hours_ago, reply_after=None):
+        now = timezone.now()
+        inquiry = Message.objects.create(
+            sender=self.buyer, receiver=listing.seller, subject='Hi', content='Available?', listing=listing
+        )
+        Message.objects.filter(pk=inquiry.pk).update(created_at=now - datetime.timedelta(hours=hours_ago))
+        if reply_after is not None:
+            reply = Message.objects.create(
+                sender=listing.seller, receiver=self.buyer, subject='Re: Hi', content='Yes', listing=listing
+            )
+            Message.objects.filter(pk=reply.pk).update(
+                created_at=now - datetime.timedelta(hours=hours_ago - reply_after)
+            )
+
+    def test_scores_combine_ratings_orders_and_replies(self):
+        self.assertEqual(
+            compute_reputations([self.seller.pk, self.other.pk]),
+            {self.seller.pk: Decimal('50.00'), self.other.pk: Decimal('50.00')},
+        )
+        for i in range(5):
+            reviewer = User.objects.create(username=f'reviewer{i}')
+            Review.objects.create(reviewer=reviewer, listing=self.listing, rating=5, comment='Great')
+        # (5 + 2.5) / 10 for ratings, and 0.5 for the rest
+        self.assertEqual(compute_reputations([self.seller.pk])[self.seller.pk], Decimal('62.50'))
+
+        for status in ('COMPLETED', 'COMPLETED', 'CANCELLED', 'PENDING'):
+            Order.objects.create(
+                buyer=self.buyer, listing=self.listing, quantity=Decimal('1'),
+                total_price=Decimal('25'), shipping_address='Sfax', status=status,
+            )
+        # One reply after a half-life, one inquiry unanswered past the deadline, one still fresh
+        self.inquire(self.listing, 200, reply_after=24)
+        self.inquire(self.listing, 100)
+        self.inquire(self.listing, 1)
+        # 0.5 * 0.75 + 0.3 * (2 + 2.5) / 8 + 0.2 * (0.5 + 2.5) / 7
+        self.assertEqual(compute_reputations([self.seller.pk])[self.seller.pk], Decimal('62.95'))
+
+        Order.objects.create(
+            buyer=self.buyer, listing=self.other_listing, quantity=Decimal('1'),
+            total_price=Decimal('25'), shipping_address='Sfax', status='REJECTED',
+        )
+        self.assertLess(compute_reputations([self.other.pk])[self.other.pk], Decimal('50'))
+
+    def test_listings_filter_and_sort_by_reputation(self):
+        for i in range(5):
+            reviewer = User.objects.create(username=f'reviewer{i}')
+            Review.objects.create(reviewer=reviewer, listing=self.listing, rating=5, comment='Great')
+        before = WasteListing.objects.get(pk=self.listing.pk).updated_at
+        stdout = io.StringIO()
+        call_command('update_reputations', stdout=stdout)
+        self.assertIn('Updated 1 seller reputations', stdout.getvalue())
+        self.assertEqual(update_reputations(), 0)
+
+        listing = WasteListing.objects.get(pk=self.listing.pk)
+        self.assertEqual(listing.seller_reputation, Decimal('62.50'))
+        self.assertGreater(listing.updated_at, before)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.profile.reputation_score, Decimal('62.50'))
+        self.assertIsNotNone(self.seller.profile.reputation_updated_at)
+        # New listings start from their seller's score
+        newer = self.create_listing(title='Newer')
+        self.assertEqual(WasteListing.objects.get(pk=newer.pk).seller_reputation, Decimal('62.50'))
+
+        response = self.client.get('/api/marketplace/listings/?ordering=-seller_reputation')
+        self.assertEqual(
+            [row['id'] for row in response.json()['results']][-1], self.other_listing.pk
+        )
+        response = self.client.get('/api/marketplace/listings/?min_reputation=60&pagination=cursor')
+        self.assertEqual(sorted(row['id'] for row in response.json()['results']), [self.listing.pk, newer.pk])
+        self.assertEqual(response.json()['results'][0]['seller_reputation'], '62.50')
+        self.assertEqual(self.client.get('/api/marketplace/listings/?min_reputation=abc').status_code, 400)
+        plan = WasteListing.objects.order_by('-seller_reputation', '-id')[:20].explain()
+        self.assertIn('listing_reputation_idx', plan)
+
+    def test_non_finite_min_reputation_is_rejected(self):
+        for url in ('/api/marketplace/listings/', '/api/marketplace/listings/facets/'):
+            for value in ('NaN', 'Infinity', '-Infinity', 'abc'):
+                with self.subTest(url=url, value=value):
+                    response = self.client.get(url, {'min_reputation': value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('min_reputation', response.json())
+
+    def test_saving_a_stale_user_keeps_the_score(self):
+        stale = User.objects.get(pk=self.seller.pk)
+        stale.profile
+        Review.objects.create(reviewer=self.buyer, listing=self.listing, rating=1, comment='Late')
+        update_reputations([self.seller.pk])
+        stale.first_name = 'Renamed'
+        stale.save()
+        self.seller.refresh_from_db()
+        self.assertLess(self.seller.profile.reputation_score, Decimal('50'))
+
+class OrderReservationTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing(quantity=Decimal('10.00'))
+        self.client.force_authenticate(self.buyer)
+
+    def order(self, quantity, **kwargs):
+        return Order.objects.create(
+            buyer=self.buyer, listing=self.listing, quantity=quantity, shipping_address='Sfax', **kwargs
+        )
+
+    def assertListing(self, quantity, status):
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.quantity, self.listing.status), (Decimal(quantity), status))
+
+    def test_placing_orders_reserves_quantity_and_sells_out(self):
+        response = self.client.post('/api/marketplace/orders/', {
+            'listing': self.listing.pk, 'buyer': self.buyer.pk, 'quantity': '4', 'total_price': '1',
+            'shipping_address': 'Sfax',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Priced by the server
+        self.assertEqual(response.data['total_price'], '100.00')
+        self.assertListing('6', 'ACTIVE')
+
+        response = self.client.post('/api/marketplace/orders/', {
+            'listing': self.listing.pk, 'buyer': self.buyer.pk, 'quantity': '7', 'shipping_address': 'Sfax',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertListing('6', 'ACTIVE')
+
+        self.order(Decimal('6'))
+        self.assertListing('0', 'SOLD')
+        self.assertEqual(get_summary(self.seller.pk)['listings'], {'ACTIVE': 0, 'SOLD': 1, 'EXPIRED': 0, 'PAUSED': 0})
+        with self.assertRaises(InsufficientQuantity):
+            self.order(Decimal('1'))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_rejected_and_cancelled_orders_release_quantity(self):
+        rejected, cancelled = self.order(Decimal('4')), self.order(Decimal('6'))
+        self.client.force_authenticate(self.seller)
+        response = self.client.post(f'/api/marketplace/orders/{rejected.pk}/update_status/', {'status': 'REJECTED'})
+        self.assertEqual(response.status_code, 200)
+        self.assertListing('4', 'ACTIVE')
+        cancelled.status = 'CANCELLED'
+        cancelled.save()
+        self.assertListing('10', 'ACTIVE')
+        self.assertEqual(get_summary(self.seller.pk)['listings']['SOLD'], 0)
+
+        # Reopening takes the quantity again, if it is still there
+        self.order(Decimal('8'))
+        response = self.client.post(f'/api/marketplace/orders/{rejected.pk}/update_status/', {'status': 'ACCEPTED'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.get(pk=rejected.pk).status, 'REJECTED')
+        response = self.client.post(f'/api/marketplace/orders/{cancelled.pk}/update_status/', {'status': 'PENDING'})
+        self.assertEqual(response.status_code, 409)
+        self.assertListing('2', 'ACTIVE')
+
+    def test_completed_orders_keep_their_quantity(self):
+        completed, pending = self.order(Decimal('3')), self.order(Decimal('7'))
+        completed.status = 'COMPLETED'
+        completed.save()
+        completed.delete()
+        self.assertListing('0', 'SOLD')
+        pending.delete()
+        self.assertListing('7', 'ACTIVE')
+
+    def test_only_active_listings_take_orders(self):
+        self.listing.status = 'PAUSED'
+        self.listing.save()
+        with self.assertRaises(InsufficientQuantity):
+            self.order(Decimal('1'))
+        self.assertListing('10', 'PAUSED')
+
+    def test_orders_cannot_move_their_reservation(self):
+        order = self.order(Decimal('2'))
+        response = self.client.patch(f'/api/marketplace/orders/{order.pk}/', {'quantity': '5'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/marketplace/orders/', {
+            'listing': self.listing.pk, 'buyer': self.buyer.pk, 'quantity': '0', 'shipping_address': 'Sfax',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertListing('8', 'ACTIVE')
+
+    def test_new_orders_ignore_the_posted_status(self):
+        for status in ('CANCELLED', 'REJECTED', 'COMPLETED'):
+            with self.subTest(status=status):
+                response = self.client.post('/api/marketplace/orders/', {
+                    'listing': self.listing.pk, 'buyer': self.buyer.pk, 'quantity': '1', 'status': status,
+                    'shipping_address': 'Sfax',
+                }, format='json')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual((response.data['status'], response.data['total_price']), ('PENDING', '25.00'))
+        self.assertListing('7', 'ACTIVE')
+
+        self.listing.status = 'PAUSED'
+        self.listing.save()
+        response = self.client.post('/api/marketplace/orders/', {
+            'listing': self.listing.pk, 'buyer': self.buyer.pk, 'quantity': '1', 'status': 'CANCELLED',
+            'shipping_address': 'Sfax',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 3)
+        # Saving the refreshed listing did not apply the reservations again
+        self.assertListing('7', 'PAUSED')
+
+    def test_saving_a_stale_listing_keeps_reservations(self):
+        stale = WasteListing.objects.get(pk=self.listing.pk)
+        self.order(Decimal('4'))
+        stale.title = 'Renamed lot'
+        stale.save()
+        self.assertListing('6', 'ACTIVE')
+        # The seller adds 5 to the 10 they saw
+        stale.quantity += 5
+        stale.save()
+        self.assertEqual(stale.quantity, Decimal('11'))
+        self.assertListing('11', 'ACTIVE')
+
+        self.order(Decimal('11'))
+        stale.price = Decimal('30.00')
+        stale.save()
+        self.assertListing('0', 'SOLD')
+        stale.status = 'PAUSED'
+        with self.assertRaises(ListingChanged):
+            stale.save()
+        self.assertListing('0', 'SOLD')
+        self.assertEqual(WasteListing.objects.get(pk=self.listing.pk).price, Decimal('30.00'))
+        self.assertEqual(get_summary(self.seller.pk)['listings'], {'ACTIVE': 0, 'SOLD': 1, 'EXPIRED': 0, 'PAUSED': 0})
+
+    def test_listing_updates_conflicting_with_orders_are_refused(self):
+        self.order(Decimal('8'))
+        self.client.force_authenticate(self.seller)
+        response = self.client.patch(f'/api/marketplace/listings/{self.listing.pk}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertListing('2', 'ACTIVE')
+        # An order selling the listing out between loading and saving it
+        with mock.patch.object(WasteListing, 'save_reserved_fields', side_effect=ListingChanged):
+            response = self.client.patch(
+                f'/api/marketplace/listings/{self.listing.pk}/', {'status': 'PAUSED'}, format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertListing('2', 'ACTIVE')
+
+        stale = WasteListing.objects.get(pk=self.listing.pk)
+        self.order(Decimal('1'))
+        # Taking away more than is left
+        stale.quantity -= 2
+        with self.assertRaises(ListingChanged):
+            stale.save()
+        self.assertListing('1', 'ACTIVE')
+
+    def test_deleting_the_listing_deletes_its_orders(self):
+        self.order(Decimal('10'))
+        self.listing.delete()
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(summary_rows(), {})
+
+
+class ConcurrentOrderTests(SimpleTestCase):
+    def test_concurrent_orders_never_oversell(self):
+        # The in-memory test database cannot take concurrent writers, so the
+        # command runs in its own process, on a file of its own
+        snapshots = Path(settings.WASTE_CATALOG_SNAPSHOT_DIR)
+        written = {path.name: path.stat().st_mtime_ns for path in snapshots.glob('*')}
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run(
+                [sys.executable, 'manage.py', 'stress_orders', '--buyers', '12', '--orders', '10', '--quantity', '40'],
+                cwd=settings.BASE_DIR, env={
+                    **{name: value for name, value in os.environ.items() if name not in ('DB_ENGINE', 'DB_REPLICAS')},
+                    'DB_NAME': os.path.join(directory, 'db.sqlite3'),
+                },
+                capture_output=True, text=True, timeout=300,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('120 requests', result.stdout)
+        self.assertIn(' 0 failed', result.stdout)
+        self.assertIn('Ordered 40 of 40, 0.00 left, listing SOLD', result.stdout)
+        self.assertIn('No oversell', result.stdout)
+        # Its throwaway catalog rows left the project's snapshot alone
+        self.assertEqual({path.name: path.stat().st_mtime_ns for path in snapshots.glob('*')}, written)
+
+
+class EventPublishingTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        patcher = mock.patch.object(broker, 'publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self):
+        return [(sorted(call.args[0]), call.args[1], call.args[2]) for call in self.publish.call_args_list]
+
+    def test_message_events(self):
+        self.client.force_authenticate(self.buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/marketplace/messages/', {
+                'receiver': self.seller.pk, 'subject': 'Hi', 'content': 'Hello',
+            }, format='json')
+        message_id = response.data['id']
+        participants = sorted([self.buyer.pk, self.seller.pk])
+        self.assertEqual(self.published(), [(participants, 'message.created', {
+            'id': message_id, 'sender': self.buyer.pk, 'receiver': self.seller.pk, 'listing': None,
+            'conversation': Message.objects.get(pk=message_id).conversation_id, 'read': False,
+        })])
+
+        self.publish.reset_mock()
+        self.client.force_authenticate(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/marketplace/messages/{message_id}/mark_as_read/')
+            self.client.post(f'/api/marketplace/messages/{message_id}/mark_as_read/')
+        self.assertEqual([event[:2] for event in self.published()], [(participants, 'message.read')])
+
+    def test_order_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order_id = Order.objects.create(
+                buyer=self.buyer, listing=self.listing, quantity=2, total_price=50, shipping_address='Tunis'
+            ).pk
+
+        self.client.force_authenticate(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/marketplace/orders/{order_id}/update_status/', {'status': 'ACCEPTED'})
+            self.client.post(f'/api/marketplace/orders/{order_id}/update_status/', {'status': 'ACCEPTED'})
+
+        participants = sorted([self.buyer.pk, self.seller.pk])
+        expected = {
+            'id': order_id, 'listing': self.listing.pk, 'buyer': self.buyer.pk, 'seller': self.seller.pk,
+        }
+        self.assertEqual(self.published(), [
+            (participants, 'order.created', {**expected, 'status': 'PENDING', 'previous_status': None}),
+            (participants, 'order.status_changed', {**expected, 'status': 'ACCEPTED', 'previous_status': 'PENDING'}),
+        ])
+
+    def test_events_wait_for_the_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Message.objects.create(sender=self.buyer, receiver=self.seller, subject='Hi', content='Hello')
+        self.publish.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.publish.call_count, 1)
@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import WasteListingViewSet, OrderViewSet, ReviewViewSet, MessageViewSet
+from .views import WasteListingViewSet, OrderViewSet, ReviewViewSet, MessageViewSet, ConversationViewSet, DashboardViewSet
 
 router = DefaultRouter()
 router.register('listings', WasteListingViewSet)
 router.register('orders', OrderViewSet)
 router.register('reviews', ReviewViewSet)
 router.register('messages', MessageViewSet)
+router.register('conversations', ConversationViewSet, basename='conversation')
+router.register('dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,18 +1,36 @@
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, filters, status
+from rest_framework import viewsets, permissions, filters, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import WasteListing, ListingImage, Order, Review, Message
+from agriwaste_project.asynchronous import AsyncReadMixin
+from agriwaste_project.conditional import ConditionalGetMixin
+from agriwaste_project.events import broker
+from .models import WasteListing, ListingChanged, ListingImage, Order, Review, Message, ConversationParticipant, ArchivedMessage
+from .pagination import ArchiveKeysetPagination, KeysetPagination, MarketplacePagination
+from .search import ListingSearchFilter
+from .facets import get_facets
+from .counters import adjust_message_counts, aget_message_counts, get_message_counts
+from .conversations import recount_unread
+from .reservations import InsufficientQuantity
+from .summaries import aget_summary, get_summary, recount_unread_inquiries
+from .fieldsets import SparseFieldsetViewMixin
 from .serializers import (
+    images_prefetch,
     WasteListingSerializer, 
     WasteListingDetailSerializer,
     ListingImageSerializer,
     OrderSerializer,
     OrderDetailSerializer,
     ReviewSerializer,
-    MessageSerializer
+    MessageSerializer,
+    ConversationSerializer,
+    MarkReadSerializer
 )
-from django.db.models import Q
+from functools import partial
+from django.db import connection, transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from decimal import Decimal
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -50,29 +68,85 @@ class AllowAnyReadOnly(permissions.BasePermission):
         # Require authentication for other methods
         return request.user and request.user.is_authenticated
 
-class WasteListingViewSet(viewsets.ModelViewSet):
+def listing_queryset(detail=False):
+    """
+    Shared queryset for every listing list/retrieve path.
+
+    Images are prefetched primary-first in a single extra query, so a page of
+    listings costs the same number of queries whatever its size. The detail
+    path additionally needs the seller profile and waste type documents.
+    """
+    queryset = WasteListing.objects.select_related('seller', 'waste_type').prefetch_related(images_prefetch())
+    if detail:
+        queryset = queryset.select_related('seller__profile').prefetch_related('waste_type__documents')
+    return queryset
+
+class WasteListingViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = WasteListing.objects.all()
     serializer_class = WasteListingSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = MarketplacePagination
+    filter_backends = [ListingSearchFilter, filters.OrderingFilter]
+    # Only used by the icontains fallback on databases without a full-text index
     search_fields = ['title', 'description', 'location', 'waste_type__name']
-    ordering_fields = ['price', 'created_at', 'available_from']
+    # Each has an index with id as the tiebreaker, for keyset pagination
+    ordering_fields = ['price', 'created_at', 'available_from', 'rating_average', 'rating_count', 'seller_reputation']
+    # Usernames (every user save saves the profile) and waste type names are nested
+    conditional_related = ('seller__profile', 'waste_type')
+    # Served by coroutines under ASGI, see agriwaste_project.asynchronous
+    async_actions = ('list', 'retrieve', 'active', 'by_country')
     
     def get_queryset(self):
-        queryset = WasteListing.objects.select_related('seller', 'waste_type').all()
+        queryset = listing_queryset(detail=self.action == 'retrieve')
+        params = self.request.query_params
         
         # Filter by country if specified
-        country = self.request.query_params.get('country', None)
+        country = params.get('country', None)
         if country:
             queryset = queryset.filter(country=country)
+        
+        # Same filters as the marketplace page, so list and facets agree
+        waste_type = params.get('waste_type', None)
+        if waste_type:
+            queryset = queryset.filter(waste_type_id=self.parse_param('waste_type', waste_type, int))
+        unit = params.get('unit', None)
+        if unit:
+            queryset = queryset.filter(unit=unit)
+        listing_status = params.get('status', None)
+        if listing_status:
+            queryset = queryset.filter(status=listing_status)
+        min_price = params.get('min_price', None)
+        if min_price:
+            queryset = queryset.filter(price__gte=self.parse_param('min_price', min_price, Decimal))
+        max_price = params.get('max_price', None)
+        if max_price:
+            queryset = queryset.filter(price__lte=self.parse_param('max_price', max_price, Decimal))
+        min_reputation = params.get('min_reputation', None)
+        if min_reputation:
+            queryset = queryset.filter(seller_reputation__gte=self.parse_param('min_reputation', min_reputation, Decimal))
             
         return queryset
     
+    def parse_param(self, name, value, parse):
+        try:
+            value = parse(value)
+        except (ValueError, ArithmeticError):
+            raise serializers.ValidationError({name: ["A valid number is required."]})
+        # Decimal('NaN') and Decimal('Infinity') parse, but no column can hold them
+        if isinstance(value, Decimal) and not value.is_finite():
+            raise serializers.ValidationError({name: ["A valid number is required."]})
+        # Ids beyond the database's integer range would overflow when the query runs
+        if isinstance(value, int):
+            low, high = connection.ops.integer_field_range('BigIntegerField')
+            if not low <= value <= high:
+                raise serializers.ValidationError({name: ["A valid number is required."]})
+        return value
+    
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
             permission_classes = [IsOwnerOrReadOnly]
         elif self.action == 'create':
             permission_classes = [permissions.IsAuthenticated]
-        elif self.action in ['list', 'retrieve', 'active', 'by_country']:
+        elif self.action in ['list', 'retrieve', 'active', 'by_country', 'facets']:
             permission_classes = [AllowAnyReadOnly]
         else:
             permission_classes = [permissions.IsAuthenticated]
@@ -91,31 +165,41 @@ class WasteListingViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(seller=self.request.user)
     
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except ListingChanged:
+            raise serializers.ValidationError(
+                "Orders changed this listing's quantity or status meanwhile, reload it and try again"
+            )
+    
     @action(detail=False)
-    def my_listings(self, request):
-        listings = WasteListing.objects.select_related('waste_type').filter(seller=request.user)
-        page = self.paginate_queryset(listings)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(listings, many=True)
-        return Response(serializer.data)
+    def facets(self, request):
+        # Counts per country, waste type, unit, status and price bucket for the current filters
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(get_facets(queryset, request.query_params))
     
     @action(detail=False)
-    def active(self, request):
-        queryset = WasteListing.objects.select_related('seller', 'waste_type').filter(status='ACTIVE')
+    def my_listings(self, request):
+        listings = listing_queryset().filter(seller=request.user)
+        return self.list_response(listings)
+    
+    def get_active_queryset(self):
+        queryset = listing_queryset().filter(status='ACTIVE')
         
         # Filter by country if specified
         country = self.request.query_params.get('country', None)
         if country:
             queryset = queryset.filter(country=country)
             
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return queryset
+    
+    @action(detail=False)
+    def active(self, request):
+        return self.list_response(self.get_active_queryset())
+    
+    async def aactive(self, request):
+        return await self.alist_response(self.get_active_queryset())
     
     @action(detail=False)
     def by_country(self, request):
@@ -123,13 +207,16 @@ class WasteListingViewSet(viewsets.ModelViewSet):
         if not country:
             return Response({"error": "Country parameter is required"}, status=400)
             
-        queryset = WasteListing.objects.select_related('seller', 'waste_type').filter(country=country, status='ACTIVE')
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = listing_queryset().filter(country=country, status='ACTIVE')
+        return self.list_response(queryset)
+    
+    async def aby_country(self, request):
+        country = request.query_params.get('country', None)
+        if not country:
+            return Response({"error": "Country parameter is required"}, status=400)
+            
+        queryset = listing_queryset().filter(country=country, status='ACTIVE')
+        return await self.alist_response(queryset)
     
     @action(detail=True, methods=['post'])
     def upload_image(self, request, pk=None):
@@ -146,11 +233,13 @@ class WasteListingViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = MarketplacePagination
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['created_at', 'status']
+    conditional_related = ('buyer__profile', 'listing')
     
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -164,8 +253,9 @@ class OrderViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.is_staff:
             return Order.objects.select_related('buyer', 'listing', 'listing__seller', 'listing__waste_type').all()
+        # A subquery on the seller's listings keeps both sides of the OR on an index
         return Order.objects.select_related('buyer', 'listing', 'listing__seller', 'listing__waste_type').filter(
-            Q(buyer=user) | Q(listing__seller=user)
+            Q(buyer=user) | Q(listing__in=WasteListing.objects.filter(seller=user).values('pk'))
         )
     
     def get_serializer_class(self):
@@ -176,42 +266,26 @@ class OrderViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         listing = serializer.validated_data.get('listing')
         
-        # Check if the listing is active
-        if listing.status != 'ACTIVE':
-            raise serializers.ValidationError("This listing is not active")
-        
         # Check if the buyer isn't also the seller
         if listing.seller == self.request.user:
             raise serializers.ValidationError("You cannot place an order for your own listing")
         
-        # Calculate total price
-        quantity = serializer.validated_data.get('quantity')
-        total_price = quantity * listing.price
-        
-        serializer.save(
-            buyer=self.request.user,
-            total_price=total_price
-        )
+        # The status, quantity left and price are checked by the reservation
+        # itself (see marketplace.reservations), which also sets total_price
+        try:
+            serializer.save(buyer=self.request.user)
+        except InsufficientQuantity:
+            raise serializers.ValidationError("This listing is not active or does not have enough quantity left")
     
     @action(detail=False)
     def my_orders(self, request):
-        orders = Order.objects.select_related('listing', 'listing__waste_type').filter(buyer=request.user)
-        page = self.paginate_queryset(orders)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        orders = Order.objects.select_related('buyer', 'listing', 'listing__waste_type').filter(buyer=request.user)
+        return self.list_response(orders)
     
     @action(detail=False)
     def my_sales(self, request):
         orders = Order.objects.select_related('buyer', 'listing').filter(listing__seller=request.user)
-        page = self.paginate_queryset(orders)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        return self.list_response(orders)
     
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -238,7 +312,13 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
         
         order.status = new_status
-        order.save()
+        try:
+            order.save()
+        except InsufficientQuantity:
+            return Response(
+                {"detail": "The listing no longer has the quantity of this order"},
+                status=status.HTTP_409_CONFLICT
+            )
         serializer = self.get_serializer(order)
         return Response(serializer.data)
 
@@ -264,9 +344,12 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save()
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(SparseFieldsetViewMixin, ConditionalGetMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    pagination_class = MarketplacePagination
+    async_actions = ('unread', 'counts', 'history')
+    conditional_related = ('sender__profile', 'receiver__profile', 'listing')
     
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -302,26 +385,49 @@ class MessageViewSet(viewsets.ModelViewSet):
             Q(sender=request.user) | Q(receiver=request.user)
         ).order_by('-created_at')
         
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+        return self.list_response(messages)
     
-    @action(detail=False)
-    def unread(self, request):
-        messages = Message.objects.select_related('sender', 'listing').filter(
-            receiver=request.user,
+    def get_history_queryset(self, model=Message):
+        user = self.request.user
+        return model.objects.select_related('sender', 'receiver', 'listing').filter(
+            Q(sender=user) | Q(receiver=user)
+        ).order_by('-created_at', '-id')
+    
+    def get_archive_queryset(self):
+        return self.get_history_queryset(ArchivedMessage)
+    
+    @action(detail=False, pagination_class=ArchiveKeysetPagination)
+    def history(self, request):
+        # Every message of the user, archived ones included, newest first
+        page = self.paginate_queryset(self.get_history_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    async def ahistory(self, request):
+        page = await self.apaginate_queryset(self.get_history_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def get_unread_queryset(self):
+        return Message.objects.select_related('sender', 'receiver', 'listing').filter(
+            receiver=self.request.user,
             read=False
         ).order_by('-created_at')
-        
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+    
+    @action(detail=False)
+    def unread(self, request):
+        return self.list_response(self.get_unread_queryset())
+    
+    async def aunread(self, request):
+        return await self.alist_response(self.get_unread_queryset())
+    
+    @action(detail=False)
+    def counts(self, request):
+        # Badge counts from the per-user counters in marketplace.counters
+        return Response(get_message_counts(request.user.pk))
+    
+    async def acounts(self, request):
+        return Response(await aget_message_counts(request.user.pk))
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -338,3 +444,98 @@ class MessageViewSet(viewsets.ModelViewSet):
         message.save()
         serializer = self.get_serializer(message)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        return self.bulk_mark_read(request, {})
+    
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self.bulk_mark_read(request, serializer.validated_data)
+    
+    def bulk_mark_read(self, request, criteria):
+        """
+        Mark the user's unread messages matching `criteria` (see
+        MarkReadSerializer) as read with a single UPDATE, and return how many
+        changed. Rows are never loaded, so the bookkeeping the save receivers
+        would do happens here instead.
+        """
+        user_id = request.user.pk
+        lookups = {('pk__in' if name == 'ids' else name): value for name, value in criteria.items()}
+        with transaction.atomic():
+            updated = Message.objects.filter(receiver=user_id, read=False, **lookups).update(
+                read=True, updated_at=timezone.now()
+            )
+            if updated:
+                recount_unread(user_id)
+                recount_unread_inquiries(user_id)
+        if updated:
+            transaction.on_commit(partial(adjust_message_counts, {(user_id, 'unread'): -updated}))
+            # Only the receiver is told; per-message read receipts would need the rows
+            transaction.on_commit(partial(broker.publish, [user_id], 'messages.read', {'count': updated, **criteria}))
+        return Response({'updated': updated})
+
+
+class ConversationViewSet(AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The current user's inbox, one entry per conversation with the newest
+    first, and the messages of each conversation. Both are keyset paginated
+    along an index (see marketplace.conversations).
+    """
+    serializer_class = ConversationSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [permissions.IsAuthenticated]
+    # Conversations are looked up through the user's own participant rows
+    lookup_field = 'conversation'
+    lookup_url_kwarg = 'pk'
+    async_actions = ('list', 'messages')
+    
+    def get_queryset(self):
+        memberships = ConversationParticipant.objects.filter(user=self.request.user)
+        if self.action == 'messages':
+            return memberships
+        return memberships.select_related(
+            'conversation', 'conversation__listing', 'conversation__last_message'
+        ).prefetch_related(
+            Prefetch('conversation__participants', queryset=ConversationParticipant.objects.select_related('user'))
+        ).order_by('-last_message_at', '-id')
+    
+    def get_thread_queryset(self, model=Message):
+        return model.objects.select_related('sender', 'receiver', 'listing').filter(
+            conversation=self.membership.conversation_id
+        ).order_by('-created_at', '-id')
+    
+    def get_archive_queryset(self):
+        return self.get_thread_queryset(ArchivedMessage)
+    
+    # Threads reach back into archived messages, see marketplace.archive
+    @action(detail=True, pagination_class=ArchiveKeysetPagination)
+    def messages(self, request, pk=None):
+        self.membership = self.get_object()
+        page = self.paginate_queryset(self.get_thread_queryset())
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+    
+    async def amessages(self, request, pk=None):
+        self.membership = await self.aget_object()
+        page = await self.apaginate_queryset(self.get_thread_queryset())
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+class DashboardViewSet(AsyncReadMixin, viewsets.ViewSet):
+    """
+    The current user's seller dashboard, read from their running totals
+    (see marketplace.summaries) rather than from their orders and listings.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    async_actions = ('summary',)
+    
+    @action(detail=False)
+    def summary(self, request):
+        return Response(get_summary(request.user.pk))
+    
+    async def asummary(self, request):
+        return Response(await aget_summary(request.user.pk))
@@ -0,0 +1,134 @@
+"""
+Token authentication with a cached token -> user lookup.
+
+`CachedTokenAuthentication` is a drop-in replacement for DRF's
+`TokenAuthentication`. Resolved tokens are kept in an in-process LRU with a
+TTL, and optionally in a shared Django cache so that other workers can reuse
+them. Entries are dropped when their token is deleted or their user is
+saved, for example when deactivated, by the receivers in `users.models`. The
+TTL bounds how long another worker's local copy can outlive such a change.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    # Alias of a shared cache in CACHES (e.g. Redis/Memcached), or None for local only
+    'SHARED_CACHE': None,
+}
+
+
+class TokenCache:
+    """
+    Token key -> Token (with its user) lookups. Entries are copied in and out,
+    so a request mutating `request.user` never touches the cached instance.
+    """
+    def __init__(self, max_size, ttl, shared_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('local_hits', 'shared_hits', 'misses', 'evictions', 'invalidations'), 0
+        )
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+        return cls(options['MAX_SIZE'], options['TTL'], options['SHARED_CACHE'])
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    @staticmethod
+    def shared_key(key):
+        # Never use raw credentials as cache keys
+        return 'auth:token:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, token = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['local_hits'] += 1
+                    return copy.deepcopy(token)
+                del self._entries[key]
+
+        if self.shared is not None:
+            token = self.shared.get(self.shared_key(key))
+            if token is not None:
+                self._count('shared_hits')
+                self._store_local(key, copy.deepcopy(token))
+                return token
+
+        self._count('misses')
+        return None
+
+    def set(self, key, token):
+        self._store_local(key, copy.deepcopy(token))
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), token, self.ttl)
+
+    def _store_local(self, key, token):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._counters['invalidations'] += len(keys)
+        if self.shared is not None and keys:
+            self.shared.delete_many([self.shared_key(key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), max_size=self.max_size, ttl=self.ttl)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+token_cache = TokenCache.from_settings()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        token = self.cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            self.cache.set(key, token)
+            return (user, token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (token.user, token)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='reputation_score',
+            field=models.DecimalField(decimal_places=2, default=50, editable=False, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='reputation_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
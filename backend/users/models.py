@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
 
 class UserProfile(models.Model):
     USER_TYPES = (
@@ -26,11 +29,26 @@ class UserProfile(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     profile_image = models.ImageField(upload_to='profile_images/', blank=True, null=True)
     country = models.CharField(max_length=2, choices=COUNTRY_CHOICES, blank=True, null=True)
+    # Seller reputation from 0 to 100, computed by marketplace.reputation
+    reputation_score = models.DecimalField(max_digits=5, decimal_places=2, default=50, editable=False)
+    reputation_updated_at = models.DateTimeField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    REPUTATION_FIELDS = ('reputation_score', 'reputation_updated_at')
     
     def __str__(self):
         return f"{self.user.username}'s profile - {self.user_type}"
+
+    def save(self, *args, **kwargs):
+        # Every user save also saves the profile; leave out the reputation, which
+        # only marketplace.reputation writes, so a stale copy is never written back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.REPUTATION_FIELDS
+            ]
+        super().save(*args, **kwargs)
         
     class Meta:
         ordering = ['-created_at']
@@ -43,3 +61,19 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    key = instance.key  # cleared on the instance once the delete completes
+    transaction.on_commit(lambda: token_cache.invalidate(key), using=kwargs['using'])
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, created, using, update_fields=None, **kwargs):
+    # Cached tokens carry a copy of the user, so any change other than a login
+    # (deactivation, staff flag, password) drops them
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    # Evicting after commit keeps a concurrent request from re-caching the old row
+    keys = list(Token.objects.using(using).filter(user=instance).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(*keys), using=using)
@@ -6,7 +6,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['id', 'user_type', 'organization', 'bio', 'address', 
-                 'phone_number', 'profile_image', 'country', 'created_at', 'updated_at']
+                 'phone_number', 'profile_image', 'country', 'reputation_score', 'reputation_updated_at',
+                 'created_at', 'updated_at']
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True)
@@ -1,3 +1,106 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        cache.clear()
+        self.user = User.objects.create(username='farmer', email='farmer@example.com')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/me/')
+        auth_queries = [q for q in context.captured_queries if 'authtoken_token' in q['sql']]
+        return response, auth_queries
+
+    def test_second_request_skips_token_query(self):
+        before = token_cache.stats()
+        response, auth_queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(auth_queries), 1)
+
+        response, auth_queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'farmer')
+        self.assertEqual(auth_queries, [])
+
+        after = token_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['local_hits'] - before['local_hits'], 1)
+
+    def test_deleted_token_is_evicted(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_is_evicted(self):
+        self.get_me()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_does_not_evict(self):
+        self.get_me()
+        self.user.save(update_fields=['last_login'])
+        _, auth_queries = self.get_me()
+        self.assertEqual(auth_queries, [])
+
+    def test_cached_user_is_a_copy(self):
+        authentication = CachedTokenAuthentication()
+        user, _ = authentication.authenticate_credentials(self.token.key)
+        user.first_name = 'Changed'
+        user, _ = authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.first_name, '')
+
+    def test_shared_tier_is_used_by_other_workers(self):
+        worker_a = TokenCache(max_size=10, ttl=60, shared_alias='default')
+        worker_b = TokenCache(max_size=10, ttl=60, shared_alias='default')
+        worker_a.set(self.token.key, Token.objects.select_related('user').get(pk=self.token.pk))
+
+        token = worker_b.get(self.token.key)
+        self.assertEqual(token.user.username, 'farmer')
+        self.assertEqual(worker_b.stats()['shared_hits'], 1)
+
+        worker_a.invalidate(self.token.key)
+        self.assertIsNone(TokenCache(max_size=10, ttl=60, shared_alias='default').get(self.token.key))
+
+    def test_lru_and_ttl_bounds(self):
+        tokens = TokenCache(max_size=2, ttl=60)
+        tokens.set('a', self.token)
+        tokens.set('b', self.token)
+        tokens.get('a')
+        tokens.set('c', self.token)
+        self.assertIsNone(tokens.get('b'))
+        self.assertIsNotNone(tokens.get('a'))
+        self.assertEqual(tokens.stats()['evictions'], 1)
+
+        with mock.patch('users.authentication.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(tokens.get('a'))
+
+    def test_stats_endpoint_is_staff_only(self):
+        response = self.client.get('/api/users/auth_cache_stats/')
+        self.assertEqual(response.status_code, 403)
 
-# Create your tests here.
+        self.user.is_staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get('/api/users/auth_cache_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.data)
@@ -3,9 +3,10 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth.models import User
+from .authentication import token_cache
 from .models import UserProfile
 from .serializers import UserSerializer, UserUpdateSerializer, UserProfileSerializer
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -14,6 +15,8 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action == 'create':
             permission_classes = [AllowAny]
+        elif self.action == 'auth_cache_stats':
+            permission_classes = [IsAdminUser]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
@@ -36,6 +39,11 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def auth_cache_stats(self, request):
+        # Hit/miss counters of this worker's token cache
+        return Response(token_cache.stats())
+    
     def list(self, request, *args, **kwargs):
         # Only admin users can list all users
         if not request.user.is_staff:
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WasteCatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'waste_catalog'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,105 @@
+"""
+Response cache for the public waste catalog.
+
+The catalog only changes when an admin edits it, so serialized list,
+retrieve and by_category responses are cached until then. Cache keys embed
+a catalog version counter that the signal handlers in
+`waste_catalog.signals` bump whenever a category, waste type or document is
+saved or deleted. Old entries are never read again and simply expire.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from agriwaste_project.conditional import ConditionalGetMixin
+
+VERSION_KEY = 'waste_catalog:version'
+
+
+def get_catalog_version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+async def aget_catalog_version():
+    return await cache.aget_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+class CatalogCacheMixin:
+    """
+    Serve cached `response.data` for safe catalog reads.
+
+    Only the serialized data is cached, so content negotiation still picks
+    the renderer per request.
+    """
+    cached_actions = ('list', 'retrieve', 'by_category')
+
+    def get_catalog_cache_key(self, request, version=None):
+        params = '&'.join(
+            f"{name}={','.join(sorted(request.query_params.getlist(name)))}"
+            for name in sorted(request.query_params.keys())
+        )
+        # File and image URLs are absolute, so the host is part of the response
+        base = request.build_absolute_uri('/')
+        digest = hashlib.sha1(f'{base}|{self.kwargs}|{params}'.encode('utf-8')).hexdigest()
+        if version is None:
+            version = get_catalog_version()
+        return f'waste_catalog:{version}:{self.basename}:{self.action}:{digest}'
+
+    def cached_response(self, request, build_response):
+        if request.method not in ('GET', 'HEAD') or self.action not in self.cached_actions:
+            return build_response()
+
+        key = self.get_catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = build_response()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, getattr(settings, 'WASTE_CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+        return response
+
+    async def acached_response(self, request, build_response):
+        if request.method not in ('GET', 'HEAD') or self.action not in self.cached_actions:
+            return await build_response()
+
+        key = self.get_catalog_cache_key(request, version=await aget_catalog_version())
+        data = await cache.aget(key)
+        if data is not None:
+            return Response(data)
+
+        response = await build_response()
+        if response.status_code == status.HTTP_200_OK:
+            await cache.aset(key, response.data, getattr(settings, 'WASTE_CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(request, lambda: super(CatalogCacheMixin, self).alist(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
+
+
+class CatalogConditionalGetMixin(ConditionalGetMixin):
+    """
+    Conditional GET keyed on the catalog version, so a 304 costs no query
+    and nested waste type or document edits also change the ETag.
+    """
+    def get_conditional_validator(self, queryset):
+        return get_catalog_version(), None
+
+    async def aget_conditional_validator(self, queryset):
+        return await aget_catalog_version(), None
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from waste_catalog.snapshot import build_snapshot, snapshot_dir
+
+
+class Command(BaseCommand):
+    help = 'Writes the versioned, precompressed waste catalog snapshot served at /api/waste-catalog/snapshot/'
+
+    def handle(self, *args, **options):
+        manifest = build_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Catalog snapshot {manifest['version']} ({manifest['size']} bytes, "
+            f"{', '.join(sorted(manifest['files']))}) written to {snapshot_dir()}"
+        ))
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .snapshot import schedule_rebuild
+from .models import WasteCategory, WasteType, ResourceDocument
+
+
+@receiver(post_save, sender=WasteCategory)
+@receiver(post_delete, sender=WasteCategory)
+@receiver(post_save, sender=WasteType)
+@receiver(post_delete, sender=WasteType)
+@receiver(post_save, sender=ResourceDocument)
+@receiver(post_delete, sender=ResourceDocument)
+def invalidate_catalog_cache(sender, instance, using='default', **kwargs):
+    transaction.on_commit(bump_catalog_version, using=using)
+    schedule_rebuild(using=using)
@@ -0,0 +1,116 @@
+"""
+Precomputed, versioned snapshot of the whole waste catalog.
+
+`build_snapshot()` serializes every category with its waste types and their
+documents into one JSON file. It also writes gzip and (when the `brotli`
+package is installed) brotli encoded copies, so the snapshot view can stream
+bytes from disk without touching the ORM or the serializers. The version is
+a hash of the JSON content and doubles as the strong ETag. `current.json` in
+the snapshot directory points at the live version and is replaced
+atomically.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from .models import WasteCategory
+from .serializers import WasteCategorySerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'current.json'
+
+# Content-Encoding -> file suffix, in server preference order
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_last_build = {}
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'WASTE_CATALOG_SNAPSHOT_DIR', settings.BASE_DIR / 'var' / 'catalog'))
+
+
+def render_catalog():
+    categories = WasteCategory.objects.prefetch_related('waste_types__documents').order_by('id')
+    data = {'categories': WasteCategorySerializer(categories, many=True).data}
+    return JSONRenderer().render(data)
+
+
+def write_atomic(path, content):
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(keep=2):
+    """
+    Write the snapshot files and point the manifest at them.
+
+    Returns the manifest. Rebuilding an unchanged catalog is a no-op apart
+    from rewriting identical files.
+    """
+    directory = snapshot_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+
+    content = render_catalog()
+    version = hashlib.sha256(content).hexdigest()[:20]
+    name = f'catalog-{version}.json'
+
+    files = {'identity': name}
+    write_atomic(directory / name, content)
+    write_atomic(directory / f'{name}.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    files['gzip'] = f'{name}.gz'
+    if brotli is not None:
+        write_atomic(directory / f'{name}.br', brotli.compress(content, quality=11))
+        files['br'] = f'{name}.br'
+
+    manifest = {'version': version, 'size': len(content), 'files': files}
+    write_atomic(directory / MANIFEST_NAME, json.dumps(manifest).encode('utf-8'))
+    prune_snapshots(directory, keep)
+    return manifest
+
+
+def prune_snapshots(directory, keep):
+    # Keep the newest versions around for requests that already read the previous manifest
+    snapshots = sorted(directory.glob('catalog-*.json'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in snapshots[keep:]:
+        for suffix in ('', '.gz', '.br'):
+            Path(f'{path}{suffix}').unlink(missing_ok=True)
+
+
+def load_manifest():
+    try:
+        return json.loads((snapshot_dir() / MANIFEST_NAME).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def schedule_rebuild(using='default'):
+    """
+    Rebuild the snapshot once the current transaction commits.
+
+    A transaction that touches many catalog rows queues one callback per row;
+    any callback queued before the last build already saw its changes and is
+    skipped, so the snapshot is rebuilt once per commit.
+    """
+    if not getattr(settings, 'WASTE_CATALOG_SNAPSHOT_AUTO_REBUILD', True):
+        return
+    scheduled_at = time.monotonic()
+
+    def rebuild():
+        if _last_build.get('at', float('-inf')) >= scheduled_at:
+            return
+        _last_build['at'] = time.monotonic()
+        build_snapshot()
+
+    transaction.on_commit(rebuild, using=using)
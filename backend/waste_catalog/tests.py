@@ -1,3 +1,142 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .models import WasteCategory, WasteType, ResourceDocument
+from .snapshot import build_snapshot
+
+
+@override_settings(WASTE_CATALOG_SNAPSHOT_AUTO_REBUILD=False)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = WasteCategory.objects.create(name='Fruit waste')
+        self.waste_type = WasteType.objects.create(category=self.category, name='Orange peels')
+        ResourceDocument.objects.create(
+            waste_type=self.waste_type, title='Pectin extraction', document_type='GUIDE',
+            file='documents/pectin.pdf',
+        )
+
+    def test_cached_reads_cost_no_queries(self):
+        for url in (
+            '/api/waste-catalog/categories/',
+            f'/api/waste-catalog/categories/{self.category.pk}/',
+            '/api/waste-catalog/types/',
+            f'/api/waste-catalog/types/{self.waste_type.pk}/',
+            f'/api/waste-catalog/types/by_category/?category_id={self.category.pk}',
+            '/api/waste-catalog/documents/',
+        ):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.data, first.data)
+
+    def test_conditional_get_uses_catalog_version(self):
+        url = '/api/waste-catalog/types/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            ResourceDocument.objects.all().delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(ROOT_URLCONF='agriwaste_project.urls_async', ALLOWED_HOSTS=['testserver'])
+    def test_async_lists_share_the_cache(self):
+        for url in ('/api/waste-catalog/categories/', '/api/waste-catalog/types/', '/api/waste-catalog/documents/'):
+            response = async_to_sync(self.async_client.get)(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                cached = self.client.get(url)
+            self.assertEqual(cached.json(), response.json())
+            etag = response['ETag']
+            with self.assertNumQueries(0):
+                response = async_to_sync(self.async_client.get)(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_query_count_does_not_grow_with_catalog(self):
+        for i in range(5):
+            WasteType.objects.create(category=self.category, name=f'Type {i}')
+        with self.assertNumQueries(4):
+            self.client.get('/api/waste-catalog/categories/')
+
+    def test_query_params_are_part_of_the_key(self):
+        WasteCategory.objects.create(name='Crop residue')
+        response = self.client.get('/api/waste-catalog/categories/', {'search': 'crop'})
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get('/api/waste-catalog/categories/')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_edits_invalidate_cache(self):
+        self.client.get('/api/waste-catalog/types/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waste_type.name = 'Lemon peels'
+            self.waste_type.save()
+        response = self.client.get('/api/waste-catalog/types/')
+        self.assertEqual(response.data['results'][0]['name'], 'Lemon peels')
+
+    def test_document_delete_invalidates_categories(self):
+        self.client.get('/api/waste-catalog/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            ResourceDocument.objects.all().delete()
+        response = self.client.get('/api/waste-catalog/categories/')
+        self.assertEqual(response.data['results'][0]['waste_types'][0]['documents'], [])
+
+
+class CatalogSnapshotTests(TestCase):
+    url = '/api/waste-catalog/snapshot/'
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        override = override_settings(WASTE_CATALOG_SNAPSHOT_DIR=Path(self.tmpdir.name))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        category = WasteCategory.objects.create(name='Fruit waste')
+        WasteType.objects.create(category=category, name='Orange peels')
+        build_snapshot()
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_serves_snapshot_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(self.read(response))
+        self.assertEqual(data['categories'][0]['waste_types'][0]['name'], 'Orange peels')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_revalidation_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_serves_precompressed_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(self.read(response)))
+        self.assertEqual(len(data['categories']), 1)
+        # The identity ETag of the same version still validates the gzip representation
+        identity_etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=identity_etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_change_rebuilds_snapshot(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            WasteCategory.objects.create(name='Crop residue')
+            WasteCategory.objects.create(name='Animal manure')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(self.read(response))['categories']), 3)
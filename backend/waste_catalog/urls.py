@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import WasteCategoryViewSet, WasteTypeViewSet, ResourceDocumentViewSet
+from .views import WasteCategoryViewSet, WasteTypeViewSet, ResourceDocumentViewSet, catalog_snapshot
 
 router = DefaultRouter()
 router.register('categories', WasteCategoryViewSet)
@@ -8,5 +8,6 @@ router.register('types', WasteTypeViewSet)
 router.register('documents', ResourceDocumentViewSet)
 
 urlpatterns = [
+    path('snapshot/', catalog_snapshot, name='catalog-snapshot'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
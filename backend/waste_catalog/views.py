@@ -1,8 +1,15 @@
 from django.shortcuts import render
+from django.http import FileResponse, HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from agriwaste_project.asynchronous import AsyncReadMixin
+from agriwaste_project.compression import accepted_encodings
 from .models import WasteCategory, WasteType, ResourceDocument
+from .cache import CatalogCacheMixin, CatalogConditionalGetMixin
+from .snapshot import ENCODINGS, build_snapshot, load_manifest, snapshot_dir
 from .serializers import (
     WasteCategorySerializer, 
     WasteTypeSerializer, 
@@ -27,8 +34,9 @@ class AllowAnyReadOnly(permissions.BasePermission):
 
 # Create your views here.
 
-class WasteCategoryViewSet(viewsets.ModelViewSet):
+class WasteCategoryViewSet(CatalogConditionalGetMixin, CatalogCacheMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = WasteCategory.objects.all()
+    async_actions = ('list',)
     serializer_class = WasteCategorySerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
@@ -45,11 +53,12 @@ class WasteCategoryViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Optimize by prefetching related waste types when listing categories
         if self.action == 'retrieve' or self.action == 'list':
-            return WasteCategory.objects.prefetch_related('waste_types').all()
+            return WasteCategory.objects.prefetch_related('waste_types__documents').all()
         return WasteCategory.objects.all()
 
-class WasteTypeViewSet(viewsets.ModelViewSet):
+class WasteTypeViewSet(CatalogConditionalGetMixin, CatalogCacheMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = WasteType.objects.all()
+    async_actions = ('list',)
     serializer_class = WasteTypeSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'potential_uses', 'category__name']
@@ -72,19 +81,28 @@ class WasteTypeViewSet(viewsets.ModelViewSet):
         # Optimize by selecting related category and prefetching documents
         if self.action == 'retrieve':
             return WasteType.objects.select_related('category').prefetch_related('documents').all()
-        return WasteType.objects.select_related('category').all()
+        return WasteType.objects.select_related('category').prefetch_related('documents').all()
     
     @action(detail=False)
     def by_category(self, request):
         category_id = request.query_params.get('category_id')
         if category_id:
-            waste_types = WasteType.objects.select_related('category').filter(category_id=category_id)
-            serializer = self.get_serializer(waste_types, many=True)
-            return Response(serializer.data)
+            not_modified = self.check_not_modified(request, None)
+            if not_modified is not None:
+                return not_modified
+
+            def build_response():
+                waste_types = WasteType.objects.select_related('category').prefetch_related('documents').filter(
+                    category_id=category_id
+                )
+                serializer = self.get_serializer(waste_types, many=True)
+                return Response(serializer.data)
+            return self.cached_response(request, build_response)
         return Response({"error": "Category ID is required"}, status=400)
 
-class ResourceDocumentViewSet(viewsets.ModelViewSet):
+class ResourceDocumentViewSet(CatalogConditionalGetMixin, CatalogCacheMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = ResourceDocument.objects.all()
+    async_actions = ('list',)
     serializer_class = ResourceDocumentSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'author', 'description', 'waste_type__name']
@@ -101,3 +119,42 @@ class ResourceDocumentViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Optimize by selecting related waste_type
         return ResourceDocument.objects.select_related('waste_type').all()
+
+
+def catalog_snapshot(request):
+    """
+    Serve the precomputed catalog snapshot straight from disk.
+
+    Each encoding gets its own strong ETag derived from the snapshot version;
+    a client presenting any of them for the current version gets a 304.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    manifest = load_manifest()
+    if manifest is None:
+        # First request before the snapshot command ever ran
+        manifest = build_snapshot()
+
+    version = manifest['version']
+    files = manifest['files']
+    accepted = accepted_encodings(request)
+    encoding = next(
+        (name for name, _ in ENCODINGS if name in files and name in accepted),
+        'identity',
+    )
+    etag = f'"{version}"' if encoding == 'identity' else f'"{version}-{encoding}"'
+    current_etags = {f'"{version}"'} | {f'"{version}-{name}"' for name in files}
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or current_etags & set(parse_etags(if_none_match))):
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(open(snapshot_dir() / files[encoding], 'rb'), content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response